@@ -0,0 +1,37 @@
+import numpy as np
+
+from PacketCodec import IMU_SCALE, IMU_STRUCT, PACKET_SIZE
+
+# Constants
+IMU_AXES = ("x1", "y1", "z1", "x2", "y2", "z2")
+P1_IMU = 2  # PacketType.P1_IMU
+P2_IMU = 5  # PacketType.P2_IMU
+
+# Layout of a 20-byte IMU packet, the first 12 bytes of data hold the axes (PacketCodec.IMU_STRUCT)
+IMU_PACKET_DTYPE = np.dtype([
+    ("packet_id", "u1"),
+    ("seq_num", "<u2"),
+    ("imu", "<i2", (len(IMU_AXES),)),
+    ("unused", "u1", (PACKET_SIZE - 4 - IMU_STRUCT.size,)),
+    ("crc", "u1"),
+])
+assert IMU_PACKET_DTYPE.itemsize == PACKET_SIZE
+
+
+def decodeImuBuffer(buffer):
+    """
+    Decode the consecutive 20-byte IMU packets of a buffer in one vectorized call
+    Returns the packet ids, the sequence numbers and a float32 array of shape (n, 6) of the axes
+    """
+    packets = np.frombuffer(buffer, dtype=IMU_PACKET_DTYPE, count=len(buffer) // PACKET_SIZE)
+    return packets["packet_id"], packets["seq_num"], packets["imu"] * np.float32(1 / IMU_SCALE)
+
+
+def decodeImuPackets(packets):
+    """ decodeImuBuffer of a list of packets (bytes or memoryviews) """
+    return decodeImuBuffer(b"".join(packets))
+
+
+def splitPlayers(packetIds, values):
+    """ The rows of values of player 1 and of player 2 """
+    return values[packetIds == P1_IMU], values[packetIds == P2_IMU]
@@ -0,0 +1,194 @@
+import queue
+import threading
+
+import numpy as np
+
+from ImuDecoder import IMU_AXES, P1_IMU, P2_IMU, decodeImuPackets
+from PacketCodec import PACKET_SIZE
+
+# Constants
+CAPACITY = 256          # samples kept per sensor, at least MAX_SAMPLES + PREROLL
+WINDOW_LENGTH = 50      # samples of an emitted window, actions are resampled to it
+START_THRESHOLD = 4.0   # motion energy starting an action
+END_THRESHOLD = 1.0     # motion energy below which the sensor is quiet
+QUIET_SAMPLES = 10      # consecutive quiet samples ending an action
+MIN_SAMPLES = 10        # shorter actions are dropped as noise
+MAX_SAMPLES = 150       # longer actions are cut
+PREROLL = 5             # samples before the start of an action included in its window
+MAX_BATCH = 256         # packets taken from the input queue at once
+QUEUE_TIMEOUT = 0.25
+PLAYER_OF_SENSOR = {P1_IMU: 1, P2_IMU: 2}
+
+
+def motionEnergy(previous, values):
+    """ Sum of the squared differences of the axes between consecutive samples, gravity does not count """
+    diff = np.diff(values, axis = 0, prepend = previous[np.newaxis])
+    return np.einsum("ij,ij->i", diff, diff)
+
+
+def resample(samples, length = WINDOW_LENGTH):
+    """ The samples linearly interpolated to length rows """
+    positions = np.linspace(0, len(samples) - 1, length, dtype = np.float32)
+    low = positions.astype(np.intp)
+    high = np.minimum(low + 1, len(samples) - 1)
+    frac = (positions - low)[:, np.newaxis]
+    return samples[low] * (1 - frac) + samples[high] * frac
+
+
+def extractFeatures(samples):
+    """ Mean, standard deviation, min and max of every axis, followed by the number of samples """
+    return np.concatenate((samples.mean(axis = 0), samples.std(axis = 0), samples.min(axis = 0),
+                           samples.max(axis = 0), [len(samples)]))
+
+
+class ImuWindow:
+    """
+    Circular NumPy buffer of the IMU samples of one sensor, cutting the stream into actions.
+    An action starts when the motion energy goes above START_THRESHOLD and ends after QUIET_SAMPLES
+    samples below END_THRESHOLD (or MAX_SAMPLES samples); the energy is computed for a whole
+    batch at once and Python only runs per action start and end
+    """
+
+    def __init__(self, capacity = CAPACITY, startThreshold = START_THRESHOLD, endThreshold = END_THRESHOLD,
+                 quietSamples = QUIET_SAMPLES, minSamples = MIN_SAMPLES, maxSamples = MAX_SAMPLES,
+                 preroll = PREROLL):
+        assert capacity >= maxSamples + preroll
+        self.capacity = capacity
+        self.startThreshold = startThreshold
+        self.endThreshold = endThreshold
+        self.quietSamples = quietSamples
+        self.minSamples = minSamples
+        self.maxSamples = maxSamples
+        self.preroll = preroll
+        self.samples = np.zeros((capacity, len(IMU_AXES)), dtype = np.float32)
+        self.total = 0              # samples added so far, the index of the next sample
+        self.actionStart = None     # index of the first sample of the current action
+        self.quietRun = 0           # consecutive quiet samples at the end of the buffer
+        # Statistics
+        self.numActions = 0
+        self.numDropped = 0         # actions shorter than minSamples
+
+    def add(self, values):
+        """ Add a batch of samples (n, 6), returns the (samples, 6) arrays of the actions which ended """
+        actions = []
+        if len(values) == 0:
+            return actions
+        previous = self.samples[(self.total - 1) % self.capacity] if self.total > 0 else values[0]
+        energy = motionEnergy(previous, values)
+        base = self.total
+        # Samples are added in chunks which never overwrite the start of the current action
+        offset = 0
+        while offset < len(values):
+            length = min(len(values) - offset, self.capacity - self.maxSamples - self.preroll + 1)
+            self.store(values[offset:offset + length])
+            actions.extend(self.detect(energy[offset:offset + length], base + offset))
+            offset += length
+        return actions
+
+    def store(self, values):
+        index = self.total % self.capacity
+        first = min(len(values), self.capacity - index)
+        self.samples[index:index + first] = values[:first]
+        self.samples[:len(values) - first] = values[first:]
+        self.total += len(values)
+
+    def detect(self, energy, base):
+        """ Find the starts and ends of actions in the energy of the samples base, base + 1, ... """
+        actions = []
+        quiet = energy < self.endThreshold
+        # Consecutive quiet samples ending at every index, counting the run before the batch
+        count = np.cumsum(quiet)
+        lastNoisy = np.maximum.accumulate(np.where(quiet, 0, count))
+        seenNoisy = np.logical_or.accumulate(~quiet)
+        runs = count - lastNoisy + np.where(seenNoisy, 0, self.quietRun)
+        self.quietRun = int(runs[-1])
+
+        i = 0
+        while i < len(energy):
+            if self.actionStart is None:
+                above = np.flatnonzero(energy[i:] > self.startThreshold)
+                if len(above) == 0:
+                    break
+                i += int(above[0])
+                self.actionStart = base + i
+            # The action ends at the first quiet run long enough, or at maxSamples
+            limit = self.actionStart + self.maxSamples - 1 - base
+            ends = np.flatnonzero(runs[i:] >= self.quietSamples)
+            end = i + int(ends[0]) if len(ends) > 0 else len(energy)
+            if limit < end:
+                end = limit
+            if end >= len(energy):
+                break
+            actions.extend(self.emit(self.actionStart, base + end + 1 - (0 if end == limit else self.quietSamples)))
+            self.actionStart = None
+            i = end + 1
+        return actions
+
+    def emit(self, start, stop):
+        """ The samples of the action start to stop (excluded), with the preroll """
+        if stop - start < self.minSamples:
+            self.numDropped += 1
+            return []
+        self.numActions += 1
+        first = max(start - self.preroll, self.total - self.capacity, 0)
+        return [self.samples[np.arange(first, stop) % self.capacity]]
+
+
+class ImuWindowStage(threading.Thread):
+    """
+    Stage between the Beetle threads and RelayClient: IMU packets are decoded in batches and cut into
+    actions per sensor, one message per action is put on the output queue instead of one per sample.
+    Other items of the input queue are passed on unchanged
+    """
+
+    def __init__(self, inputQueue, outputQueue, emitWindows = False, **windowOptions):
+        super().__init__()
+        self.inputQueue = inputQueue
+        self.outputQueue = outputQueue
+        self.emitWindows = emitWindows   # fixed length windows of samples instead of feature vectors
+        self.windows = {sensor: ImuWindow(**windowOptions) for sensor in PLAYER_OF_SENSOR}
+        self.numPackets = 0
+        self.numMessages = 0
+        self.terminateEvent = threading.Event()
+
+    def isImuPacket(self, item):
+        return isinstance(item, (bytes, bytearray)) and len(item) == PACKET_SIZE and item[0] in PLAYER_OF_SENSOR
+
+    def process(self, items):
+        """ Handle a batch of items of the input queue """
+        packets = []
+        for item in items:
+            if self.isImuPacket(item):
+                packets.append(item)
+            else:
+                self.outputQueue.put(item)
+        if not packets:
+            return
+        self.numPackets += len(packets)
+        packetIds, _, values = decodeImuPackets(packets)
+        for sensor, window in self.windows.items():
+            for samples in window.add(values[packetIds == sensor]):
+                self.outputQueue.put(self.makeMessage(PLAYER_OF_SENSOR[sensor], samples))
+                self.numMessages += 1
+
+    def makeMessage(self, playerId, samples):
+        if self.emitWindows:
+            return {'playerID': playerId, 'window': np.round(resample(samples), 2).tolist()}
+        return {'playerID': playerId, 'features': np.round(extractFeatures(samples), 3).tolist()}
+
+    def run(self):
+        while not self.terminateEvent.is_set():
+            try:
+                items = [self.inputQueue.get(timeout = QUEUE_TIMEOUT)]
+            except queue.Empty:
+                continue
+            try:
+                while len(items) < MAX_BATCH:
+                    items.append(self.inputQueue.get_nowait())
+            except queue.Empty:
+                pass
+            self.process(items)
+
+    def quit(self):
+        print("IMU windows: {} packets, {} messages".format(self.numPackets, self.numMessages))
+        self.terminateEvent.set()
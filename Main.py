@@ -4,6 +4,7 @@ import socket
 import sys 
 from thread_connect import PacketType,bcolors,BlePacketDelegate,Beetle
 from RelayClient import RelayClient
+from ImuWindow import ImuWindowStage
 # Constants
 
 BLUNO_MAC_ADDR_LIST = [
@@ -25,6 +26,7 @@ if __name__ == "__main__":
         
     ipaddress = sys.argv[1]
     port = int(sys.argv[2])
+    ble_to_window_queue = queue.Queue()
     ble_to_relay_queue = queue.Queue()
     
     beetles = []
@@ -32,18 +34,23 @@ if __name__ == "__main__":
     try:
         index = 0
         for beetle_addr in BLUNO_MAC_ADDR_LIST:
-            thisBeetle = Beetle(ble_to_relay_queue,beetle_addr, colors[index])
+            thisBeetle = Beetle(ble_to_window_queue,beetle_addr, colors[index])
             thisBeetle.start()
             beetles.append(thisBeetle)
             index += 1
+        # one message per action instead of one per IMU sample
+        imu_stage = ImuWindowStage(ble_to_window_queue,ble_to_relay_queue)
+        imu_stage.start()
         relay_client = RelayClient(ipaddress,port,ble_to_relay_queue)
         relay_client.start()
         for thisBeetle in beetles:
             thisBeetle.join()
+        imu_stage.join()
         relay_client.join()
 
     except KeyboardInterrupt as err:
         for mBeetle in beetles:
             mBeetle.quit()
+        imu_stage.quit()
         relay_client.quit()
         sys.exit(0)
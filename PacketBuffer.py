@@ -0,0 +1,125 @@
+import re
+
+# Constants
+DEFAULT_CAPACITY = 4096
+DEFAULT_HEADER_BYTES = range(0, 9)  # PacketType.HELLO to PacketType.GAME_STAT
+
+
+class PacketRingBuffer:
+    """
+    Preallocated ring buffer reassembling the fixed size packets of a Beetle from BLE notifications.
+    Notifications are copied in with slice copies and complete packets are read out as memoryviews,
+    there is no per-byte Python work. A packet is taken only if it starts with a header byte and
+    isValidPacket (e.g. the CRC check) accepts it, else the buffer skips to the next header byte.
+
+    Not thread safe: bluepy calls handleNotification from waitForNotifications, in the Beetle thread
+    which also reads the packets.
+    """
+
+    def __init__(self, packetSize, isValidPacket=None, capacity=DEFAULT_CAPACITY, headerBytes=DEFAULT_HEADER_BYTES):
+        self.packetSize = packetSize
+        self.isValidPacket = isValidPacket
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # index of the first byte
+        self.size = 0   # number of bytes in the buffer
+        # a packet wrapping around the end of the buffer is copied here to be returned in one piece
+        self.scratch = bytearray(packetSize)
+        self.scratchView = memoryview(self.scratch)
+        self.headerPattern = re.compile(b"[" + b"".join(re.escape(bytes([b])) for b in headerBytes) + b"]")
+        self.isHeader = bytes(b in headerBytes for b in range(256))  # lookup table indexed by the byte
+        # Statistics
+        self.droppedBytes = 0   # skipped to resynchronize on a header byte
+        self.invalidPackets = 0 # rejected by isValidPacket
+        self.overflowBytes = 0  # oldest bytes overwritten when the buffer was full
+
+    def __len__(self):
+        return self.size
+
+    def clear(self):
+        self.start = 0
+        self.size = 0
+
+    def write(self, data):
+        """ Add the bytes of a notification """
+        length = len(data)
+        capacity = self.capacity
+        if self.size + length > capacity:
+            if length > capacity:
+                self.overflowBytes += length - capacity
+                data = memoryview(data)[length - capacity:]
+                length = capacity
+            # drop the oldest bytes
+            excess = self.size + length - capacity
+            if excess > 0:
+                self.overflowBytes += excess
+                self.consume(excess)
+        end = self.start + self.size
+        if end >= capacity:
+            end -= capacity
+        if end + length <= capacity:
+            self.buffer[end:end + length] = data
+        else:
+            data = memoryview(data)
+            first = capacity - end
+            self.view[end:] = data[:first]
+            self.view[:length - first] = data[first:]
+        self.size += length
+
+    def consume(self, length):
+        self.start = (self.start + length) % self.capacity
+        self.size -= length
+
+    def skipToHeader(self):
+        """ Drop the bytes before the next header byte, all of them if there is none """
+        end = self.start + self.size
+        match = self.headerPattern.search(self.buffer, self.start, min(end, self.capacity))
+        if match is None and end > self.capacity:
+            match = self.headerPattern.search(self.buffer, 0, end - self.capacity)
+        if match is None:
+            skipped = self.size
+        else:
+            skipped = (match.start() - self.start) % self.capacity
+        self.droppedBytes += skipped
+        self.consume(skipped)
+
+    def peekPacket(self):
+        """ The first packetSize bytes as a memoryview, the buffer must hold at least packetSize bytes """
+        end = self.start + self.packetSize
+        if end <= self.capacity:
+            return self.view[self.start:end]
+        first = self.capacity - self.start
+        self.scratchView[:first] = self.view[self.start:]
+        self.scratchView[first:] = self.view[:self.packetSize - first]
+        return self.scratchView
+
+    def readPacket(self):
+        """
+        The next valid packet as a memoryview, None if there is no complete packet yet.
+        The memoryview is only valid until the next write or read
+        """
+        packetSize = self.packetSize
+        while self.size >= packetSize:
+            start = self.start
+            if not self.isHeader[self.buffer[start]]:
+                self.skipToHeader()
+                continue
+            end = start + packetSize
+            packet = self.view[start:end] if end <= self.capacity else self.peekPacket()
+            if self.isValidPacket is None or self.isValidPacket(packet):
+                self.start = end if end < self.capacity else end - self.capacity
+                self.size -= packetSize
+                return packet
+            # not a packet boundary: resynchronize on the next header byte
+            self.invalidPackets += 1
+            self.droppedBytes += 1
+            self.consume(1)
+        return None
+
+    def packets(self):
+        """ Yield all the complete valid packets """
+        packet = self.readPacket()
+        while packet is not None:
+            yield packet
+            packet = self.readPacket()
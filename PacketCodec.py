@@ -0,0 +1,106 @@
+import struct
+
+try:
+    import anycrc
+except ImportError:  # anycrc is optional, CRC8_TABLE is used without it
+    anycrc = None
+
+# Constants
+PACKET_SIZE = 20
+DATA_SIZE = 16
+PACKET_FORMAT = "=BH16sB"   # packet id, sequence number, data, CRC8
+PACKET_STRUCT = struct.Struct(PACKET_FORMAT)
+HEADER_STRUCT = struct.Struct("=BH")
+CRC_OFFSET = PACKET_SIZE - 1
+HEADER_BYTES = range(0, 9)  # PacketType.HELLO to PacketType.GAME_STAT
+
+# The data of the IMU packets: six little-endian int16, signed fixed-point numbers with 2 decimals
+IMU_STRUCT = struct.Struct("<6h")
+IMU_SCALE = 100.0
+
+# The data is padded to DATA_SIZE with bytes holding the number of padding bytes
+PADDING = [bytes([n]) * n for n in range(DATA_SIZE + 1)]
+CRC_BYTES = [bytes([crc]) for crc in range(256)]
+
+
+def makeCrc8Table(poly = 0x07):
+    """ Lookup table of CRC8-SMBUS (polynomial 0x07, no reflection, initial value and final xor 0) """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+CRC8_TABLE = makeCrc8Table()
+
+def crc8Table(data, crc = 0):
+    for dataByte in data:
+        crc = CRC8_TABLE[crc ^ dataByte]
+    return crc
+
+if anycrc is not None:
+    # one model for all the packets, calc does not keep any state
+    crc8 = anycrc.Model('CRC8-SMBUS').calc
+else:
+    crc8 = crc8Table
+
+
+class PacketCodec:
+    """
+    Encoding and decoding of the 20-byte Beetle packets with precompiled structs and a single CRC8.
+    encodeInto writes packets into a preallocated buffer, decodeMany decodes all the packets of a buffer
+    """
+
+    @staticmethod
+    def pad(data):
+        if len(data) < DATA_SIZE:
+            return bytes(data) + PADDING[DATA_SIZE - len(data)]
+        return data
+
+    def encodeInto(self, buffer, offset, packet_id, seq_num, data):
+        """ Write a packet at offset of a preallocated buffer, e.g. several packets to send at once """
+        checked = HEADER_STRUCT.pack(packet_id, seq_num) + self.pad(data)
+        buffer[offset:offset + CRC_OFFSET] = checked
+        buffer[offset + CRC_OFFSET] = crc8(checked)
+
+    def encode(self, packet_id, seq_num, data):
+        """ The bytes of a packet, the data is padded to DATA_SIZE """
+        checked = HEADER_STRUCT.pack(packet_id, seq_num) + self.pad(data)
+        return checked + CRC_BYTES[crc8(checked)]
+
+    @staticmethod
+    def decode(packetBytes):
+        """ packet_id, seq_num, data, dataCrc of a packet """
+        return PACKET_STRUCT.unpack(packetBytes)
+
+    @staticmethod
+    def decodeImu(data):
+        """ x1, y1, z1, x2, y2, z2 of the data of an IMU packet, see ImuDecoder for batches of packets """
+        x1, y1, z1, x2, y2, z2 = IMU_STRUCT.unpack_from(data)
+        return x1 / IMU_SCALE, y1 / IMU_SCALE, z1 / IMU_SCALE, x2 / IMU_SCALE, y2 / IMU_SCALE, z2 / IMU_SCALE
+
+    @staticmethod
+    def isValid(packetBytes):
+        """ Header byte and CRC of a packet """
+        return packetBytes[0] in HEADER_BYTES and crc8(packetBytes[:CRC_OFFSET]) == packetBytes[CRC_OFFSET]
+
+    @staticmethod
+    def decodeMany(buffer):
+        """
+        Decode the consecutive packets of a buffer (its length a multiple of PACKET_SIZE)
+        Returns the (packet_id, seq_num, data) of the valid packets and the number of invalid packets
+        """
+        buffer = bytes(buffer)
+        packets = []
+        numInvalid = 0
+        offset = 0
+        for packet_id, seq_num, data, dataCrc in PACKET_STRUCT.iter_unpack(buffer):
+            # the CRC covers the first CRC_OFFSET bytes of the packet, read from the buffer not re-unpacked
+            if packet_id in HEADER_BYTES and crc8(buffer[offset:offset + CRC_OFFSET]) == dataCrc:
+                packets.append((packet_id, seq_num, data))
+            else:
+                numInvalid += 1
+            offset += PACKET_SIZE
+        return packets, numInvalid
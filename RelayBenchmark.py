@@ -0,0 +1,373 @@
+"""
+Micro-benchmarks for the relay laptop code, they do not need the Beetles (nor bluepy).
+usage: python3 RelayBenchmark.py <name> [options]
+"""
+
+import argparse
+import json
+import os
+import queue
+import random
+import socket
+import statistics
+import struct
+import sys
+import threading
+from collections import deque
+from contextlib import redirect_stdout
+from time import perf_counter, sleep
+
+import PacketCodec
+from PacketBuffer import PacketRingBuffer
+
+# Constants
+PACKET_SIZE = 20
+HEADER_BYTES = range(0, 9)
+
+
+def _rate(func, count, repeat=3):
+    """ the best of repeat runs """
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count / best
+
+
+def _notifications(count, fragmented, noise, seed):
+    """ BLE notifications carrying count packets, some of them fragmented, with a few garbage bytes in between """
+    rng = random.Random(seed)
+    stream = bytearray()
+    for i in range(count):
+        if rng.random() < noise:
+            stream += bytes([rng.randint(9, 255)])
+        stream += bytes([i % 9]) + rng.randbytes(PACKET_SIZE - 1)
+    notifications = []
+    offset = 0
+    while offset < len(stream):
+        size = rng.randint(1, PACKET_SIZE - 1) if rng.random() < fragmented else PACKET_SIZE
+        notifications.append(bytes(stream[offset:offset + size]))
+        offset += size
+    return notifications
+
+
+def _deque_baseline(notifications):
+    """ the per-byte deque of BlePacketDelegate / Beetle.checkReceiveBuffer before PacketRingBuffer """
+    dataBuffer = deque()
+    packets = 0
+    for data in notifications:
+        for dataByte in data:
+            if (dataByte <= 8 and dataByte >= 0) or len(dataBuffer) > 0:
+                dataBuffer.append(dataByte)
+        while len(dataBuffer) >= PACKET_SIZE:
+            dataPacket = bytearray()
+            for i in range(0, PACKET_SIZE):
+                dataPacket.append(dataBuffer.popleft())
+            packets += 1
+    return packets
+
+
+def _ring_buffer(notifications):
+    dataBuffer = PacketRingBuffer(PACKET_SIZE, headerBytes=HEADER_BYTES)
+    packets = 0
+    for data in notifications:
+        dataBuffer.write(data)
+        for packet in dataBuffer.packets():
+            packets += 1
+    return packets
+
+
+def bench_reassembly(args):
+    """ packets/s reassembled from the notifications, per-byte deque against the ring buffer """
+    notifications = _notifications(args.count, args.fragmented, args.noise, args.seed)
+    print("{} packets in {} notifications ({:.0%} fragmented, {:.1%} garbage bytes)".format(
+        args.count, len(notifications), args.fragmented, args.noise))
+    print("{:<26}{:>14}{:>14}".format("reassembly", "packets", "packets/s"))
+    for name, func in (("deque, per byte", _deque_baseline), ("PacketRingBuffer", _ring_buffer)):
+        packets = func(notifications)
+        print("{:<26}{:>14}{:>14.0f}".format(name, packets, _rate(lambda: func(notifications), args.count)))
+
+
+def _baseline_crc(packet_id, seq_num, data):
+    """ the former Beetle.getCrcOf, before PacketCodec: a new CRC model per packet, fed in three parts """
+    crc8 = PacketCodec.anycrc.Model('CRC8-SMBUS')
+    crc = crc8.calc(packet_id.to_bytes())
+    crc = crc8.calc(seq_num.to_bytes(length = 2, byteorder = 'little'), crc)
+    return crc8.calc(data, crc)
+
+
+def _baseline_encode(packet_id, seq_num, data):
+    """ Beetle.createPacket / addPaddingBytes before PacketCodec """
+    if len(data) < 16:
+        num_padding_bytes = 16 - len(data)
+        data = bytearray(data)
+        for i in range(0, num_padding_bytes):
+            data.append(num_padding_bytes)
+    return struct.pack(PacketCodec.PACKET_FORMAT, packet_id, seq_num, data, _baseline_crc(packet_id, seq_num, data))
+
+
+def _baseline_decode(packetBytes):
+    """ Beetle.getPacketFrom and the CRC check of Beetle.parsePacket before PacketCodec """
+    packet_id, seq_num, data, dataCrc = struct.unpack(PacketCodec.PACKET_FORMAT, packetBytes)
+    return dataCrc == _baseline_crc(packet_id, seq_num, data)
+
+
+def bench_codec(args):
+    """ packets/s encoded and decoded by the former Beetle methods and by PacketCodec """
+    rng = random.Random(args.seed)
+    payloads = [rng.randbytes(rng.choice((5, 6, 12, 16))) for _ in range(args.count)]
+    codec = PacketCodec.PacketCodec()
+    stream = bytearray(PacketCodec.PACKET_SIZE * args.count)
+    for i, data in enumerate(payloads):
+        codec.encodeInto(stream, PacketCodec.PACKET_SIZE * i, i % 9, i % 65536, data)
+    packets = [bytes(stream[i:i + PacketCodec.PACKET_SIZE]) for i in range(0, len(stream), PacketCodec.PACKET_SIZE)]
+
+    def encode(func):
+        def run():
+            for i, data in enumerate(payloads):
+                func(i % 9, i % 65536, data)
+        return run
+
+    def decode_each():
+        decoded = []
+        for packet in packets:
+            if codec.isValid(packet):
+                decoded.append(codec.decode(packet))
+
+    def decode_many():
+        codec.decodeMany(stream)
+
+    def baseline_decode():
+        decoded = []
+        for packet in packets:
+            if _baseline_decode(packet):
+                decoded.append(struct.unpack(PacketCodec.PACKET_FORMAT, packet))
+
+    crcs = [("anycrc", PacketCodec.crc8)] if PacketCodec.anycrc is not None else []
+    crcs.append(("table", PacketCodec.crc8Table))
+    print("{:<34}{:>14}".format("operation", "packets/s"))
+    if PacketCodec.anycrc is not None:
+        assert all(_baseline_encode(i % 9, i % 65536, data) == packets[i] for i, data in enumerate(payloads))
+        print("{:<34}{:>14.0f}".format("encode, Beetle methods", _rate(encode(_baseline_encode), args.count)))
+        print("{:<34}{:>14.0f}".format("decode, Beetle methods", _rate(baseline_decode, args.count)))
+    else:
+        print("anycrc is not installed: the former Beetle methods can not be measured")
+    saved = PacketCodec.crc8
+    try:
+        for name, crc8 in crcs:
+            PacketCodec.crc8 = crc8
+            print("{:<34}{:>14.0f}".format("encode, PacketCodec ({})".format(name), _rate(encode(codec.encode), args.count)))
+            print("{:<34}{:>14.0f}".format("decode, PacketCodec ({})".format(name), _rate(decode_each, args.count)))
+            print("{:<34}{:>14.0f}".format("decodeMany, PacketCodec ({})".format(name), _rate(decode_many, args.count)))
+    finally:
+        PacketCodec.crc8 = saved
+
+
+def _parse_axis(byte1, byte2):
+    """ the corrected Beetle.parseData, one int.from_bytes per axis """
+    return int.from_bytes(bytes((byte1, byte2)), byteorder='little', signed=True) / 100.0
+
+
+def bench_imu(args):
+    """ IMU packets/s decoded per axis, per packet and per window of packets """
+    import ImuDecoder
+
+    rng = random.Random(args.seed)
+    codec = PacketCodec.PacketCodec()
+    packets = [codec.encode(rng.choice((ImuDecoder.P1_IMU, ImuDecoder.P2_IMU)), i % 65536,
+                            struct.pack("<6h", *(rng.randint(-2000, 2000) for _ in range(6))))
+               for i in range(args.count)]
+    windows = [packets[i:i + args.window] for i in range(0, len(packets), args.window)]
+
+    def per_axis():
+        for packet in packets:
+            data = packet[3:19]
+            [_parse_axis(data[i], data[i + 1]) for i in range(0, 12, 2)]
+
+    def per_packet():
+        for packet in packets:
+            codec.decodeImu(packet[3:19])
+
+    def per_window():
+        for window in windows:
+            ImuDecoder.decodeImuPackets(window)
+
+    print("{} packets, windows of {} packets".format(args.count, args.window))
+    print("{:<34}{:>14}".format("IMU decoding", "packets/s"))
+    for name, func in (("parseData per axis", per_axis), ("PacketCodec.decodeImu per packet", per_packet),
+                       ("ImuDecoder per window", per_window)):
+        print("{:<34}{:>14.0f}".format(name, _rate(func, args.count)))
+
+
+def _imu_stream(numActions, rng):
+    """ IMU samples of a player at rest (gravity and noise) with numActions bursts of motion in between """
+    import numpy as np
+
+    rest = np.array([0, 0, 9.8, 0, 0, 0])
+    parts = []
+    for _ in range(numActions):
+        parts.append(rest + rng.normal(0, 0.1, (rng.integers(40, 120), 6)))
+        x = np.arange(rng.integers(20, 60))[:, np.newaxis]
+        parts.append(rest + 5 * np.sin(x * rng.uniform(0.3, 0.8, 6)) + rng.normal(0, 0.1, (len(x), 6)))
+    parts.append(rest + rng.normal(0, 0.1, (100, 6)))
+    return np.concatenate(parts)
+
+
+def bench_window(args):
+    """ IMU packets/s through ImuWindowStage, and the relay messages per sample against per action """
+    import numpy as np
+    from ImuDecoder import P1_IMU, P2_IMU
+    from ImuWindow import ImuWindowStage
+
+    rng = np.random.default_rng(args.seed)
+    codec = PacketCodec.PacketCodec()
+    packets = []
+    samples = []
+    for sensor in (P1_IMU, P2_IMU):
+        values = np.round(_imu_stream(args.actions, rng) * 100).astype(np.int16)
+        packets.append([codec.encode(sensor, i % 65536, struct.pack("<6h", *row)) for i, row in enumerate(values)])
+        samples.append(values / 100)
+    # the two sensors interleaved, as the Beetle threads put them on the queue
+    stream = [p for pair in zip(*packets) for p in pair]
+
+    # one message per sample, as RelayClient would send them without the stage
+    per_sample = sum(len(json.dumps({'playerID': player + 1, 'IMU': [round(float(v), 2) for v in row]}))
+                     for player, values in enumerate(samples) for row in values[:len(stream) // 2])
+
+    print("{} packets of 2 sensors, {} actions per sensor, batches of {} packets".format(
+        len(stream), args.actions, args.batch))
+    print("{:<26}{:>12}{:>14}{:>14}".format("relay messages", "messages", "bytes", "packets/s"))
+    print("{:<26}{:>12}{:>14}{:>14}".format("per sample", len(stream), per_sample, ""))
+    for name, emitWindows in (("per action, features", False), ("per action, windows", True)):
+        output = queue.Queue()
+
+        def run():
+            stage = ImuWindowStage(queue.Queue(), output, emitWindows = emitWindows)
+            for i in range(0, len(stream), args.batch):
+                stage.process(stream[i:i + args.batch])
+
+        rate = _rate(run, len(stream), repeat = 1)
+        messages = list(output.queue)
+        size = sum(len(json.dumps(message)) for message in messages)
+        print("{:<26}{:>12}{:>14}{:>14.0f}".format(name, len(messages), size, rate))
+
+
+def _relay_receiver(server, count, arrivals):
+    """ the relay server side: read the "<length>_<body>" frames and decode them until count messages arrived """
+    from RelayFraming import decodeBody
+
+    conn, _ = server.accept()
+    data = b""
+    while len(arrivals) < count:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+        while True:
+            sep = data.find(b"_")
+            if sep < 0 or len(data) < sep + 1 + int(data[:sep]):
+                break
+            end = sep + 1 + int(data[:sep])
+            now = perf_counter()
+            arrivals.extend(now for _ in decodeBody(data[sep + 1:end]))
+            data = data[end:]
+    conn.close()
+
+
+def _relay_run(messages, rate, **options):
+    """ send the messages through a RelayClient to a loopback receiver, rate messages/s or as fast as possible """
+    from RelayClient import RelayClient
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    arrivals = []
+    receiver = threading.Thread(target=_relay_receiver, args=(server, len(messages), arrivals))
+    receiver.start()
+
+    relay_queue = queue.Queue()
+    client = RelayClient("127.0.0.1", server.getsockname()[1], relay_queue, tcp_nodelay=True, **options)
+    sent = []
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        client.start()
+        start = perf_counter()
+        for i, message in enumerate(messages):
+            if rate:
+                delay = start + i / rate - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+            sent.append(perf_counter())
+            relay_queue.put(message)
+        receiver.join()
+        elapsed = perf_counter() - start
+        client.quit()
+        client.join()
+    server.close()
+    client.socket.close()
+    latency = [arrival - send for send, arrival in zip(sent, arrivals)]
+    return len(arrivals) / elapsed, latency, client.num_frames
+
+
+def bench_relay(args):
+    """ RelayClient messages/s and latency over loopback, JSON against binary, one frame per message against batches """
+    rng = random.Random(args.seed)
+    messages = [{'playerID': rng.randint(1, 2), 'features': [round(rng.uniform(-20, 20), 3) for _ in range(25)]}
+                for _ in range(args.count)]
+    modes = (("JSON, per message, print", dict()),
+             ("JSON, per message", dict(verbose=False)),
+             ("binary, per message", dict(binary=True)),
+             ("JSON, batched", dict(batch=True, max_delay=args.delay)),
+             ("binary, batched", dict(batch=True, binary=True, max_delay=args.delay)))
+    print("{} feature messages, latency at {} messages/s, batches flushed at 4096 bytes or {} ms".format(
+        args.count, args.rate, args.delay * 1000))
+    print("{:<26}{:>14}{:>10}{:>12}{:>12}".format("relay mode", "messages/s", "frames", "p50 ms", "p99 ms"))
+    for name, options in modes:
+        rate, _, frames = _relay_run(messages, 0, **options)
+        _, latency, _ = _relay_run(messages[:args.rate], args.rate, **options)
+        q = statistics.quantiles(latency, n=100, method="inclusive")
+        print("{:<26}{:>14.0f}{:>10}{:>12.3f}{:>12.3f}".format(name, rate, frames, q[49] * 1000, q[98] * 1000))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="relay micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="name", required=True)
+
+    p = subparsers.add_parser("reassembly", help="packet reassembly from BLE notifications")
+    p.add_argument("--count",      type=int,   default=200000)
+    p.add_argument("--fragmented", type=float, default=0.1, help="fraction of the notifications split in two")
+    p.add_argument("--noise",      type=float, default=0.0, help="probability of a garbage byte before a packet")
+    p.add_argument("--seed",       type=int,   default=1)
+    p.set_defaults(func=bench_reassembly)
+
+    p = subparsers.add_parser("codec", help="packet encoding and decoding")
+    p.add_argument("--count", type=int, default=200000)
+    p.add_argument("--seed",  type=int, default=1)
+    p.set_defaults(func=bench_codec)
+
+    p = subparsers.add_parser("imu", help="IMU payload decoding, per packet against NumPy per window")
+    p.add_argument("--count",  type=int, default=200000)
+    p.add_argument("--window", type=int, default=50, help="packets decoded at once")
+    p.add_argument("--seed",   type=int, default=1)
+    p.set_defaults(func=bench_imu)
+
+    p = subparsers.add_parser("window", help="IMU windowing stage throughput and relay traffic")
+    p.add_argument("--actions", type=int, default=500, help="actions per sensor")
+    p.add_argument("--batch",   type=int, default=20,  help="packets taken from the queue at once")
+    p.add_argument("--seed",    type=int, default=1)
+    p.set_defaults(func=bench_window)
+
+    p = subparsers.add_parser("relay", help="RelayClient over loopback: JSON or binary, batched or not")
+    p.add_argument("--count", type=int,   default=50000, help="messages sent as fast as possible")
+    p.add_argument("--rate",  type=int,   default=2000,  help="messages/s of the latency run, which lasts 1 s")
+    p.add_argument("--delay", type=float, default=0.005, help="max_delay of the batches in seconds")
+    p.add_argument("--seed",  type=int,   default=1)
+    p.set_defaults(func=bench_relay)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,17 +1,43 @@
+import queue
 import socket 
 import sys 
 import json
 import random
+import threading
+import time
 
+from RelayFraming import MessageBatcher, encodeBinary, frame
 
-class RelayClient:
+QUEUE_TIMEOUT = 0.25
 
-    def __init__(self,server_ip,server_port,ble_to_relay_queue):
+
+class RelayClient(threading.Thread):
+
+    def __init__(self,server_ip,server_port,ble_to_relay_queue,tcp_nodelay=False,sndbuf=None,rcvbuf=None,
+                 batch=False,binary=False,max_batch_bytes=4096,max_delay=0.005,verbose=None):
+        super().__init__()
         self.server_ip = server_ip
         self.server_port = server_port  
         self.timeout = 100   # the timeout for receiving any data
         self.socket = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
         self.ble_to_relay_queue = ble_to_relay_queue
+        # high performance network mode (opt-in): send every message at once and size the buffers,
+        # the buffer sizes have to be set before connect to be used for the TCP window
+        if tcp_nodelay:
+            self.socket.setsockopt(socket.IPPROTO_TCP,socket.TCP_NODELAY,1)
+        if sndbuf:
+            self.socket.setsockopt(socket.SOL_SOCKET,socket.SO_SNDBUF,sndbuf)
+        if rcvbuf:
+            self.socket.setsockopt(socket.SOL_SOCKET,socket.SO_RCVBUF,rcvbuf)
+        # relay transport mode (opt-in): several messages per frame, sent when max_batch_bytes are pending
+        # or max_delay seconds after the first one, and binary records instead of JSON (see RelayFraming)
+        self.binary = binary
+        self.batcher = MessageBatcher(binary,max_batch_bytes,max_delay) if batch else None
+        # print every message, by default only without the transport mode
+        self.verbose = verbose if verbose is not None else not (batch or binary)
+        self.num_messages = 0
+        self.num_frames = 0
+        self.terminate_event = threading.Event()
     
     def connect(self,host,port):
         try:
@@ -21,12 +47,32 @@ class RelayClient:
             sys.exit(1)
     
     def send(self,message):
+        self.num_messages += 1
+        if self.batcher is not None:
+            data = self.batcher.add(message,time.monotonic())
+            if data is not None:
+                self.send_frame(data)
+            return
+        if self.binary:
+            self.send_frame(frame(encodeBinary([message])))
+            return
         message = json.dumps(message)
-        length = str(len(message))
-        first = length + "_"
-        self.socket.sendall(first.encode("utf-8"))
-        self.socket.sendall(message.encode("utf-8"))
-        print(f'Sent {message} to relay server')
+        # one write for the length and the message, a separate small write for the length
+        # would wait for the ACK of the previous one (Nagle) without TCP_NODELAY
+        self.send_frame(frame(message.encode("utf-8")))
+        if self.verbose:
+            print(f'Sent {message} to relay server')
+
+    def send_frame(self,data):
+        self.socket.sendall(data)
+        self.num_frames += 1
+
+    def flush(self):
+        # send the pending batch
+        if self.batcher is not None:
+            data = self.batcher.flush()
+            if data is not None:
+                self.send_frame(data)
 
 
     def receive(self,message):
@@ -45,13 +91,27 @@ class RelayClient:
     def run(self):
         self.connect(self.server_ip,self.server_port)
         print('Connected to relay server')
-        while True:
+        while not self.terminate_event.is_set():
+            timeout = QUEUE_TIMEOUT
+            if self.batcher is not None and self.batcher.deadline is not None:
+                timeout = max(0,self.batcher.deadline - time.monotonic())
             try:
-              ble_data = self.data_queue.get()
-              print(f'data received from int comms {ble_data}')
-              self.send(ble_data)
-            except ble_data:
-                print("No data received from int comms")
+                ble_data = self.ble_to_relay_queue.get(timeout=timeout)
+            except queue.Empty:
+                # the deadline of the pending batch, if any
+                self.flush()
+                continue
+            if self.verbose:
+                print(f'data received from int comms {ble_data}')
+            self.send(ble_data)
+            if self.batcher is not None and self.batcher.deadline is not None \
+                    and time.monotonic() >= self.batcher.deadline:
+                self.flush()
+        self.flush()
+
+    def quit(self):
+        print(f'{self.num_messages} messages sent in {self.num_frames} frames')
+        self.terminate_event.set()
 
 
 
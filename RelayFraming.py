@@ -0,0 +1,129 @@
+import json
+import struct
+
+# Frames are "<length>_<body>" as before; the body is a JSON message (an object), a JSON array of messages
+# (batched) or the binary records of one or more messages, starting with BINARY_MARKER
+BINARY_MARKER = 0xB1
+RECORD_JSON = 0         # any message: u32 length, utf-8 JSON
+RECORD_FEATURES = 1     # {'playerID', 'features'}: u8 player, u16 count, count float32
+RECORD_WINDOW = 2       # {'playerID', 'window'}: u8 player, u16 rows, u8 columns, rows * columns float32
+RECORD_HEADER = struct.Struct("<B")
+FEATURES_HEADER = struct.Struct("<BBH")
+WINDOW_HEADER = struct.Struct("<BBHB")
+JSON_HEADER = struct.Struct("<BI")
+
+
+def frame(body):
+    """ The length header and the body in one bytes object, for a single sendall """
+    return str(len(body)).encode("utf-8") + b"_" + body
+
+
+def encodeJson(messages):
+    """ Body of one message, or of a JSON array of messages """
+    if len(messages) == 1:
+        return json.dumps(messages[0]).encode("utf-8")
+    return json.dumps(messages).encode("utf-8")
+
+
+def encodeRecord(message):
+    """
+    The binary record of a message: the feature vectors and windows of ImuWindowStage are packed as float32
+    (about 7 significant digits), any other message as JSON
+    """
+    if len(message) == 2 and 'playerID' in message:
+        try:
+            if 'features' in message:
+                features = message['features']
+                return FEATURES_HEADER.pack(RECORD_FEATURES, message['playerID'], len(features)) + \
+                    struct.pack("<{}f".format(len(features)), *features)
+            if 'window' in message and message['window']:
+                window = message['window']
+                columns = len(window[0])
+                return WINDOW_HEADER.pack(RECORD_WINDOW, message['playerID'], len(window), columns) + \
+                    struct.pack("<{}f".format(len(window) * columns), *(v for row in window for v in row))
+        except struct.error:
+            # e.g. rows of different lengths, sent as JSON
+            pass
+    body = json.dumps(message).encode("utf-8")
+    return JSON_HEADER.pack(RECORD_JSON, len(body)) + body
+
+
+def encodeBinary(messages):
+    return bytes((BINARY_MARKER,)) + b"".join(encodeRecord(message) for message in messages)
+
+
+def decodeBody(body):
+    """ The messages of a frame body, whatever its encoding """
+    if not body or body[0] != BINARY_MARKER:
+        messages = json.loads(body)
+        return messages if isinstance(messages, list) else [messages]
+    messages = []
+    view = memoryview(body)
+    offset = 1
+    while offset < len(body):
+        (recordType,) = RECORD_HEADER.unpack_from(body, offset)
+        if recordType == RECORD_FEATURES:
+            _, playerId, count = FEATURES_HEADER.unpack_from(body, offset)
+            offset += FEATURES_HEADER.size
+            features = list(struct.unpack_from("<{}f".format(count), body, offset))
+            offset += 4 * count
+            messages.append({'playerID': playerId, 'features': features})
+        elif recordType == RECORD_WINDOW:
+            _, playerId, rows, columns = WINDOW_HEADER.unpack_from(body, offset)
+            offset += WINDOW_HEADER.size
+            values = struct.unpack_from("<{}f".format(rows * columns), body, offset)
+            offset += 4 * rows * columns
+            messages.append({'playerID': playerId,
+                             'window': [list(values[i:i + columns]) for i in range(0, rows * columns, columns)]})
+        elif recordType == RECORD_JSON:
+            _, length = JSON_HEADER.unpack_from(body, offset)
+            offset += JSON_HEADER.size
+            messages.append(json.loads(bytes(view[offset:offset + length])))
+            offset += length
+        else:
+            raise ValueError("unknown record type {}".format(recordType))
+    return messages
+
+
+class MessageBatcher:
+    """
+    Messages collected into one frame, flushed when the body reaches maxBytes or maxDelay seconds
+    after the first message of the batch (the caller checks the deadline, see RelayClient.run)
+    """
+
+    def __init__(self, binary=False, maxBytes=4096, maxDelay=0.005):
+        self.binary = binary
+        self.maxBytes = maxBytes
+        self.maxDelay = maxDelay
+        self.pieces = []        # the encoded messages, binary records or JSON
+        self.size = 0
+        self.deadline = None    # time at which the batch has to be sent
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def add(self, message, now):
+        """ Add a message, returns the frame to send if the batch is full, else None """
+        piece = encodeRecord(message) if self.binary else json.dumps(message).encode("utf-8")
+        self.pieces.append(piece)
+        self.size += len(piece)
+        if self.deadline is None:
+            self.deadline = now + self.maxDelay
+        if self.size >= self.maxBytes:
+            return self.flush()
+        return None
+
+    def flush(self):
+        """ The frame of the pending messages, None if there is none """
+        if not self.pieces:
+            return None
+        if self.binary:
+            body = bytes((BINARY_MARKER,)) + b"".join(self.pieces)
+        elif len(self.pieces) == 1:
+            body = self.pieces[0]
+        else:
+            body = b"[" + b",".join(self.pieces) + b"]"
+        self.pieces = []
+        self.size = 0
+        self.deadline = None
+        return frame(body)
@@ -94,6 +94,64 @@ function next() {
     disableButton ("button_next")
 }
 
+/*
+    handle one message from the server
+*/
+function handleMessage(data) {
+    switch (data.type) {
+        case "info":
+            updateInfo (data.message);
+            break;
+        case "info_y":
+            updateInfo (data.message, type="yellow");
+            break;
+        case "info_wobr":
+            updateInfo (data.message, newline=false);
+            break;
+        case "error":
+            updateInfo (data.message, type="error");
+            break;
+        case "num_move":
+            changeText ("num_move", data.message);
+            break;
+        case "position":
+            // activate the button sleep for some time to see the result
+            sleep(2000).then(() => {
+                enableButton("button_next");
+                //reset the colour of the position box
+                changePlayerState("p1", 2)
+                if (sessionStorage.num_player != 1)
+                    changePlayerState("p2", 2)
+                if (sessionStorage.num_player == 1) {
+                    // we do not have to display the position unless it is disconnect event
+                    if (data.pos_1 == 0)
+                        changeText ("p1", data.pos_1);
+                } else {
+                    changeText ("p1", data.pos_1);
+                    changeText ("p2", data.pos_2);
+                }
+            });
+
+            break;
+        case "action":
+            changeText ("p1", data.pos_1);
+            if (sessionStorage.num_player != 1)
+                changeText ("p2", data.pos_2);
+
+            break;
+        case "action_match":
+            if (data.player_id == 1)
+                player_id = "p1"
+            else
+                player_id = "p2"
+            changePlayerState(player_id, data.action_match)
+            updateInfo (data.message);
+            break;
+        default:
+            updateInfoError ("Invalid datatype received: "+data.type);
+    }
+}
+
 /*
     function to establish the connection to the websocket
 */
@@ -147,59 +205,12 @@ function startConnection() {
             return console.error(e); // error in the above string (in this case, yes)!
         }
 
-        switch (data.type) {
-            case "info":
-                updateInfo (data.message);
-                break;
-            case "info_y":
-                updateInfo (data.message, type="yellow");
-                break;
-            case "info_wobr":
-                updateInfo (data.message, newline=false);
-                break;
-            case "error":
-                updateInfo (data.message, type="error");
-                break;
-            case "num_move":
-                changeText ("num_move", data.message);
-                break;
-            case "position":
-                // activate the button sleep for some time to see the result
-                sleep(2000).then(() => {
-                    enableButton("button_next");
-                    //reset the colour of the position box
-                    changePlayerState("p1", 2)
-                    if (sessionStorage.num_player != 1)
-                        changePlayerState("p2", 2)
-                    if (sessionStorage.num_player == 1) {
-                        // we do not have to display the position unless it is disconnect event
-                        if (data.pos_1 == 0)
-                            changeText ("p1", data.pos_1);
-                    } else {
-                        changeText ("p1", data.pos_1);
-                        changeText ("p2", data.pos_2);
-                    }
-                });
-
-                break;
-            case "action":
-                changeText ("p1", data.pos_1);
-                if (sessionStorage.num_player != 1)
-                    changeText ("p2", data.pos_2);
-
-                break;
-            case "action_match":
-                if (data.player_id == 1)
-                    player_id = "p1"
-                else
-                    player_id = "p2"
-                changePlayerState(player_id, data.action_match)
-                updateInfo (data.message);
-                break;
-            default:
-                updateInfoError ("Invalid datatype received: "+data.type);
+        if (Array.isArray(data)) {
+            // batched messages, handle them in order
+            data.forEach(handleMessage);
+        } else {
+            handleMessage(data);
         }
-
     };
 
     ws.onclose = function() {
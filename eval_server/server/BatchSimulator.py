@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+"""
+Vectorized simulation of many independent games at once, for Monte Carlo estimates of how the
+accuracy of the AI classification and the rate of timeouts change the final game states.
+The rules of Player / GameState.perform_action are applied with NumPy to arrays holding one
+row per game. --check replays the same random draws through GameState and compares the states.
+
+usage: python3 BatchSimulator.py [--games 10000] [--players 2] [--accuracy 0.6 0.8 1.0]
+                                 [--timeout-rate 0.05] [--no-visualizer] [--check 200]
+"""
+
+import argparse
+import sys
+from time import perf_counter
+
+import numpy as np
+
+from GameState import GameState, Player
+from Helper import Action
+from Schedules import generate_moves
+
+# action codes of the batch engine
+NONE, GUN, SHIELD, RELOAD, BOMB, AI = range(6)
+
+# the actions an eval client can send, wrong predictions are drawn uniformly from the first len(Action.all)
+ACTION_NAMES = sorted(Action.all) + [Action.logout, Action.none]
+_CODES = {Action.shoot: GUN, Action.shield: SHIELD, Action.reload: RELOAD, Action.bomb: BOMB,
+          Action.basket: AI, Action.soccer: AI, Action.volley: AI, Action.bowl: AI}
+ACTION_CODES = np.array([_CODES.get(name, NONE) for name in ACTION_NAMES], dtype=np.int8)
+
+
+class BatchGameState:
+    """
+    class holding the game states of num_games independent games.
+    Every field is an array of shape (num_games, 2), column 0 for player 1 and column 1 for player 2
+    """
+
+    def __init__(self, num_games):
+        shape = (num_games, 2)
+        self.num_games  = num_games
+        self.hp         = np.full(shape, Player.max_hp,      dtype=np.int32)
+        self.bullets    = np.full(shape, Player.max_bullets, dtype=np.int32)
+        self.bombs      = np.full(shape, Player.max_bombs,   dtype=np.int32)
+        self.shield_hp  = np.zeros(shape, dtype=np.int32)
+        self.deaths     = np.zeros(shape, dtype=np.int32)
+        self.shields    = np.full(shape, Player.max_shields, dtype=np.int32)
+        # number of rains started by the bombs of each player in each position (Player.rain_list)
+        self.rains      = np.zeros((num_games, 2, Player.POSITIONS), dtype=np.int32)
+        self._rows      = np.arange(num_games)
+
+    def get_dict(self, game):
+        """ the game state of one game, as GameState.get_dict """
+        return {p: {'hp':           int(self.hp[game, i]),
+                    'bullets':      int(self.bullets[game, i]),
+                    'bombs':        int(self.bombs[game, i]),
+                    'shield_hp':    int(self.shield_hp[game, i]),
+                    'deaths':       int(self.deaths[game, i]),
+                    'shields':      int(self.shields[game, i])}
+                for i, p in enumerate(('p1', 'p2'))}
+
+    def _reduce_health(self, rows, player, hp_reduction):
+        """ Player.reduce_health of the players in column player[i] of the games rows[i] """
+        if rows.size == 0:
+            return
+        # the shield absorbs what it can (the shield hp is never negative)
+        hp_shield = self.shield_hp[rows, player]
+        self.shield_hp[rows, player] = np.maximum(0, hp_shield - hp_reduction)
+        hp_reduction = np.maximum(0, hp_reduction - hp_shield)
+
+        hp = np.maximum(0, self.hp[rows, player] - hp_reduction)
+        dead = hp == 0
+        hp[dead] = Player.max_hp
+        self.hp[rows, player] = hp
+        if dead.any():
+            # if we die, we spawn immediately
+            rows, player = rows[dead], player[dead]
+            self.deaths[rows, player]    += 1
+            self.bullets[rows, player]   = Player.max_bullets
+            self.bombs[rows, player]     = Player.max_bombs
+            self.shield_hp[rows, player] = 0
+            self.shields[rows, player]   = Player.max_shields
+
+    def perform_action(self, codes, player_id, position_1, position_2, does_not_have_visualizer, active=None):
+        """
+        GameState.perform_action for every game: codes (action codes), player_id and the positions
+        are arrays with one value per game, the games where active is False are left unchanged
+        """
+        rows = self._rows
+        if active is not None:
+            rows, codes, player_id = rows[active], codes[active], player_id[active]
+            position_1, position_2 = position_1[active], position_2[active]
+        attacker = player_id - 1
+        opponent = 1 - attacker
+        opponent_position = np.where(attacker == 0, position_2, position_1)
+
+        # the players cannot see each other only if one is in quadrant 4 and the other is not
+        can_see = (position_1 == 4) == (position_2 == 4)
+
+        if not does_not_have_visualizer:
+            # rain damage: one Player.hp_rain reduction per rain of the attacker in the position of the opponent,
+            # applied one after the other since the opponent can respawn in between
+            count = np.where(can_see, self.rains[rows, attacker, opponent_position], 0)
+            for k in range(1, int(count.max(initial=0)) + 1):
+                hit = count >= k
+                self._reduce_health(rows[hit], opponent[hit], Player.hp_rain)
+        else:
+            # for bomb and AI actions we assume the opponent is always visible
+            can_see = can_see | (codes == AI) | (codes == BOMB)
+
+        # gun: one bullet, damage if the opponent is visible
+        fired = (codes == GUN) & (self.bullets[rows, attacker] > 0)
+        self.bullets[rows[fired], attacker[fired]] -= 1
+        hit = fired & can_see
+        self._reduce_health(rows[hit], opponent[hit], Player.hp_bullet)
+
+        # shield: only if one is left and none is active
+        shielded = (codes == SHIELD) & (self.shields[rows, attacker] > 0) & (self.shield_hp[rows, attacker] <= 0)
+        self.shield_hp[rows[shielded], attacker[shielded]] = Player.max_shield_health
+        self.shields[rows[shielded], attacker[shielded]] -= 1
+
+        # reload: only if the magazine is empty
+        reloaded = (codes == RELOAD) & (self.bullets[rows, attacker] <= 0)
+        self.bullets[rows[reloaded], attacker[reloaded]] = Player.max_bullets
+
+        # bomb: damage and a rain in the position of the opponent if visible
+        thrown = (codes == BOMB) & (self.bombs[rows, attacker] > 0)
+        self.bombs[rows[thrown], attacker[thrown]] -= 1
+        hit = thrown & can_see
+        self._reduce_health(rows[hit], opponent[hit], Player.hp_bomb)
+        self.rains[rows[hit], attacker[hit], opponent_position[hit]] += 1
+
+        # AI actions: damage if the opponent is visible
+        hit = (codes == AI) & can_see
+        self._reduce_health(rows[hit], opponent[hit], Player.hp_AI)
+
+
+def draw_events(moves, num_games, num_players, accuracy, timeout_rate, rng):
+    """
+    the random draws of num_games games following the move schedule: for every step and every player,
+    which player acts (the order of the two players is random), the index in ACTION_NAMES of the action
+    sent by the eval client (the correct one with probability accuracy) and whether it timed out.
+    returns three arrays of shape (len(moves) * num_players, num_games)
+    """
+    num_events = len(moves) * num_players
+    player_id  = np.ones((num_events, num_games), dtype=np.int8)
+    if num_players == 2:
+        first = rng.integers(1, 3, size=(len(moves), num_games), dtype=np.int8)
+        player_id[0::2] = first
+        player_id[1::2] = 3 - first
+
+    index   = {name: i for i, name in enumerate(ACTION_NAMES)}
+    correct = np.array([[index[move.action_1], index[move.action_2]] for move in moves], dtype=np.int8)
+    correct = correct[np.repeat(np.arange(len(moves)), num_players)[:, None], player_id - 1]
+    wrong   = rng.integers(0, len(Action.all), size=(num_events, num_games), dtype=np.int8)
+    actions = np.where(rng.random((num_events, num_games)) < accuracy, correct, wrong)
+
+    active  = rng.random((num_events, num_games)) >= timeout_rate
+    return player_id, actions, active
+
+
+def simulate(moves, num_games, num_players, accuracy, timeout_rate, does_not_have_visualizer, seed=None):
+    """ play num_games games following the move schedule, returns the BatchGameState and the draws """
+    rng = np.random.default_rng(seed)
+    player_id, actions, active = draw_events(moves, num_games, num_players, accuracy, timeout_rate, rng)
+
+    state = BatchGameState(num_games)
+    codes = ACTION_CODES[actions]
+    for event in range(len(actions)):
+        move = moves[event // num_players]
+        state.perform_action(codes[event], player_id[event],
+                             np.full(num_games, move.position_1), np.full(num_games, move.position_2),
+                             does_not_have_visualizer, active[event])
+    return state, (player_id, actions, active)
+
+
+def simulate_scalar(moves, game, num_players, does_not_have_visualizer, draws):
+    """ one game of the draws played through GameState, to check the batch engine """
+    player_id, actions, active = draws
+    game_state = GameState()
+    for event in range(len(actions)):
+        if active[event, game]:
+            move = moves[event // num_players]
+            game_state.perform_action(ACTION_NAMES[actions[event, game]], int(player_id[event, game]),
+                                      move.position_1, move.position_2, does_not_have_visualizer)
+    return game_state
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Monte Carlo simulation of many games with NumPy")
+    parser.add_argument("--games",        type=int,   default=10000)
+    parser.add_argument("--players",      type=int,   default=2, choices=(1, 2))
+    parser.add_argument("--accuracy",     type=float, default=[0.6, 0.8, 1.0], nargs="+",
+                        help="probabilities of sending the correct action")
+    parser.add_argument("--timeout-rate", type=float, default=0.05, help="probability of a frame timing out")
+    parser.add_argument("--no-visualizer", action="store_true", help="play without rain damage")
+    parser.add_argument("--seed",         type=int,   default=1, help="id of the move schedule and seed of the draws")
+    parser.add_argument("--check",        type=int,   default=0, metavar="N",
+                        help="compare the first N games with GameState")
+    args = parser.parse_args(argv)
+
+    moves = generate_moves(args.seed, args.players)
+
+    print("{} games of {} moves, {} player(s), timeout rate {}".format(
+        args.games, len(moves), args.players, args.timeout_rate))
+    print("{:<10}{:>10}{:>10}{:>12}{:>12}{:>14}{:>14}{:>12}".format(
+        "accuracy", "p1 hp", "p2 hp", "p1 deaths", "p2 deaths", "p1 deaths>0", "p2 deaths>0", "games/s"))
+    num_mismatch = 0
+    for accuracy in args.accuracy:
+        start = perf_counter()
+        state, draws = simulate(moves, args.games, args.players, accuracy, args.timeout_rate,
+                                args.no_visualizer, args.seed)
+        rate = args.games / (perf_counter() - start)
+        hp, deaths = state.hp.mean(axis=0), state.deaths.mean(axis=0)
+        died = (state.deaths > 0).mean(axis=0)
+        print("{:<10}{:>10.1f}{:>10.1f}{:>12.2f}{:>12.2f}{:>14.1%}{:>14.1%}{:>12.0f}".format(
+            accuracy, hp[0], hp[1], deaths[0], deaths[1], died[0], died[1], rate))
+
+        if args.check:
+            start = perf_counter()
+            n = min(args.check, args.games)
+            for game in range(n):
+                if simulate_scalar(moves, game, args.players, args.no_visualizer, draws).get_dict() \
+                        != state.get_dict(game):
+                    num_mismatch += 1
+            print("    checked {} games against GameState ({:.0f} games/s): {} mismatches".format(
+                n, n / (perf_counter() - start), num_mismatch))
+    return 1 if num_mismatch else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
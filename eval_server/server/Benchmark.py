@@ -0,0 +1,449 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the eval server.
+usage: python3 Benchmark.py <name> [options]
+"""
+
+import argparse
+import asyncio
+import base64
+import copy
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import tracemalloc
+from time import perf_counter, sleep
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+
+from Decryptor import Decryptor, encrypt_message
+from FrameReader import FrameReader
+from GameSimulator import GameSimulator
+from GameState import GameState
+from Helper import Action, json_dumpb
+from LoopMonitor import LoopMonitor
+from Network import SOCKET_OPTIONS, install_uvloop, tune_socket
+from Offload import EXECUTOR_KINDS, CryptoOffload
+from Schedules import ScheduleCache
+
+
+def _decrypt_baseline(secret_key, cipher_text):
+    """ the per message decryption used before Decryptor """
+    decoded_message = base64.b64decode(cipher_text)
+    iv = decoded_message[:AES.block_size]
+    secret_key = bytes(str(secret_key), encoding="utf8")
+    cipher = AES.new(secret_key, AES.MODE_CBC, iv)
+    decrypted_message = cipher.decrypt(decoded_message[AES.block_size:])
+    decrypted_message = unpad(decrypted_message, AES.block_size)
+    return decrypted_message.decode('utf8')
+
+
+def _game_state_payloads():
+    """ typical eval client messages, followed by larger synthetic ones """
+    game_state = GameState()
+    game_state.init_players_random()
+    one_player = {"player_id": 1, "action": "gun", "game_state": {"p1": game_state.get_dict()["p1"]}}
+    two_player = {"player_id": 2, "action": "basket", "game_state": game_state.get_dict()}
+    large      = dict(two_player, padding="x" * 1024)
+    return [("1-player", json.dumps(one_player)),
+            ("2-player", json.dumps(two_player)),
+            ("2-player+1KB", json.dumps(large))]
+
+
+def _rate(func, count):
+    start = perf_counter()
+    func()
+    return count / (perf_counter() - start)
+
+
+def bench_decrypt(args):
+    secret_key = "PLSPLSPLSPLSWORK"
+    decryptor = Decryptor(secret_key)
+
+    print("{:<14}{:>8}{:>16}{:>16}{:>16}".format("payload", "bytes", "before msg/s", "after msg/s", "batch msg/s"))
+    for name, text in _game_state_payloads():
+        # the frame as received from the socket: bytes before, and the str passed to the old path
+        frames = [encrypt_message(secret_key, text) for _ in range(args.count)]
+        frames_str = [f.decode("utf8") for f in frames]
+        assert decryptor.decrypt(frames[0]) == text == _decrypt_baseline(secret_key, frames_str[0])
+
+        def before():
+            for f in frames_str:
+                _decrypt_baseline(secret_key, f)
+
+        def after():
+            for f in frames:
+                decryptor.decrypt(f)
+
+        def batch():
+            for i in range(0, len(frames), args.batch):
+                decryptor.decrypt_many(frames[i:i+args.batch])
+
+        print("{:<14}{:>8}{:>16.0f}{:>16.0f}{:>16.0f}".format(
+            name, len(frames[0]), _rate(before, args.count), _rate(after, args.count), _rate(batch, args.count)))
+
+
+async def _offload_clients(offload, secret_key, frames, num_clients):
+    """ num_clients sessions receiving the frames concurrently, returns frames/s and the loop lag """
+    monitor = LoopMonitor(interval=0.001)
+    monitor.start()
+
+    async def client():
+        decryptor = Decryptor(secret_key)
+        for f in frames:
+            await offload.run(decryptor, [f])
+            await asyncio.sleep(0)  # the next frame arrives from the socket
+
+    start = perf_counter()
+    await asyncio.gather(*[client() for _ in range(num_clients)])
+    elapsed = perf_counter() - start
+    monitor.stop()
+    offload.shutdown()
+    return num_clients * len(frames) / elapsed, monitor.lag
+
+
+def bench_offload(args):
+    """
+    event loop lag while clients receive frames, decrypted and parsed inline or in an executor
+    """
+    secret_key = "PLSPLSPLSPLSWORK"
+    _, text = _game_state_payloads()[1]
+    text = json.dumps(dict(json.loads(text), padding="x" * args.size))
+    frames = [encrypt_message(secret_key, text) for _ in range(args.count)]
+
+    print("{} clients, frames of {} bytes".format(args.clients, len(frames[0])))
+    print("{:<10}{:>12}{:>14}{:>14}{:>14}".format("executor", "frames/s", "lag p50 ms", "lag p99 ms", "lag max ms"))
+    for kind in args.executors:
+        offload = CryptoOffload(kind, args.workers, args.threshold)
+        rate, lag = asyncio.run(_offload_clients(offload, secret_key, frames, args.clients))
+        print("{:<10}{:>12.0f}{:>14.3f}{:>14.3f}{:>14.3f}".format(
+            kind, rate, lag.percentile(50) * 1000, lag.percentile(99) * 1000, lag.max * 1000))
+
+
+async def _rtt_server(listener, socket_options, count):
+    """ the receive / reply loop of Client: a length-prefixed game state reply for every frame """
+    loop = asyncio.get_event_loop()
+    conn, _ = await loop.sock_accept(listener)
+    if socket_options:
+        tune_socket(conn, **socket_options)
+    reader = FrameReader(conn)
+    game_state = json_dumpb(GameState().get_dict())
+    reply = str(len(game_state)).encode("utf-8") + b"_" + game_state
+    for _ in range(count):
+        if await reader.read_frame() is None:
+            break
+        await loop.sock_sendall(conn, reply)
+    conn.close()
+
+
+def _rtt_client(port, socket_options, frame, count, latencies):
+    """ an eval client writing the length and the frame separately and waiting for every reply """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if socket_options:
+        tune_socket(sock, **socket_options)
+    sock.connect(("127.0.0.1", port))
+    replies = sock.makefile("rb")
+    header = str(len(frame)).encode("utf-8") + b"_"
+    for _ in range(count):
+        start = perf_counter()
+        sock.sendall(header)
+        sock.sendall(frame)
+        length = b""
+        while not length.endswith(b"_"):
+            length += replies.read(1)
+        replies.read(int(length[:-1]))
+        latencies.append(perf_counter() - start)
+    sock.close()
+
+
+def bench_rtt(args):
+    """
+    round trip time of a frame and its game state reply, with the default network settings
+    and with the high performance network mode (Network.SOCKET_OPTIONS, uvloop)
+    """
+    _, text = _game_state_payloads()[1]
+    frame = encrypt_message("PLSPLSPLSPLSWORK", text)
+    modes = [("default", None, False), ("tuned", SOCKET_OPTIONS, False)]
+    if install_uvloop():
+        modes.append(("tuned+uvloop", SOCKET_OPTIONS, True))
+    asyncio.set_event_loop_policy(None)
+
+    print("{} messages of {} bytes".format(args.count, len(frame)))
+    print("{:<14}{:>12}{:>12}{:>12}{:>12}".format("mode", "mean ms", "p50 ms", "p99 ms", "max ms"))
+    for name, socket_options, use_uvloop in modes:
+        if use_uvloop:
+            install_uvloop()
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if socket_options:
+            tune_socket(listener, **socket_options)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(1)
+        listener.setblocking(False)
+
+        latencies = []
+        client = threading.Thread(target=_rtt_client, args=(listener.getsockname()[1], socket_options, frame,
+                                                            args.count, latencies))
+        client.start()
+        asyncio.run(_rtt_server(listener, socket_options, args.count))
+        client.join()
+        listener.close()
+        asyncio.set_event_loop_policy(None)
+
+        q = statistics.quantiles(latencies, n=100, method="inclusive")
+        print("{:<14}{:>12.3f}{:>12.3f}{:>12.3f}{:>12.3f}".format(
+            name, statistics.mean(latencies) * 1000, q[49] * 1000, q[98] * 1000, max(latencies) * 1000))
+
+
+def _get_difference_baseline(player, recv_dict):
+    """ Player.get_difference before the dirty tracking, through get_dict """
+    data = player.get_dict()
+    for key in list(data.keys()):
+        val = data[key] - recv_dict[key]
+        if val == 0:
+            data.pop(key)
+        else:
+            data[key] = val
+    return data
+
+
+def bench_state(args):
+    """
+    size and serialization time of the full and the delta game state replies,
+    and the time of the received game state difference before and after the dirty tracking
+    """
+    random.seed(args.seed)
+    game_state = GameState()
+    full, delta, received = [], [], []
+    for _ in range(args.count):
+        game_state.perform_action(Action.get_random_action(), random.randint(1, 2),
+                                  random.randint(1, 4), random.randint(1, 4), False)
+        full.append(game_state.get_dict())
+        delta.append({'version': game_state.version, 'base': game_state.version - 1, 'delta': game_state.get_delta()})
+        game_state.clear_dirty()
+        # what an eval client sends back, mostly right
+        state = game_state.get_dict()
+        if random.random() < 0.2:
+            state['p1']['hp'] -= 5
+        received.append(state)
+
+    def full_replies():
+        for d in full:
+            json_dumpb(d)
+
+    def delta_replies():
+        for d in delta:
+            json_dumpb(d)
+
+    full_bytes  = sum(len(json_dumpb(d)) for d in full) / args.count
+    delta_bytes = sum(len(json_dumpb(d)) for d in delta) / args.count
+    print("{:<22}{:>14}{:>14}".format("reply", "bytes", "replies/s"))
+    print("{:<22}{:>14.1f}{:>14.0f}".format("full", full_bytes, _rate(full_replies, args.count)))
+    print("{:<22}{:>14.1f}{:>14.0f}".format("delta", delta_bytes, _rate(delta_replies, args.count)))
+
+    def difference_before():
+        for state in received:
+            _get_difference_baseline(game_state.player_1, state['p1'])
+            _get_difference_baseline(game_state.player_2, state['p2'])
+
+    def difference_after():
+        for state in received:
+            game_state.player_1.get_difference(state['p1'])
+            game_state.player_2.get_difference(state['p2'])
+
+    print("{:<22}{:>14}{:>14}".format("difference", "", "states/s"))
+    print("{:<22}{:>14}{:>14.0f}".format("before", "", _rate(difference_before, args.count)))
+    print("{:<22}{:>14}{:>14.0f}".format("after", "", _rate(difference_after, args.count)))
+
+
+def bench_snapshot(args):
+    """ memory of a GameState, copying and comparing game states """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    game_states = [GameState() for _ in range(args.count)]
+    per_state = (tracemalloc.get_traced_memory()[0] - before) / args.count
+    tracemalloc.stop()
+    print("{:.0f} bytes per GameState, {} bytes per snapshot".format(
+        per_state, len(game_states[0].snapshot().tobytes())))
+
+    game_state = GameState()
+    game_state.init_players_random()
+    game_state.player_1.add_rain(1)
+    game_state.player_1.add_rain(3)
+    snapshot = game_state.snapshot()
+    other = game_state.copy()
+    actions = ("gun", "shield", "bomb", "reload", "basket")
+
+    def deepcopy():
+        for _ in range(args.count):
+            copy.deepcopy(game_state)
+
+    def copy_method():
+        for _ in range(args.count):
+            game_state.copy()
+
+    def restore():
+        for _ in range(args.count):
+            other.restore(snapshot)
+
+    def compare_dict():
+        for _ in range(args.count):
+            game_state.get_dict() == other.get_dict()
+
+    def compare_snapshot():
+        for _ in range(args.count):
+            game_state.snapshot() == snapshot
+
+    def compare_packed():
+        for _ in range(args.count):
+            game_state.packed == other.packed
+
+    def perform_action():
+        for i in range(args.count):
+            if i % 50 == 0:
+                # a new game, the rains of a game accumulate
+                state = GameState()
+            state.perform_action(actions[i % len(actions)], i % 2 + 1, 1, 2, False)
+
+    print("{:<26}{:>14}".format("operation", "ops/s"))
+    for name, func in (("copy.deepcopy", deepcopy), ("GameState.copy", copy_method),
+                       ("GameState.restore", restore), ("compare get_dict", compare_dict),
+                       ("compare snapshot", compare_snapshot), ("compare packed", compare_packed),
+                       ("GameState.perform_action", perform_action)):
+        print("{:<26}{:>14.0f}".format(name, _rate(func, args.count)))
+
+
+def bench_schedules(args):
+    """ setting up the moves of a session: random moves, a cached schedule, loading the schedule file """
+    def random_moves():
+        for _ in range(args.count):
+            GameSimulator(args.players, False)
+
+    cache = ScheduleCache(max_cached=args.schedules)
+    cache.pregenerate(range(args.schedules), args.players)
+
+    def cached_moves():
+        for i in range(args.count):
+            GameSimulator(args.players, False, cache.get(i % args.schedules, args.players))
+
+    path = os.path.join(tempfile.mkdtemp(), "schedules.bin")
+    cache.save(path)
+
+    def load_file():
+        ScheduleCache(path)
+
+    print("{} schedules: {} bytes on disk".format(args.schedules, os.path.getsize(path)))
+    print("{:<26}{:>14}".format("session moves", "sessions/s"))
+    print("{:<26}{:>14.0f}".format("random (GameSimulator)", _rate(random_moves, args.count)))
+    print("{:<26}{:>14.0f}".format("cached schedule", _rate(cached_moves, args.count)))
+    print("{:<26}{:>14.0f}".format("schedules loaded (file)", _rate(load_file, 1) * args.schedules))
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+
+
+def _wait_for_port(port, timeout=10):
+    deadline = perf_counter() + timeout
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            if perf_counter() > deadline:
+                raise
+            sleep(0.1)
+
+
+def bench_shards(args):
+    """
+    throughput of ShardedServer with an increasing number of workers. The load comes from
+    several LoadGenerator processes so that the generator itself is not the bottleneck.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    print("{:<10}{:>8}{:>12}{:>14}{:>14}{:>10}".format("workers", "groups", "steps/s", "frames/s", "p99 step ms", "errors"))
+    for num_workers in args.workers:
+        # the logs of the simulated groups go to a temporary folder, not to evaluation_logs
+        log_dir = tempfile.mkdtemp(prefix="eval_logs_")
+        server = subprocess.Popen([sys.executable, "ShardedServer.py", "--workers", str(num_workers)],
+                                  cwd=here, env=dict(os.environ, EVAL_LOG_DIR=log_dir), stdout=subprocess.DEVNULL)
+        try:
+            _wait_for_port(8001)
+            per_generator = args.groups // args.generators
+            generators = [subprocess.Popen([sys.executable, "LoadGenerator.py", "--json",
+                                            "--groups", str(per_generator), "--games", str(args.games),
+                                            "--first-group", str(101 + i * per_generator)],
+                                           cwd=here, stdout=subprocess.PIPE)
+                          for i in range(args.generators)]
+            results = [json.loads(g.communicate()[0]) for g in generators]
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(log_dir, ignore_errors=True)
+
+        # the generators run concurrently, the slowest one bounds the elapsed time
+        elapsed = max(r["elapsed"] for r in results)
+        steps   = sum(r["steps"] for r in results)
+        frames  = sum(r["frames"] for r in results)
+        latency = sorted(t for r in results for t in r["step_latency"])
+        p99     = latency[int(0.99 * (len(latency) - 1))] * 1000 if latency else float("nan")
+        errors  = sum(sum(r["errors"].values()) for r in results)
+        print("{:<10}{:>8}{:>12.1f}{:>14.1f}{:>14.2f}{:>10}".format(
+            num_workers, per_generator * args.generators, steps / elapsed, frames / elapsed, p99, errors))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="eval server micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="name", required=True)
+
+    p = subparsers.add_parser("decrypt", help="messages/sec of Client decryption before and after Decryptor")
+    p.add_argument("--count", type=int, default=20000, help="messages per payload size")
+    p.add_argument("--batch", type=int, default=32,    help="frames per decrypt_many call")
+    p.set_defaults(func=bench_decrypt)
+
+    p = subparsers.add_parser("offload", help="event loop lag with decryption inline or in an executor")
+    p.add_argument("--size",      type=int, default=64 * 1024, help="padding added to a 2-player message")
+    p.add_argument("--count",     type=int, default=200, help="frames received by every client")
+    p.add_argument("--clients",   type=int, default=8,   help="concurrent clients")
+    p.add_argument("--workers",   type=int, default=2,   help="executor workers")
+    p.add_argument("--threshold", type=int, default=4096, help="frames of at least these many bytes are offloaded")
+    p.add_argument("--executors", nargs="+", default=list(EXECUTOR_KINDS), choices=EXECUTOR_KINDS)
+    p.set_defaults(func=bench_offload)
+
+    p = subparsers.add_parser("rtt", help="reply round trip time with and without the high performance network mode")
+    p.add_argument("--count", type=int, default=500, help="messages per mode")
+    p.set_defaults(func=bench_rtt)
+
+    p = subparsers.add_parser("state", help="full against delta game state replies, game state difference")
+    p.add_argument("--count", type=int, default=100000, help="actions performed")
+    p.add_argument("--seed",  type=int, default=1)
+    p.set_defaults(func=bench_state)
+
+    p = subparsers.add_parser("snapshot", help="memory, copy and comparison of game states")
+    p.add_argument("--count", type=int, default=100000)
+    p.set_defaults(func=bench_snapshot)
+
+    p = subparsers.add_parser("schedules", help="random moves against cached move schedules per session")
+    p.add_argument("--count",     type=int, default=20000)
+    p.add_argument("--schedules", type=int, default=1000)
+    p.add_argument("--players",   type=int, default=2, choices=(1, 2))
+    p.set_defaults(func=bench_schedules)
+
+    p = subparsers.add_parser("shards", help="throughput of ShardedServer against the number of workers")
+    p.add_argument("--workers",    type=int, nargs="+", default=[1, 2, 4], help="worker counts to measure")
+    p.add_argument("--groups",     type=int, default=40, help="concurrent groups in total")
+    p.add_argument("--generators", type=int, default=4,  help="LoadGenerator processes sharing the groups")
+    p.add_argument("--games",      type=int, default=2,  help="games played in a row by every group")
+    p.set_defaults(func=bench_shards)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,16 +1,21 @@
 import asyncio
 import json
 import socket
+from collections import deque
 from _socket import SHUT_RDWR
-import base64
 from time import perf_counter
 
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
-
+from Decryptor import Decryptor
+from FrameReader import FrameReader
 from GameSimulator import GameSimulator
-from Helper import ice_print_group_name
+from Helper import ice_print_group_name, json_dumpb
 from Logger import Logger
+from Metrics import StageMetrics
+from Network import tune_socket
+from Offload import offload
+
+HELLO       = "hello"           # the first message of the eval client, encrypted with the password
+HELLO_DELTA = "hello delta"     # the same, asking for the delta replies (see Client.send_game_state)
 
 
 class Client:
@@ -18,24 +23,56 @@ class Client:
     class for coordinating all the TCP communication and gameplay with one team.
     """
 
-    def __init__(self, group_name, secret_key, num_players, does_not_have_visualizer):
+    def __init__(self, group_name, secret_key, num_players, does_not_have_visualizer, socket_options=None,
+                 acceptor=None, moves=None):
         self.group_name     = group_name
         self.secret_key     = secret_key
+        self.decryptor      = Decryptor(secret_key)     # key schedule prepared once per client
+        self.offload        = offload   # decrypts and parses large frames in an executor
 
         self.is_running     = True
+        self.is_stopped     = False     # is_running also turns False once all the moves are done
         self.num_players    = num_players
 
         self.timeout = 60   # the timeout for receiving any data
 
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # TCP socket connecting to the eval client
-        self.socket.bind(("", 0))
-        self.port_number = self.socket.getsockname()[1]
+        self.socket_options = socket_options  # keyword arguments of Network.tune_socket, None for the system defaults
+        self.acceptor = acceptor  # SharedAcceptor of the port shared by all the clients, None for a port of our own
+        if acceptor is None:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)  # TCP socket connecting to the eval client
+            if socket_options:
+                tune_socket(self.socket, **socket_options)
+            self.socket.bind(("", 0))
+            self.port_number = self.socket.getsockname()[1]
+        else:
+            self.socket = None
+            self.port_number = acceptor.port
 
         self.addr   = None  # address of the client
         self.conn   = None  # address of the client socket
-
-        self.simulator = GameSimulator(num_players, does_not_have_visualizer)  # the game simulator
-        self.logger    = Logger(group_name, num_players)
+        self.reader = None  # framed reader on top of the client socket
+        self._first_text = None  # the first message, already received and decrypted by the acceptor
+
+        # the game simulator, playing the moves of a schedule (see Schedules.ScheduleCache) or random moves
+        self.simulator = GameSimulator(num_players, does_not_have_visualizer, moves)
+        self.metrics   = StageMetrics()  # durations of the stages of every step, see Metrics.STAGES
+        self.logger    = Logger(group_name, num_players, metrics=self.metrics)
+        self.logger_closed = None  # task flushing and closing the log at the end of the session
+        self.log_in_background = True  # do not wait for the log write before replying to the eval client
+
+        # delta replies: only the fields changed since the previous reply are sent
+        self.delta_replies  = False     # negotiated with HELLO_DELTA
+        self.client_version = None      # version of the game state reported by the eval client
+        self.sent_version   = None      # version of the game state in the previous reply
+        self.num_full_replies   = 0
+        self.num_delta_replies  = 0
+
+        # pipelined mode: frames are received by a background task and queued in arrival order
+        self.pipelined      = False
+        self.frame_queue    = None  # (text, json) of the frames received but not handled yet
+        self._frame_ready   = None  # set whenever a frame is queued or the connection closed
+        self._reader_closed = False
+        self._reader_task   = None
 
     async def accept (self):
         """
@@ -43,39 +80,58 @@ class Client:
         """
         if not self.is_running:
             return
+        if self.acceptor is not None:
+            self.conn, self.addr, self.reader, self._first_text = await self.acceptor.expect(self)
+            return
         self.socket.listen(1)
         self.socket.setblocking(False)
 
         loop = asyncio.get_event_loop()
         self.conn, self.addr = await loop.sock_accept(self.socket)
+        if self.socket_options:
+            tune_socket(self.conn, **self.socket_options)
+        self.reader = FrameReader(self.conn)
 
     def stop (self):
         """
         The cleanup function
         """
-        if not self.is_running:
+        if self.is_stopped:
             return
+        self.is_stopped = True
         self.is_running = False
+        if self._reader_task is not None:
+            self._reader_task.cancel()
         try:
             if self.conn is not None:
                 self.conn.shutdown(SHUT_RDWR)
                 self.conn.close()
                 self.conn = None
-            self.socket.close()
+            if self.socket is not None:
+                self.socket.close()
         except Exception as e:
             # this is an inconsequential error
             ice_print_group_name(self.group_name, 'client.stop: (NO PROBLEM)', e)
 
+        # flush the queued log records to the disk
+        loop = asyncio.get_event_loop()
+        self.logger_closed = loop.create_task(self.logger.close())
+
     async def verify_password(self):
         """
         We verify to see if the student supplied password matches
         """
         success = False
-        _, timeout, text = await self.recv_text(self.timeout)
+        if self._first_text is not None:
+            # received by the shared acceptor
+            timeout, text = self.timeout, self._first_text
+        else:
+            _, timeout, text = await self.recv_text(self.timeout)
 
-        if text == "hello":
+        if text == HELLO or text == HELLO_DELTA:
             # our passwords match
             success = True
+            self.delta_replies = text == HELLO_DELTA
 
         return success, timeout
 
@@ -83,59 +139,108 @@ class Client:
         """
         receive and decrypt the message from client
         """
+        success, timeout, text_received, _ = await self._recv_frame(timeout)
+        return success, timeout, text_received
+
+    async def _recv_frame(self, timeout):
+        """
+        receive, decrypt and parse the message from client
+        returns success, the remaining timeout, the text and its parsed json (None if it did not parse)
+        """
         text_received   = ""
+        data_received   = None
         success         = False
 
         if self.is_running:
-            loop = asyncio.get_event_loop()
             try:
-                while True:
-                    # recv length followed by '_' followed by cypher
-                    data = b''
-                    while not data.endswith(b'_'):
-                        start_time = perf_counter()
-                        task = loop.sock_recv(self.conn, 1)
-                        _d = await asyncio.wait_for(task, timeout=timeout)
-                        timeout -= (perf_counter() - start_time)
-                        if not _d:
-                            data = b''
-                            break
-                        data += _d
-                    if len(data) == 0:
-                        ice_print_group_name(self.group_name, 'recv_text: client disconnected')
-                        self.stop()
-                        break
-                    data = data.decode("utf-8")
-                    length = int(data[:-1])
-
-                    data = b''
-                    while len(data) < length:
-                        start_time = perf_counter()
-                        task = loop.sock_recv(self.conn, length - len(data))
-                        _d = await asyncio.wait_for(task, timeout=timeout)
-                        timeout -= (perf_counter() - start_time)
-                        if not _d:
-                            data = b''
-                            break
-                        data += _d
-                    if len(data) == 0:
-                        ice_print_group_name(self.group_name, 'recv_text: client disconnected')
-                        self.stop()
-                        break
-                    msg = data.decode("utf8")  # Decode raw bytes to UTF-8
-                    text_received = self.decrypt_message(msg)
+                # recv length followed by '_' followed by cypher, with a single deadline for the whole message
+                start_time = perf_counter()
+                data = await asyncio.wait_for(self.reader.read_frame(), timeout=timeout)
+                self.metrics.record("receive", perf_counter() - start_time)
+                if data is None:
+                    ice_print_group_name(self.group_name, 'recv_text: client disconnected')
+                    self.stop()
+                else:
+                    text_received, data_received = (await self.decrypt_and_parse([data]))[0]
                     success = True
-                    break
+                timeout -= (perf_counter() - start_time)
             except ConnectionResetError:
                 ice_print_group_name(self.group_name, 'recv_text: Connection Reset')
                 self.stop()
+            except ValueError as e:
+                # corrupt frame header, e.g. a length above FrameReader.max_frame_len
+                ice_print_group_name(self.group_name, 'recv_text:', e)
+                self.stop()
             except asyncio.TimeoutError:
                 ice_print_group_name(self.group_name, 'recv_text: Timeout while receiving data')
                 timeout = -1
         else:
             timeout = -1
 
-        return success, timeout, text_received
+        return success, timeout, text_received, data_received
+
+    def start_reader(self):
+        """
+        Switch to the pipelined mode: a background task receives the frames of both players
+        and queues them, so that processing a frame overlaps with receiving the next one.
+        The frames are handled in arrival order, as in the non pipelined mode
+        """
+        if self.pipelined or not self.is_running:
+            return
+        self.pipelined      = True
+        self.frame_queue    = deque()
+        self._frame_ready   = asyncio.Event()
+        loop = asyncio.get_event_loop()
+        self._reader_task   = loop.create_task(self._reader_loop())
+
+    async def _reader_loop(self):
+        """
+        receive, decrypt and parse the frames, queue them in arrival order
+        """
+        try:
+            while self.is_running:
+                frames = await self.reader.read_frames()
+                if not frames:
+                    ice_print_group_name(self.group_name, '_reader_loop: client disconnected')
+                    break
+                # handle_a_player reports the frames which did not decrypt or parse
+                self.frame_queue.extend(await self.decrypt_and_parse(frames))
+                self._frame_ready.set()
+        except (ConnectionResetError, OSError):
+            ice_print_group_name(self.group_name, '_reader_loop: Connection Reset')
+        except ValueError as e:
+            ice_print_group_name(self.group_name, '_reader_loop:', e)
+        self._reader_closed = True
+        self._frame_ready.set()
+
+    async def _next_frame(self, timeout):
+        """
+        the next queued frame, waiting at most timeout
+        returns success, the remaining timeout, the text and its parsed json (None if it did not parse)
+        """
+        wait_start = perf_counter()
+        while True:
+            # the shared deadline of the step is over, like recv_text we do not look at queued data
+            if timeout <= 0:
+                ice_print_group_name(self.group_name, '_next_frame: Timeout while receiving data')
+                return False, -1, "", None
+
+            if self.frame_queue:
+                text, data = self.frame_queue.popleft()
+                self.metrics.record("receive", perf_counter() - wait_start)
+                return True, timeout, text, data
+            if self._reader_closed:
+                self.stop()
+                return False, timeout, "", None
+
+            self._frame_ready.clear()
+            start_time = perf_counter()
+            try:
+                await asyncio.wait_for(self._frame_ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                ice_print_group_name(self.group_name, '_next_frame: Timeout while receiving data')
+                return False, -1, "", None
+            timeout -= (perf_counter() - start_time)
 
     def decrypt_message(self, cipher_text):
         """
@@ -143,20 +248,25 @@ class Client:
         the secret encryption key/ password
         """
         try:
-            decoded_message = base64.b64decode(cipher_text)  # Decode message from base64 to bytes
-            iv = decoded_message[:AES.block_size]  # Get IV value
-            secret_key = bytes(str(self.secret_key), encoding="utf8")  # Convert secret key to bytes
-
-            cipher = AES.new(secret_key, AES.MODE_CBC, iv)  # Create new AES cipher object
-
-            decrypted_message = cipher.decrypt(decoded_message[AES.block_size:])  # Perform decryption
-            decrypted_message = unpad(decrypted_message, AES.block_size)
-            decrypted_message = decrypted_message.decode('utf8')  # Decode bytes into utf-8
+            decrypted_message = self.decryptor.decrypt(cipher_text)
         except Exception as e:
             decrypted_message = ""
             ice_print_group_name(self.group_name, "exception in decrypt_message: ", e)
         return decrypted_message
 
+    async def decrypt_and_parse(self, frames):
+        """
+        Decrypt a batch of received frames and parse their json, on the event loop or in the
+        executor of self.offload depending on their size.
+        returns a list of (text, json), ("", None) for the frames which fail to decrypt
+        """
+        results = await self.offload.run(self.decryptor, frames, self.metrics)
+        for i, (text, data) in enumerate(results):
+            if isinstance(text, Exception):
+                ice_print_group_name(self.group_name, "exception in decrypt_and_parse: ", text)
+                results[i] = ("", None)
+        return results
+
     def current_move (self):
         """ The text message of number of moves to be displayed on the UI """
         return self.simulator.current_move()
@@ -176,7 +286,11 @@ class Client:
         start_time = perf_counter()
 
         # wait for a json from eval_client with timeout
-        success, timeout, text_received = await self.recv_text(timeout_para)
+        data = None
+        if self.pipelined:
+            success, timeout, text_received, data = await self._next_frame(timeout_para)
+        else:
+            success, timeout, text_received, data = await self._recv_frame(timeout_para)
 
         player_id       = -1
         action          = ""
@@ -185,12 +299,15 @@ class Client:
 
         if success:
             try:
-                data = json.loads (text_received)
+                if data is None:
+                    data = json.loads (text_received)
 
                 # process the received game state
                 player_id           = int (data["player_id"])
                 action              = data["action"]
                 received_game_state = data["game_state"]
+                if self.delta_replies:
+                    self.client_version = data.get("version")
 
                 if player_id == player_processed:
                     # we have received a duplicate json, hence discarding
@@ -207,18 +324,34 @@ class Client:
                         action_match = 1
 
                     # use the user sent action to alter the game state
+                    stage_start = perf_counter()
                     self.simulator.perform_action (action, player_id)
+                    self.metrics.record("simulate", perf_counter() - stage_start)
 
                     # find the difference between the game states
+                    stage_start = perf_counter()
                     message = self.simulator.get_game_state_difference (received_game_state)
+                    stage_end = perf_counter()
+                    self.metrics.record("diff", stage_end - stage_start)
+
+                    response_time = stage_end - start_time
+                    self.metrics.record("response", response_time)
 
                     # log the result
-                    response_time = perf_counter() - start_time
-                    await self.logger.write_state(response_time=response_time, player_id=player_id,
-                                                  correct_action=current_action,
-                                                  predicted_action=action, action_matched=action_match,
-                                                  game_state_received=received_game_state,
-                                                  game_state_expected=self.simulator.get_game_state_dict())
+                    stage_start = perf_counter()
+                    log_args = dict(response_time=response_time, player_id=player_id,
+                                    correct_action=current_action,
+                                    predicted_action=action, action_matched=action_match,
+                                    game_state_received=received_game_state,
+                                    game_state_expected=self.simulator.get_game_state_dict())
+                    if self.log_in_background:
+                        # fire-and-forget, the record reaches the disk from the logger's background task,
+                        # when too many records are waiting the step waits for them to be written
+                        if not self.logger.log_state(**log_args):
+                            await self.logger.write_state(**log_args)
+                    else:
+                        await self.logger.write_state(**log_args)
+                    self.metrics.record("log", perf_counter() - stage_start)
 
             except (ValueError, TypeError):  # includes simplejson.decoder.JSONDecodeError
                 message = 'Decoding JSON has failed'
@@ -240,17 +373,41 @@ class Client:
             # all actions have been displayed
             self.is_running = False
 
+    def _delta_reply(self):
+        """
+        the reply of the delta mode:
+            {"version": v, "base": b, "delta": {"p1": {changed fields}, "p2": {...}}}
+                if the eval client reported the version b of the previous reply, else
+            {"version": v, "p1": {...}, "p2": {...}}
+                a full snapshot, e.g. for the first reply or when the eval client lost track
+        """
+        game_state = self.simulator.game_state
+        if self.sent_version is not None and self.client_version == self.sent_version:
+            reply = {'version': game_state.version, 'base': self.sent_version, 'delta': game_state.get_delta()}
+            self.num_delta_replies += 1
+        else:
+            reply = game_state.get_dict()
+            reply['version'] = game_state.version
+            self.num_full_replies += 1
+        game_state.clear_dirty()
+        self.sent_version = game_state.version
+        return reply
+
     async def send_game_state(self):
         if not self.is_running:
             return
         loop = asyncio.get_event_loop()
+        start_time = perf_counter()
 
-        game_state  = json.dumps(self.simulator.game_state.get_dict())
-        data        = str(len(game_state))+"_"+game_state
+        if self.delta_replies:
+            game_state = json_dumpb(self._delta_reply())
+        else:
+            game_state = json_dumpb(self.simulator.game_state.get_dict())
+        data        = str(len(game_state)).encode("utf-8")+b"_"+game_state
 
         # send the data to eval client
         try:
-            task = loop.sock_sendall(self.conn, data.encode("utf-8"))
+            task = loop.sock_sendall(self.conn, data)
             await asyncio.wait_for(task, timeout=self.timeout)
         except OSError:
             ice_print_group_name(self.group_name, 'send_game_state: Connection terminated')
@@ -260,6 +417,7 @@ class Client:
             self.stop()
         except asyncio.TimeoutError:
             ice_print_group_name(self.group_name, 'send_game_state: Timeout while sending data')
+        self.metrics.record("send_game_state", perf_counter() - start_time)
 
         return
 
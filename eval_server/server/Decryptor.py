@@ -0,0 +1,96 @@
+import os
+from binascii import a2b_base64, b2a_base64
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+
+
+def encrypt_message(secret_key, text):
+    """
+    what the eval client on the Ultra96 sends: base64(iv + AES-CBC(text)), used by the test tools
+    """
+    iv = os.urandom(AES.block_size)
+    cipher = AES.new(bytes(str(secret_key), encoding="utf8"), AES.MODE_CBC, iv)
+    return b2a_base64(iv + cipher.encrypt(pad(text.encode("utf-8"), AES.block_size)), newline=False)
+
+
+class Decryptor:
+    """
+    class for decrypting the base64(iv + AES-CBC(text)) messages of one team.
+    The key schedule is prepared once: a single ECB cipher object is kept and the
+    CBC chaining is applied with one XOR per message, instead of creating a new
+    CBC cipher object for every message.
+    """
+
+    def __init__(self, secret_key):
+        self.secret_key = bytes(str(secret_key), encoding="utf8")  # Convert secret key to bytes
+        self._cipher    = None
+
+    @property
+    def _ecb(self):
+        """
+        the ECB cipher, created on the first message: a password which is not a valid AES key
+        raises ValueError there and fails the verification like a wrong password
+        """
+        if self._cipher is None:
+            self._cipher = AES.new(self.secret_key, AES.MODE_ECB)
+        return self._cipher
+
+    @staticmethod
+    def _split(data):
+        """ base64 decode the raw frame (bytes/memoryview/str) into iv and cipher text """
+        decoded_message = a2b_base64(data)  # Decode message from base64 to bytes
+        n = len(decoded_message)
+        if n < 2 * AES.block_size or n % AES.block_size != 0:
+            raise ValueError("Decryptor: invalid cipher text length {}".format(n))
+        return decoded_message
+
+    @staticmethod
+    def _unchain(decoded_message, block_decrypted):
+        """ apply the CBC xor, remove the padding and decode into utf-8 """
+        n = len(block_decrypted)
+        chain = int.from_bytes(decoded_message[:n], "big")  # iv followed by all cipher blocks but the last
+        decrypted_message = (int.from_bytes(block_decrypted, "big") ^ chain).to_bytes(n, "big")
+        decrypted_message = unpad(decrypted_message, AES.block_size)
+        return decrypted_message.decode('utf8')  # Decode bytes into utf-8
+
+    def decrypt(self, data):
+        """
+        decrypt a single message, raises ValueError on a malformed message
+        """
+        decoded_message = self._split(data)
+        block_decrypted = self._ecb.decrypt(decoded_message[AES.block_size:])  # Perform decryption
+        return self._unchain(decoded_message, block_decrypted)
+
+    def decrypt_many(self, frames):
+        """
+        decrypt a batch of messages with a single call into the cipher.
+        returns a list with the decrypted text or the exception raised for each frame
+        """
+        results = [None] * len(frames)
+        decoded = []
+        for i, data in enumerate(frames):
+            try:
+                decoded.append((i, self._split(data)))
+            except ValueError as e:
+                results[i] = e
+
+        if not decoded:
+            return results
+        try:
+            block_decrypted = self._ecb.decrypt(b''.join(m[AES.block_size:] for _, m in decoded))
+        except ValueError as e:
+            # invalid key
+            for i, _ in decoded:
+                results[i] = e
+            return results
+
+        offset = 0
+        for i, decoded_message in decoded:
+            n = len(decoded_message) - AES.block_size
+            try:
+                results[i] = self._unchain(decoded_message, block_decrypted[offset:offset+n])
+            except ValueError as e:
+                results[i] = e
+            offset += n
+        return results
@@ -0,0 +1,104 @@
+import asyncio
+
+
+class FrameReader:
+    """
+    class for reading "<len>_<payload>" frames from one TCP connection.
+    Data is pulled from the socket in large chunks into a reusable receive buffer,
+    any number of complete frames can be parsed out of one read and the leftover
+    bytes are kept for the next call.
+    """
+
+    max_header_len = 16     # number of digits + '_' we accept before declaring the header corrupt
+
+    def __init__(self, conn, chunk_size=64 * 1024, max_frame_len=4 * 1024 * 1024):
+        self.conn           = conn
+        self.chunk_size     = chunk_size
+        self.max_frame_len  = max_frame_len     # longest payload accepted, the header is not trusted
+
+        self._buffer    = bytearray(chunk_size)    # reusable receive buffer
+        self._start     = 0                         # first unparsed byte
+        self._end       = 0                         # one past the last received byte
+
+    def buffered(self):
+        """ number of bytes received but not yet returned as a frame """
+        return self._end - self._start
+
+    def _next_frame(self):
+        """
+        parse one complete frame out of the buffer
+        returns the payload as bytes or None if more data is required
+        """
+        sep = self._buffer.find(b'_', self._start, self._end)
+        if sep < 0:
+            if self._end - self._start > self.max_header_len:
+                raise ValueError("FrameReader: invalid frame header")
+            return None
+
+        length = int(self._buffer[self._start:sep])
+        if length < 0 or length > self.max_frame_len:
+            raise ValueError("FrameReader: invalid frame length {}".format(length))
+        frame_end = sep + 1 + length
+        if frame_end > self._end:
+            # make sure the whole frame fits in the buffer once it arrives
+            self._reserve(frame_end - self._start)
+            return None
+
+        frame = bytes(self._buffer[sep+1:frame_end])
+        self._start = frame_end
+        if self._start == self._end:
+            self._start = self._end = 0
+        return frame
+
+    def _reserve(self, needed):
+        """ compact the buffer and grow it so that needed bytes fit from the start """
+        if self._start > 0:
+            n = self._end - self._start
+            self._buffer[:n] = self._buffer[self._start:self._end]
+            self._start = 0
+            self._end   = n
+        if needed > len(self._buffer):
+            # allocate a new buffer rather than resizing, a cancelled recv may still hold a view
+            buffer = bytearray(needed)
+            buffer[:self._end] = self._buffer[:self._end]
+            self._buffer = buffer
+
+    async def _fill(self):
+        """ receive one chunk from the socket, returns the number of bytes read (0 on EOF) """
+        if self._end == len(self._buffer):
+            self._reserve(self._end - self._start + self.chunk_size)
+        elif len(self._buffer) - self._end < self.chunk_size // 4:
+            self._reserve(len(self._buffer))
+
+        loop = asyncio.get_event_loop()
+        n = await loop.sock_recv_into(self.conn, memoryview(self._buffer)[self._end:])
+        self._end += n
+        return n
+
+    async def read_frame(self):
+        """
+        return the payload of the next frame, None if the connection was closed.
+        Callers apply a single deadline to the whole message e.g. with asyncio.wait_for
+        """
+        while True:
+            frame = self._next_frame()
+            if frame is not None:
+                return frame
+            if await self._fill() == 0:
+                return None
+
+    async def read_frames(self):
+        """
+        return all the frames which are complete after at most one wait on the socket,
+        an empty list if the connection was closed
+        """
+        frame = await self.read_frame()
+        if frame is None:
+            return []
+        frames = [frame]
+        while True:
+            frame = self._next_frame()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
@@ -10,40 +10,32 @@ class GameSimulator:
     Actions will be displayed on the evaluation server UI for the
     players to follow.
     """
-    def __init__(self, num_players, does_not_have_visualizer):
+    def __init__(self, num_players, does_not_have_visualizer, moves=None):
         # create the players
         self.game_state     = GameState()
         self.num_players    = num_players
 
-        # generate the list of action and moves to perform
-        self.num_moves_gun  = 0
-        self.num_moves_ai   = 0
-
-        self.moves      = self._init_moves (num_players)
+        # generate the list of action and moves to perform, unless the moves of a schedule are given (see Schedules)
+        self.moves      = moves if moves is not None else self.make_moves (num_players)
+        self.num_moves_gun, self.num_moves_ai = self._count_moves(self.moves, num_players)
         self.move_index = 0  # move to be made
         self.num_moves  = len(self.moves)
 
         self.does_not_have_visualizer = does_not_have_visualizer  # some teams do not have visualizer
 
-    def _init_moves(self, num_players):
+    @staticmethod
+    def make_moves(num_players, rng=random):
         """
-        Create a random list of moves
+        Create a random list of moves, rng is the random generator (a seeded random.Random for a schedule)
         """
         # randomize the size of the list
-        _r = random.randint(0, 1)
+        _r = rng.randint(0, 1)
 
-        actions_1 = Action.init_list(_r)
+        actions_1 = Action.init_list(_r, rng)
         n = len(actions_1)
 
-        _g = actions_1.count(Action.shoot)
-        self.num_moves_gun += _g
-        self.num_moves_ai  += n-_g
-
         if num_players == 2:
-            actions_2 = Action.init_list(_r)
-            _g = actions_2.count(Action.shoot)
-            self.num_moves_gun += _g
-            self.num_moves_ai  += n-_g
+            actions_2 = Action.init_list(_r, rng)
         else:
             actions_2 = [Action.none]*n
 
@@ -52,14 +44,14 @@ class GameSimulator:
             m = n//2
             positions_1 = [1]
             positions_2 = [3]
-            self._get_positions (m, positions_1)
-            self._get_positions (m, positions_2)
+            GameSimulator._get_positions (m, positions_1, rng)
+            GameSimulator._get_positions (m, positions_2, rng)
             # adding the disconnect move
             positions_1.extend([0, 2])
             positions_2.extend([3, 4])
             m = n-m
-            self._get_positions (m, positions_1)
-            self._get_positions (m, positions_2)
+            GameSimulator._get_positions (m, positions_1, rng)
+            GameSimulator._get_positions (m, positions_2, rng)
 
             # adding the disconnect move
             positions_1[n-3] = 0
@@ -80,12 +72,20 @@ class GameSimulator:
         return moves
 
     @staticmethod
-    def _get_positions(n, ret):
+    def _count_moves(moves, num_players):
+        """ the number of gun and AI (logout included) actions to perform by all the players """
+        num_gun = sum(move.action_1 == Action.shoot for move in moves)
+        if num_players == 2:
+            num_gun += sum(move.action_2 == Action.shoot for move in moves)
+        return num_gun, len(moves) * num_players - num_gun
+
+    @staticmethod
+    def _get_positions(n, ret, rng=random):
         """ Generates a list of moves """
         prev_pos = ret[-1]
 
         for _ in range(n):
-            r = random.random()
+            r = rng.random()
             if r < 0.49:
                 next_pos = prev_pos + 1
             elif r < 0.98:
@@ -1,13 +1,19 @@
 import random
 import sys
+from array import array
 
 from Helper import Action
 
 
 class GameState:
+    __slots__ = ('packed', 'player_1', 'player_2', 'version')
+
     def __init__(self):
-        self.player_1 = Player()
-        self.player_2 = Player()
+        # the state of both players packed in one array of Player.STATE_SIZE * 2 ints, see Player
+        self.packed   = array('i', Player.INITIAL_STATE * 2)
+        self.player_1 = Player(self.packed, 0)
+        self.player_2 = Player(self.packed, Player.STATE_SIZE)
+        self.version  = 0   # incremented whenever a field of a player changes
 
     def __str__(self):
         return str(self.get_dict())
@@ -16,6 +22,37 @@ class GameState:
         data = {'p1': self.player_1.get_dict(), 'p2': self.player_2.get_dict()}
         return data
 
+    def copy(self):
+        """ an independent copy, cheaper than copy.deepcopy """
+        clone = GameState.__new__(GameState)
+        clone.packed    = self.packed[:]
+        clone.player_1  = Player(clone.packed, 0, self.player_1.dirty)
+        clone.player_2  = Player(clone.packed, Player.STATE_SIZE, self.player_2.dirty)
+        clone.version   = self.version
+        return clone
+
+    def snapshot(self):
+        """
+        a copy of the packed state of both players, an array of Player.STATE_SIZE * 2 ints.
+        Two game states with equal packed states behave the same for any further action.
+        """
+        return self.packed[:]
+
+    def restore(self, snapshot):
+        """ set the state of both players from a snapshot, all the fields are marked dirty """
+        self.packed[:] = snapshot
+        self.player_1.dirty = Player.ALL_DIRTY
+        self.player_2.dirty = Player.ALL_DIRTY
+        self.version += 1
+
+    def get_delta(self):
+        """ the fields changed since clear_dirty, e.g. {'p1': {'hp': 90}, 'p2': {}} """
+        return {'p1': self.player_1.get_delta(), 'p2': self.player_2.get_delta()}
+
+    def clear_dirty(self):
+        self.player_1.dirty = 0
+        self.player_2.dirty = 0
+
     def difference(self, received_game_state):
         """Find the difference between the current game_state and received"""
         try:
@@ -54,6 +91,7 @@ class GameState:
             player = self.player_2
         player.set_state(bullets_remaining, bombs_remaining, hp, num_deaths,
                          num_unused_shield, shield_health)
+        self.version += 1
 
     def perform_action(self, action, player_id, position_1, position_2, does_not_have_visualizer):
         """use the user sent action to alter the game state"""
@@ -73,6 +111,9 @@ class GameState:
             opponent            = self.player_1
             opponent_position   = position_1
 
+        # the packed state before the action, to find the dirty fields
+        before = self.packed[:]
+
         # check if the players can see each other
         can_see = self._can_see (position_1, position_2)
 
@@ -110,6 +151,13 @@ class GameState:
             # invalid action we do nothing
             pass
 
+        # a single comparison of the packed states when the action changed nothing
+        if self.packed != before:
+            changed = self.player_1.mark_dirty(before)
+            changed = self.player_2.mark_dirty(before) or changed
+            if changed:
+                self.version += 1
+
     @staticmethod
     def _can_see(position_1, position_2):
         """check if the players can see each other"""
@@ -122,50 +170,126 @@ class GameState:
         return can_see
 
 
+def _field(index):
+    """ the property of the int at index in the packed state of a player """
+    def get(self):
+        return self._state[self._offset + index]
+
+    def set(self, value):
+        self._state[self._offset + index] = value
+
+    return property(get, set)
+
+
 class Player:
-    def __init__(self):
-        self.max_bombs          = 2
-        self.max_shields        = 3
-        self.hp_bullet          = 5     # the hp reduction for bullet
-        self.hp_AI              = 10    # the hp reduction for AI action
-        self.hp_bomb            = 5
-        self.hp_rain            = 5
-        self.max_shield_health  = 30
-        self.max_bullets        = 6
-        self.max_hp             = 100
-
-        self.num_deaths         = 0
-
-        self.hp             = self.max_hp
-        self.num_bullets    = self.max_bullets
-        self.num_bombs      = self.max_bombs
-        self.hp_shield      = 0
-        self.num_shield     = self.max_shields
-
-        self.rain_list = []  # list of quadrants where rain has been started by the bomb of this player
+    """
+    A player is a view on STATE_SIZE ints of a packed array, usually GameState.packed:
+    the fields in the order of FIELDS followed by the number of rains started in every position.
+    rain_damage only counts the rains in the position of the opponent, so their order does not matter
+    """
+    __slots__ = ('_state', '_offset', 'dirty')
+
+    # the keys of the player in the game state json and the corresponding attributes
+    FIELDS = (('hp',        'hp'),
+              ('bullets',   'num_bullets'),
+              ('bombs',     'num_bombs'),
+              ('shield_hp', 'hp_shield'),
+              ('deaths',    'num_deaths'),
+              ('shields',   'num_shield'))
+
+    POSITIONS  = 5                              # rains can be started in the positions 0 (disconnect) to 4
+    RAINS      = len(FIELDS)                    # index of the number of rains in position 0
+    STATE_SIZE = RAINS + POSITIONS              # the fields followed by the number of rains per position
+    ALL_DIRTY  = (1 << len(FIELDS)) - 1
+
+    hp          = _field(0)
+    num_bullets = _field(1)
+    num_bombs   = _field(2)
+    hp_shield   = _field(3)
+    num_deaths  = _field(4)
+    num_shield  = _field(5)
+
+    # the rules of the game, the same for every player
+    max_bombs          = 2
+    max_shields        = 3
+    hp_bullet          = 5     # the hp reduction for bullet
+    hp_AI              = 10    # the hp reduction for AI action
+    hp_bomb            = 5
+    hp_rain            = 5
+    max_shield_health  = 30
+    max_bullets        = 6
+    max_hp             = 100
+
+    INITIAL_STATE = (max_hp, max_bullets, max_bombs, 0, 0, max_shields) + (0,) * POSITIONS
+
+    def __init__(self, state=None, offset=0, dirty=0):
+        if state is None:
+            # a player of its own
+            state = array('i', self.INITIAL_STATE)
+        self._state    = state
+        self._offset   = offset
+        self.dirty     = dirty  # bit i is set if FIELDS[i] changed since GameState.clear_dirty
 
     def __str__(self):
         return str(self.get_dict())
 
     def get_dict(self):
+        state, offset = self._state, self._offset
         data = dict()
-        data['hp']              = self.hp
-        data['bullets']         = self.num_bullets
-        data['bombs']           = self.num_bombs
-        data['shield_hp']       = self.hp_shield
-        data['deaths']          = self.num_deaths
-        data['shields']         = self.num_shield
+        data['hp']              = state[offset]
+        data['bullets']         = state[offset + 1]
+        data['bombs']           = state[offset + 2]
+        data['shield_hp']       = state[offset + 3]
+        data['deaths']          = state[offset + 4]
+        data['shields']         = state[offset + 5]
         return data
 
+    @property
+    def rain_list(self):
+        """ the positions where rains have been started by the bombs of this player, in position order """
+        rains = self._offset + self.RAINS
+        return [p for p in range(self.POSITIONS) for _ in range(self._state[rains + p])]
+
+    def values(self):
+        """ the fields in the order of FIELDS """
+        return tuple(self._state[self._offset:self._offset + self.RAINS])
+
+    def state(self):
+        """ the fields followed by the number of rains in every position, a tuple of STATE_SIZE ints """
+        return tuple(self._state[self._offset:self._offset + self.STATE_SIZE])
+
+    def load(self, state):
+        """ set the fields and the rains from state(), all the fields are marked dirty """
+        self._state[self._offset:self._offset + self.STATE_SIZE] = array('i', state)
+        self.dirty = self.ALL_DIRTY
+
+    def copy(self):
+        """ an independent player with its own packed state """
+        return Player(array('i', self.state()), 0, self.dirty)
+
+    def mark_dirty(self, old_state):
+        """ mark the fields which differ from old_state (a copy of the packed array) dirty, returns True if any """
+        changed = False
+        state, offset = self._state, self._offset
+        for i in range(self.RAINS):
+            if old_state[offset + i] != state[offset + i]:
+                self.dirty |= 1 << i
+                changed = True
+        return changed
+
+    def get_delta(self):
+        """ the dirty fields and their values """
+        values = self.values()
+        return {key: values[i] for i, (key, _) in enumerate(self.FIELDS) if self.dirty >> i & 1}
+
     def get_difference(self, recv_dict):
         """get difference between the received player sate and our state"""
-        data = self.get_dict()
-        for key in list(data.keys()):
-            val = data[key] - recv_dict[key]
-            if val == 0:
-                # there is no difference so we delete the element
-                data.pop(key)
-            else:
+        # the received state can be wrong in any field, all of them are compared,
+        # directly from the packed state without building the dict of our state
+        data = dict()
+        for (key, _), value in zip(self.FIELDS, self.values()):
+            val = value - recv_dict[key]
+            if val != 0:
                 data[key] = val
         return data
 
@@ -176,6 +300,7 @@ class Player:
         self.hp_shield      = shield_health
         self.num_shield     = num_unused_shield
         self.num_deaths     = num_deaths
+        self.dirty          = self.ALL_DIRTY
 
     def shoot(self, opponent, can_see):
         while True:
@@ -240,18 +365,25 @@ class Player:
 
             opponent.reduce_health(self.hp_bomb)
             # start a rain in the quadrant of the opponent
-            self.rain_list.append(opponent_position)
+            self.add_rain(opponent_position)
             break
 
+    def add_rain(self, position):
+        """
+        start a rain in position. A rain outside the positions 0 to POSITIONS - 1 could never damage
+        an opponent, it is not counted (the index would be in the fields of the other player)
+        """
+        if 0 <= position < self.POSITIONS:
+            self._state[self._offset + self.RAINS + position] += 1
+
     def rain_damage(self, opponent, opponent_position, can_see):
         """
         whenever an opponent walks into a quadrant we need to reduce the health
         based on the number of rains
         """
-        if can_see:
-            for p in self.rain_list:
-                if p == opponent_position:
-                    opponent.reduce_health(self.hp_rain)
+        if can_see and 0 <= opponent_position < self.POSITIONS:
+            for _ in range(self._state[self._offset + self.RAINS + opponent_position]):
+                opponent.reduce_health(self.hp_rain)
 
     def harm_AI(self, opponent, can_see):
         """ We can harm am opponent based on our AI action if we can see them"""
@@ -1,11 +1,44 @@
+import json
 import random
 
+try:
+    import orjson
+except ImportError:  # orjson is optional, it is a faster JSON backend
+    orjson = None
+
+
+def json_dumps(data):
+    """
+    serialize to a JSON str with orjson when it is installed, else with the json module.
+    For the messages sent over the network only: the output differs between the two (spacing, NaN),
+    files such as the evaluation logs are written with the json module
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data).decode("utf-8")
+        except TypeError:
+            # e.g. integers larger than 64 bit in a game state sent by the eval client
+            pass
+    return json.dumps(data)
+
+
+def json_dumpb(data):
+    """
+    serialize to JSON encoded in utf-8 bytes
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            pass
+    return json.dumps(data).encode("utf-8")
+
 
 def ice_print_group_name (group_name, *arg):
     """
     print each group message in different colour
     """
-    n = int (group_name[1:])
+    n = (int (group_name[1:]) - 1) % 14 + 1  # there are 14 colours, B01 is colour 1
     print(group_name, end=": ")
     ice_print(arg, color=n)
 
@@ -69,7 +102,10 @@ class Action:
     num_AI_total = _num_AI * (len(all) - 1) + 1
 
     @classmethod
-    def init_list(cls, _r):
+    def init_list(cls, _r, rng=random):
+        """
+        the shuffled actions of a game, rng is the random generator (a seeded random.Random for a schedule)
+        """
         if _r > 0:
             ret = [cls.shoot]
         else:
@@ -82,7 +118,7 @@ class Action:
         ret.extend([cls.soccer] * cls._num_AI)
         ret.extend([cls.volley] * cls._num_AI)
         ret.extend([cls.bowl]   * cls._num_AI)
-        random.shuffle(ret)
+        rng.shuffle(ret)
 
         ret.append(cls.logout)
         return ret
@@ -0,0 +1,89 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, used for vectorized updates
+    np = None
+
+
+class Histogram:
+    """
+    class for approximate percentiles in constant memory.
+    Values are counted in log spaced bins, the relative error of a percentile is
+    at most the bin width (1% by default). Values below min_value share the first bin.
+    """
+
+    def __init__(self, min_value=1e-6, max_value=1e4, relative_error=0.01):
+        self.min_value  = min_value
+        self._log_base  = math.log1p(relative_error)
+        self.num_bins   = int(math.log(max_value / min_value) / self._log_base) + 2
+        self.counts     = [0] * self.num_bins
+
+        self.count      = 0
+        self.total      = 0.0
+        self.min        = math.inf
+        self.max        = -math.inf
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        return min(self.num_bins - 1, int(math.log(value / self.min_value) / self._log_base) + 1)
+
+    def _value(self, index):
+        """ the upper edge of a bin """
+        return self.min_value * math.exp(index * self._log_base)
+
+    def add(self, value):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def add_many(self, values):
+        """ add a batch of values, vectorized when numpy is available """
+        if np is None:
+            for v in values:
+                self.add(v)
+            return
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        index = np.ones(values.size, dtype=np.int64)
+        above = values > self.min_value
+        index[~above] = 0
+        index[above] += (np.log(values[above] / self.min_value) / self._log_base).astype(np.int64)
+        np.minimum(index, self.num_bins - 1, out=index)
+        for i, c in enumerate(np.bincount(index, minlength=self.num_bins)):
+            if c:
+                self.counts[i] += int(c)
+        self.count += int(values.size)
+        self.total += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def percentile(self, p):
+        """ the p-th percentile (0 <= p <= 100) """
+        if self.count == 0:
+            return math.nan
+        rank = max(1, math.ceil(p / 100.0 * self.count))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                # clamp to the exact extremes which are known
+                return min(self.max, max(self.min, self._value(i)))
+        return self.max
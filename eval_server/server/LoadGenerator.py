@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+Headless load generator for WebSocketServer.py.
+For every simulated group it plays both sides the server expects:
+    1) the browser: sends the handshake over the WebSocket and clicks "next" for every move
+    2) the eval client on the Ultra96: connects to the TCP port shown to the browser,
+       sends the encrypted "hello" and then an encrypted {player_id, action, game_state}
+       for every player, waiting for the game state sent back by the server
+Everything runs on localhost. Reports throughput, latency percentiles and error counts.
+
+usage: python3 LoadGenerator.py --groups 20 [--players 2] [--accuracy 0.8] [--spawn]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import websockets
+
+from Client import HELLO, HELLO_DELTA
+from Decryptor import encrypt_message
+from GameState import GameState
+from Helper import Action
+
+SERVER_PORT = 8001
+
+
+class _Result:
+    """
+    measurements of one simulated group
+    """
+
+    def __init__(self):
+        self.steps          = 0
+        self.frames         = 0
+        self.reply_bytes    = 0     # size of the game state replies
+        self.step_latency   = []    # "next" click -> last game state received
+        self.frame_latency  = []    # frame sent -> game state received
+        self.setup_latency  = []    # WebSocket connect -> first position, i.e. the eval client is verified
+        self.errors         = dict()
+
+    def error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+
+async def _send_frame(writer, secret_key, text):
+    cipher_text = encrypt_message(secret_key, text)
+    writer.write(str(len(cipher_text)).encode("utf-8") + b'_' + cipher_text)
+    await writer.drain()
+
+
+async def _recv_frame(reader):
+    header = await reader.readuntil(b'_')
+    return await reader.readexactly(int(header[:-1]))
+
+
+async def _connect(host, port, deadline):
+    """ the server announces the port just before it starts listening, retry until it accepts """
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            if writer.get_extra_info("sockname") != writer.get_extra_info("peername"):
+                return reader, writer
+            # on localhost a connect to a port which is not listening yet can pick the same port
+            # as its source and connect to itself
+            writer.close()
+        except ConnectionRefusedError:
+            pass
+        if perf_counter() > deadline:
+            raise ConnectionRefusedError("port {} is not listening".format(port))
+        await asyncio.sleep(0.01)
+
+
+def _apply_reply(game_state, version, reply):
+    """ the game state and its version after a reply of the delta mode, see Client._delta_reply """
+    if "delta" not in reply:
+        version = reply.pop("version")
+        return reply, version
+    if reply["base"] != version:
+        # the version we report makes the server send a full snapshot with the next reply
+        return game_state, None
+    return {p: dict(game_state[p], **reply["delta"].get(p, {})) for p in game_state}, reply["version"]
+
+
+async def run_group(group_name, num_players, accuracy, host, timeout, burst=False, prefix_hello=False,
+                    delta=False, schedule=None):
+    """ simulate the browser and the eval client of one group """
+    result      = _Result()
+    connect_time = perf_counter()
+    secret_key  = "".join(random.choice("ABCDEFGHIJKLMNOP") for _ in range(16))
+    handshake   = {"group_name": group_name, "password": secret_key,
+                   "num_player": str(num_players), "no_visualizer": "false"}
+    if schedule is not None:
+        handshake["schedule"] = schedule
+    handshake   = json.dumps(handshake)
+    game_state  = GameState().get_dict()
+    version     = None  # of game_state in the delta mode
+    hello       = HELLO_DELTA if delta else HELLO
+    writer      = None
+    try:
+        async with websockets.connect("ws://{}:{}/".format(host, SERVER_PORT)) as ws:
+            await ws.send(handshake)
+
+            next_time = 0
+            pending   = []
+            while True:
+                if not pending:
+                    data = json.loads(await asyncio.wait_for(ws.recv(), timeout=timeout))
+                    # the server may batch several messages in one frame
+                    pending = data if isinstance(data, list) else [data]
+                data = pending.pop(0)
+                m_type  = data["type"]
+                message = data["message"]
+
+                if m_type == "error":
+                    result.error("server: " + message.split(":")[0])
+                elif m_type == "num_move" and " Port:" in message:
+                    # connect the eval client and start with the password verification
+                    port = int(message.split("Port:")[1])
+                    reader, writer = await _connect(host, port, perf_counter() + timeout)
+                    if prefix_hello:
+                        # "<group_name>:<cipher>" routes the connection on a shared eval client port
+                        cipher_text = group_name.encode("utf-8") + b':' + encrypt_message(secret_key, hello)
+                        writer.write(str(len(cipher_text)).encode("utf-8") + b'_' + cipher_text)
+                    else:
+                        await _send_frame(writer, secret_key, hello)
+                elif m_type == "num_move" and message == "Eval Terminated":
+                    break
+                elif m_type == "position":
+                    next_time = perf_counter()
+                    if not result.setup_latency:
+                        result.setup_latency.append(next_time - connect_time)
+                    await ws.send("next")
+                elif m_type == "action" and writer is not None:
+                    actions = (data["pos_1"], data["pos_2"])
+                    sent = []
+                    for player_id in range(1, num_players + 1):
+                        action = actions[player_id - 1]
+                        if random.random() >= accuracy:
+                            action = Action.get_random_action()
+                        message = {"player_id": player_id, "action": action, "game_state": game_state}
+                        if delta:
+                            message["version"] = version
+                        text = json.dumps(message)
+                        sent.append(perf_counter())
+                        await _send_frame(writer, secret_key, text)
+                        if burst and player_id < num_players:
+                            # both players act at the same time, read the replies afterwards
+                            continue
+                        for start_time in sent:
+                            reply = await asyncio.wait_for(_recv_frame(reader), timeout=timeout)
+                            result.frame_latency.append(perf_counter() - start_time)
+                            result.frames += 1
+                            result.reply_bytes += len(reply)
+                            if delta:
+                                game_state, version = _apply_reply(game_state, version, json.loads(reply))
+                            else:
+                                game_state = json.loads(reply)
+                        sent = []
+                    result.step_latency.append(perf_counter() - next_time)
+                    result.steps += 1
+    except asyncio.TimeoutError:
+        result.error("timeout")
+    except (websockets.ConnectionClosed, ConnectionError, asyncio.IncompleteReadError) as e:
+        result.error(type(e).__name__)
+    except OSError:
+        result.error("OSError")
+    finally:
+        if writer is not None:
+            writer.close()
+    return result
+
+
+async def run_games(games, *args):
+    """ play several games in a row for one group """
+    total = _Result()
+    for _ in range(games):
+        result = await run_group(*args)
+        total.steps         += result.steps
+        total.frames        += result.frames
+        total.reply_bytes   += result.reply_bytes
+        total.step_latency  += result.step_latency
+        total.frame_latency += result.frame_latency
+        total.setup_latency += result.setup_latency
+        for name, count in result.errors.items():
+            total.errors[name] = total.errors.get(name, 0) + count
+    return total
+
+
+def _percentiles(values):
+    if len(values) < 2:
+        return "n/a"
+    q = statistics.quantiles(values, n=100, method="inclusive")
+    return "p50={:.2f}ms p90={:.2f}ms p99={:.2f}ms max={:.2f}ms".format(
+        q[49] * 1000, q[89] * 1000, q[98] * 1000, max(values) * 1000)
+
+
+async def _wait_for_server(host, deadline):
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, SERVER_PORT)
+            writer.close()
+            return
+        except OSError:
+            if perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run(args):
+    server  = None
+    log_dir = None
+    if args.spawn:
+        # the logs of the simulated groups go to a temporary folder, not to evaluation_logs
+        log_dir = tempfile.mkdtemp(prefix="eval_logs_")
+        server = subprocess.Popen([sys.executable, args.server] + args.server_args,
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  env=dict(os.environ, EVAL_LOG_DIR=log_dir),
+                                  stdout=subprocess.DEVNULL if not args.server_output else None)
+    try:
+        await _wait_for_server(args.host, perf_counter() + 10)
+
+        start = perf_counter()
+        results = await asyncio.gather(*[
+            run_games(args.games, "B{}".format(args.first_group + i), args.players, args.accuracy, args.host,
+                      args.timeout, args.burst, args.prefix_hello, args.delta, args.schedule)
+            for i in range(args.groups)])
+        elapsed = perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(log_dir, ignore_errors=True)
+
+    steps          = sum(r.steps for r in results)
+    frames         = sum(r.frames for r in results)
+    reply_bytes    = sum(r.reply_bytes for r in results)
+    step_latency   = [t for r in results for t in r.step_latency]
+    frame_latency  = [t for r in results for t in r.frame_latency]
+    setup_latency  = [t for r in results for t in r.setup_latency]
+    errors = dict()
+    for r in results:
+        for name, count in r.errors.items():
+            errors[name] = errors.get(name, 0) + count
+
+    if args.json:
+        print(json.dumps({"groups": args.groups, "players": args.players, "elapsed": elapsed,
+                          "steps": steps, "frames": frames, "reply_bytes": reply_bytes, "step_latency": step_latency,
+                          "frame_latency": frame_latency, "setup_latency": setup_latency, "errors": errors}))
+        return
+
+    print("groups={} players={} elapsed={:.2f}s".format(args.groups, args.players, elapsed))
+    print("throughput: {:.1f} steps/s {:.1f} frames/s, {:.1f} reply bytes/frame".format(
+        steps / elapsed, frames / elapsed, reply_bytes / frames if frames else 0))
+    print("step latency  ({} steps):  {}".format(len(step_latency), _percentiles(step_latency)))
+    print("frame latency ({} frames): {}".format(len(frame_latency), _percentiles(frame_latency)))
+    print("session setup ({} games):  {}".format(len(setup_latency), _percentiles(setup_latency)))
+    print("errors: {}".format(errors if errors else "none"))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="load generator for the eval server")
+    parser.add_argument("--groups",      type=int,   default=10,  help="number of concurrent groups")
+    parser.add_argument("--players",     type=int,   default=2,   choices=(1, 2))
+    parser.add_argument("--accuracy",    type=float, default=0.8, help="probability of sending the correct action")
+    parser.add_argument("--games",       type=int,   default=1,   help="games played in a row by every group")
+    parser.add_argument("--first-group", type=int,   default=101, help="groups are named B<first-group + i>")
+    parser.add_argument("--burst",       action="store_true", help="send the frames of both players back to back")
+    parser.add_argument("--prefix-hello", action="store_true", help="send the group name with the first frame")
+    parser.add_argument("--delta",       action="store_true", help="ask for the delta game state replies")
+    parser.add_argument("--schedule",    type=int,   default=None, help="id of the move schedule played by all groups")
+    parser.add_argument("--host",        default="127.0.0.1")
+    parser.add_argument("--timeout",     type=float, default=30)
+    parser.add_argument("--json",        action="store_true", help="print the raw measurements as JSON")
+    parser.add_argument("--spawn",       action="store_true", help="start the server for the run")
+    parser.add_argument("--server",      default="WebSocketServer.py", help="server script started by --spawn")
+    parser.add_argument("--server-output", action="store_true", help="show the output of the spawned server")
+    parser.add_argument("--server-args", nargs=argparse.REMAINDER, default=[],
+                        help="arguments passed to the spawned server")
+    asyncio.run(run(parser.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
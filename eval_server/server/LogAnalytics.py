@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Statistics over the evaluation logs written by Logger (JSON lines or the binary format).
+The files are streamed record by record so the memory used does not depend on their size: a group keeps
+one response time histogram, its sessions only a compact summary (mean and extremes, no percentiles).
+
+usage: python3 LogAnalytics.py [--json] [--no-numpy] <log file>...
+   e.g python3 LogAnalytics.py evaluation_logs/*_logs.json
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+
+import Histogram as _histogram
+from Histogram import Histogram
+from LogFormat import FIELDS, PLAYERS, iter_records
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class _Summary:
+    """
+    count, mean and extremes of the response times of a session, a few numbers instead of a Histogram
+    """
+
+    def __init__(self):
+        self.count  = 0
+        self.total  = 0.0
+        self.min    = math.inf
+        self.max    = -math.inf
+
+    def add_many(self, values):
+        self.count += len(values)
+        self.total += sum(values)
+        self.min = min(self.min, min(values))
+        self.max = max(self.max, max(values))
+
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+
+class _Stats:
+    """
+    class accumulating the statistics of a set of records,
+    with response time percentiles or only their summary (see _Summary)
+    """
+
+    def __init__(self, percentiles=True):
+        self.num_records        = 0
+        self.num_matched        = 0
+        self.num_state_mismatch = 0     # records where the received game state differs from the expected
+        self.field_mismatch     = {p: {k: 0 for k in FIELDS} for p in PLAYERS}
+        self.actions            = dict()    # correct_action -> [number of records, number matched]
+        self.confusion          = dict()    # correct_action -> predicted_action -> count
+        self.response_time      = Histogram() if percentiles else _Summary()
+        self._pending_times     = []        # response times waiting for a vectorized histogram update
+
+    def add(self, data):
+        self.num_records += 1
+        correct     = str(data['correct_action'])
+        predicted   = str(data['predicted_action'])     # sent by the eval client, may be anything
+        matched     = data['action_matched'] == 0
+
+        action = self.actions.get(correct)
+        if action is None:
+            action = self.actions[correct] = [0, 0]
+        action[0] += 1
+        if matched:
+            action[1] += 1
+            self.num_matched += 1
+
+        row = self.confusion.setdefault(correct, dict())
+        row[predicted] = row.get(predicted, 0) + 1
+
+        self._pending_times.append(data['response_time'])
+        if len(self._pending_times) >= 4096:
+            self.flush()
+
+        received = data['game_state_received']
+        expected = data['game_state_expected']
+        if received != expected:
+            self.num_state_mismatch += 1
+            if not isinstance(received, dict):
+                received = dict()
+            for p in PLAYERS:
+                exp_player  = expected.get(p, dict())
+                recv_player = received.get(p)
+                if not isinstance(recv_player, dict):
+                    recv_player = dict()
+                for k in FIELDS:
+                    if recv_player.get(k) != exp_player.get(k):
+                        self.field_mismatch[p][k] += 1
+
+    def flush(self):
+        """ move the pending response times into the histogram """
+        if self._pending_times:
+            self.response_time.add_many(self._pending_times)
+            self._pending_times = []
+
+    def to_dict(self):
+        self.flush()
+        n = self.num_records
+        return {
+            'records':              n,
+            'accuracy':             self.num_matched / n if n else 0.0,
+            'actions':              {a: {'records': c[0], 'matched': c[1], 'accuracy': c[1] / c[0]}
+                                     for a, c in sorted(self.actions.items())},
+            'confusion':            {a: dict(sorted(row.items())) for a, row in sorted(self.confusion.items())},
+            'response_time':        self._response_time_dict(),
+            'state_mismatch_rate':  self.num_state_mismatch / n if n else 0.0,
+            'field_mismatch_rate':  {p: {k: v / n if n else 0.0 for k, v in f.items()}
+                                     for p, f in self.field_mismatch.items()},
+        }
+
+
+    def _response_time_dict(self):
+        rt = self.response_time
+        data = {'mean': rt.mean(), 'max': rt.max if rt.count else math.nan}
+        if isinstance(rt, Histogram):
+            data.update(('p{}'.format(p), rt.percentile(p)) for p in PERCENTILES)
+        return data
+
+
+def group_of(path):
+    """ the group and number of players from the name <group>_<num_players>_logs.<ext> """
+    name = os.path.basename(path).split('.')[0]
+    parts = name.split('_')
+    if len(parts) >= 3 and parts[-1] == 'logs':
+        return parts[0], parts[1]
+    return name, '?'
+
+
+def analyse(paths):
+    """
+    stream the log files, returns {group: {'total': stats, 'sessions': {"<num_players>p:<id>": stats}}}
+    """
+    groups = dict()
+    for path in paths:
+        group, num_players = group_of(path)
+        g = groups.setdefault(group, {'total': _Stats(), 'sessions': dict()})
+        for data in iter_records(path):
+            g['total'].add(data)
+            key = '{}p:{}'.format(num_players, data['id'])
+            session = g['sessions'].get(key)
+            if session is None:
+                session = g['sessions'][key] = _Stats(percentiles=False)
+            session.add(data)
+    return {group: {'total':    g['total'].to_dict(),
+                    'sessions': {k: s.to_dict() for k, s in g['sessions'].items()}}
+            for group, g in sorted(groups.items())}
+
+
+def _print_stats(title, stats, detailed):
+    rt = stats['response_time']
+    print("{:<16} records={:<7} accuracy={:6.1%} state_mismatch={:6.1%} response time "
+          "mean={:.3f} {}".format(title, stats['records'], stats['accuracy'], stats['state_mismatch_rate'],
+                                  rt['mean'], " ".join("{}={:.3f}".format(k, v) for k, v in rt.items()
+                                                       if k != 'mean')))
+    if not detailed:
+        return
+    for action, a in stats['actions'].items():
+        print("    {:<10} {:>4}/{:<4} {:6.1%}".format(action, a['matched'], a['records'], a['accuracy']))
+
+    # confusion matrix, rows: correct action, columns: predicted action
+    predicted = sorted({p for row in stats['confusion'].values() for p in row})
+    print("    confusion (row: correct, column: predicted)")
+    print("    {:<10}".format("") + "".join("{:>8}".format(p[:7]) for p in predicted))
+    for action, row in stats['confusion'].items():
+        print("    {:<10}".format(action) + "".join("{:>8}".format(row.get(p, 0)) for p in predicted))
+
+    print("    field mismatch rate: " + "; ".join(
+        "{}.{}={:.1%}".format(p, k, v) for p, f in stats['field_mismatch_rate'].items() for k, v in f.items() if v))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="statistics over the evaluation logs")
+    parser.add_argument("paths", nargs="+", help="log files (JSON lines or binary)")
+    parser.add_argument("--json", action="store_true", help="print the statistics as JSON")
+    parser.add_argument("--no-numpy", action="store_true", help="do not use numpy even when installed")
+    args = parser.parse_args(argv)
+
+    if args.no_numpy:
+        _histogram.np = None
+
+    result = analyse(args.paths)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+
+    for group, g in result.items():
+        _print_stats(group, g['total'], detailed=True)
+        for session, stats in g['sessions'].items():
+            _print_stats("  " + session, stats, detailed=False)
+        print()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
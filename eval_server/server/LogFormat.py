@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+"""
+Compact binary format for the evaluation logs, and a reader which streams
+either the JSON lines written by Logger or the binary format.
+
+A binary log is a sequence of segments, each one starting with MAGIC
+(a new segment is started every time a Logger opens the file). A segment
+contains records, each one starting with a one byte tag:
+    'R' fixed width record, see _RECORD
+    'S' defines the code of an action string not in ACTIONS, valid until the end of the segment
+    'J' a JSON encoded record, used when a record does not fit the fixed width layout
+        (e.g. a malformed game state sent by the eval client)
+
+usage: python3 LogFormat.py convert <input> <output>
+       python3 LogFormat.py cat <input>...
+"""
+
+import json
+import struct
+import sys
+
+from Helper import Action
+
+MAGIC = b'\x00EVB1\n'
+
+# the keys of Player.get_dict, in the order they are stored
+FIELDS  = ('hp', 'bullets', 'bombs', 'shield_hp', 'deaths', 'shields')
+PLAYERS = ('p1', 'p2')
+
+# action strings with a fixed code, codes of other strings are defined by 'S' records
+ACTIONS = ("", Action.none, Action.shoot, Action.shield, Action.bomb, Action.reload, Action.basket,
+           Action.soccer, Action.volley, Action.bowl, Action.logout)
+
+_TAG_RECORD = b'R'
+_TAG_STRING = b'S'
+_TAG_JSON   = b'J'
+
+# id, timestamp, response_time, player_id, correct_action, predicted_action, action_matched,
+# mask of the players present in the received and expected game states, received values, expected values
+_NUM_VALUES = len(FIELDS) * len(PLAYERS)
+_RECORD = struct.Struct('<HddbBBbB{n}h{n}h'.format(n=_NUM_VALUES))
+_STRING = struct.Struct('<BB')
+_JSON   = struct.Struct('<I')
+
+_SHORT_MIN, _SHORT_MAX = -2**15, 2**15 - 1
+
+
+class _NotEncodable(Exception):
+    pass
+
+
+def _check_int(value, lo, hi):
+    if type(value) is not int or value < lo or value > hi:
+        raise _NotEncodable()
+    return value
+
+
+def _pack_game_state(game_state, values, offset):
+    """ append the values of game_state to values, returns the presence mask of the players """
+    if type(game_state) is not dict or not set(game_state).issubset(PLAYERS):
+        raise _NotEncodable()
+    mask = 0
+    for i, p in enumerate(PLAYERS):
+        if p not in game_state:
+            values.extend([0] * len(FIELDS))
+            continue
+        player = game_state[p]
+        if type(player) is not dict or len(player) != len(FIELDS):
+            raise _NotEncodable()
+        try:
+            values.extend(_check_int(player[k], _SHORT_MIN, _SHORT_MAX) for k in FIELDS)
+        except KeyError:
+            raise _NotEncodable()
+        mask |= 1 << (i + offset)
+    return mask
+
+
+def _unpack_game_state(values, mask, offset):
+    game_state = dict()
+    for i, p in enumerate(PLAYERS):
+        if mask & (1 << (i + offset)):
+            start = i * len(FIELDS)
+            game_state[p] = dict(zip(FIELDS, values[start:start + len(FIELDS)]))
+    return game_state
+
+
+class BinaryEncoder:
+    """
+    encodes the records of one segment
+    """
+
+    def __init__(self):
+        self._codes = {a: i for i, a in enumerate(ACTIONS)}
+
+    @staticmethod
+    def header():
+        """ the bytes starting a segment """
+        return MAGIC
+
+    def _code(self, action, out):
+        """ the code of an action string, defining it in the segment if required """
+        code = self._codes.get(action)
+        if code is None:
+            if type(action) is not str or len(self._codes) > 255:
+                raise _NotEncodable()
+            raw = action.encode('utf-8')
+            if len(raw) > 255:
+                raise _NotEncodable()
+            code = len(self._codes)
+            self._codes[action] = code
+            out.append(_TAG_STRING + _STRING.pack(code, len(raw)) + raw)
+        return code
+
+    def encode(self, data):
+        """ the bytes of one log record (the dict written by Logger) """
+        out = []
+        try:
+            values = []
+            mask  = _pack_game_state(data['game_state_received'], values, 0)
+            mask |= _pack_game_state(data['game_state_expected'], values, len(PLAYERS))
+            out.append(_TAG_RECORD + _RECORD.pack(
+                _check_int(data['id'], 0, 2**16 - 1), data['timestamp'], data['response_time'],
+                _check_int(data['player_id'], -128, 127),
+                self._code(data['correct_action'], out), self._code(data['predicted_action'], out),
+                _check_int(data['action_matched'], -128, 127), mask, *values))
+        except (_NotEncodable, KeyError, TypeError, struct.error):
+            # string definitions already emitted stay valid
+            out = [o for o in out if o[:1] == _TAG_STRING]
+            raw = json.dumps(data).encode('utf-8')
+            out.append(_TAG_JSON + _JSON.pack(len(raw)) + raw)
+        return b''.join(out)
+
+
+def _iter_binary(f, chunk_size):
+    buffer  = bytearray()
+    actions = list(ACTIONS)
+    pos     = 0
+    eof     = False
+
+    def need(n):
+        """ make sure n bytes are available from pos, returns False at the end of the file """
+        nonlocal buffer, pos, eof
+        while len(buffer) - pos < n:
+            if eof:
+                return False
+            chunk = f.read(max(chunk_size, n))
+            if not chunk:
+                eof = True
+                continue
+            del buffer[:pos]
+            pos = 0
+            buffer += chunk
+        return True
+
+    while need(1):
+        tag = buffer[pos:pos + 1]
+        if tag == MAGIC[:1]:
+            if not need(len(MAGIC)) or buffer[pos:pos + len(MAGIC)] != MAGIC:
+                raise ValueError("LogFormat: corrupt segment header")
+            pos += len(MAGIC)
+            actions = list(ACTIONS)
+        elif tag == _TAG_RECORD:
+            if not need(1 + _RECORD.size):
+                raise ValueError("LogFormat: truncated record")
+            r = _RECORD.unpack_from(buffer, pos + 1)
+            pos += 1 + _RECORD.size
+            mask   = r[7]
+            values = r[8:]
+            yield {
+                'id':                  r[0],
+                'timestamp':           r[1],
+                'response_time':       r[2],
+                'player_id':           r[3],
+                'correct_action':      actions[r[4]],
+                'predicted_action':    actions[r[5]],
+                'action_matched':      r[6],
+                'game_state_received': _unpack_game_state(values[:_NUM_VALUES], mask, 0),
+                'game_state_expected': _unpack_game_state(values[_NUM_VALUES:], mask, len(PLAYERS)),
+            }
+        elif tag == _TAG_STRING:
+            if not need(1 + _STRING.size):
+                raise ValueError("LogFormat: truncated string")
+            code, n = _STRING.unpack_from(buffer, pos + 1)
+            if not need(1 + _STRING.size + n):
+                raise ValueError("LogFormat: truncated string")
+            start = pos + 1 + _STRING.size
+            actions[len(actions):code + 1] = [None] * (code + 1 - len(actions))
+            actions[code] = buffer[start:start + n].decode('utf-8')
+            pos = start + n
+        elif tag == _TAG_JSON:
+            if not need(1 + _JSON.size):
+                raise ValueError("LogFormat: truncated record")
+            n, = _JSON.unpack_from(buffer, pos + 1)
+            if not need(1 + _JSON.size + n):
+                raise ValueError("LogFormat: truncated record")
+            start = pos + 1 + _JSON.size
+            yield json.loads(buffer[start:start + n])
+            pos = start + n
+        else:
+            raise ValueError("LogFormat: unknown record tag {}".format(tag))
+
+
+def _iter_json(f):
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def is_binary(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def iter_records(path, chunk_size=1 << 20):
+    """
+    stream the records of a log file in either format as the dicts written by Logger
+    """
+    if is_binary(path):
+        with open(path, 'rb') as f:
+            yield from _iter_binary(f, chunk_size)
+    else:
+        with open(path, 'rb') as f:
+            yield from _iter_json(f)
+
+
+def convert(path_in, path_out):
+    """
+    convert a log file into the other format, returns the number of records
+    """
+    count = 0
+    if is_binary(path_in):
+        with open(path_out, 'w') as f:
+            for data in iter_records(path_in):
+                f.write(json.dumps(data) + '\n')
+                count += 1
+    else:
+        encoder = BinaryEncoder()
+        with open(path_out, 'wb') as f:
+            f.write(encoder.header())
+            for data in iter_records(path_in):
+                f.write(encoder.encode(data))
+                count += 1
+    return count
+
+
+def main(argv):
+    if len(argv) == 3 and argv[0] == "convert":
+        count = convert(argv[1], argv[2])
+        print("converted {} records: {} -> {}".format(count, argv[1], argv[2]))
+    elif len(argv) >= 2 and argv[0] == "cat":
+        for path in argv[1:]:
+            for data in iter_records(path):
+                print(json.dumps(data))
+    else:
+        print(__doc__)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
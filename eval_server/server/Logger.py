@@ -1,3 +1,4 @@
+import asyncio
 import json
 import os
 import time
@@ -5,27 +6,130 @@ import random as random
 
 import aiofiles as aiofiles
 
+from Helper import ice_print_group_name
+from LogFormat import BinaryEncoder
+
+# the folder of the logs, EVAL_LOG_DIR overrides it (the load tests point it at a temporary folder)
+LOG_DIR = os.environ.get('EVAL_LOG_DIR') or os.path.join(os.path.dirname(__file__), 'evaluation_logs')
+
 
 class Logger:
     """
     class log team performance.
+    The log file is kept open for the whole session, records are queued in memory
+    and written in batches by a background task.
     """
 
-    def __init__(self, group_name, num_players):
+    def __init__(self, group_name, num_players, flush_size=64, flush_interval=1.0, max_queued=4096,
+                 binary=False, metrics=None):
         # create the folder for the logs
-        log_dir = os.path.join(os.path.dirname(__file__), 'evaluation_logs')
+        log_dir = LOG_DIR
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
 
+        self.group_name = group_name
         self.log_filepath_json = os.path.join(log_dir, '{}_{}_logs.json'.format(group_name, num_players))
+        self.log_filepath_bin  = os.path.join(log_dir, '{}_{}_logs.bin'.format(group_name, num_players))
+
+        # compact fixed width records, see LogFormat
+        self.binary     = binary
+        self._encoder   = BinaryEncoder() if binary else None
 
         # used to distinguish 2 different usages of eval_server for the same group
         # not foolproof, needs manual verification
         self.random_id = random.randint(1, 10 * 1000)
 
-    async def write_state (self, response_time: float, player_id: int,
-                           correct_action: str, predicted_action: str, action_matched: int,
-                           game_state_received: dict, game_state_expected: dict):
+        self.flush_size     = flush_size        # flush as soon as these many records are queued
+        self.flush_interval = flush_interval    # flush at least this often (seconds) while records are queued
+        self.max_queued     = max_queued        # bound on the records waiting in memory
+
+        # instrumentation counters
+        self.num_queued     = 0     # records accepted into the queue
+        self.num_dropped    = 0     # records dropped because the log was closed or could not be opened
+        self.num_flushed    = 0     # records written to the file
+        self.metrics        = metrics   # StageMetrics recording the duration of the writes, optional
+
+        self._file          = None  # the log file, opened on the first write
+        self._records       = []    # serialized records waiting to be written
+        self._wakeup        = asyncio.Event()  # set when the queue reaches flush_size
+        self._lock          = asyncio.Lock()   # serializes opening and writing the file
+        self._open_task     = None  # task opening the file and starting the flush task
+        self._flush_task    = None  # background task writing the queued records
+        self._closed        = False
+        self._open_failed   = False
+
+    def _start(self):
+        """ open the file in the background on the first record """
+        if self._open_task is None:
+            self._open_task = asyncio.get_event_loop().create_task(self._open())
+
+    async def _open(self):
+        """ open the log file and start the background flush task """
+        # append mode creates the file on the first write
+        async with self._lock:
+            if self.binary:
+                self._file = await aiofiles.open(self.log_filepath_bin, mode='ab')
+                await self._file.write(self._encoder.header())
+            else:
+                self._file = await aiofiles.open(self.log_filepath_json, mode='a')
+            self._flush_task    = asyncio.get_event_loop().create_task(self._flush_loop())
+
+    async def _opened(self):
+        """ wait for the file to be opened, returns False (reported once) if it could not be """
+        try:
+            await self._open_task
+        except OSError as e:
+            if self._file is None and not self._open_failed:
+                self._open_failed = True
+                ice_print_group_name(self.group_name, "Logger: could not open the log file:", e)
+            return False
+        return True
+
+    async def _flush_loop(self):
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """ write all the queued records to the file """
+        if self._file is None or not self._records:
+            return
+        async with self._lock:
+            start_time = time.perf_counter()
+            records, self._records = self._records, []
+            await self._file.write(b''.join(records) if self.binary else ''.join(records))
+            await self._file.flush()
+            self.num_flushed += len(records)
+            if self.metrics is not None:
+                self.metrics.record("log_write", time.perf_counter() - start_time)
+
+    async def close(self):
+        """ flush the remaining records and close the file, called at the end of the session """
+        if self._closed:
+            return
+        self._closed = True
+        if self._open_task is None or not await self._opened():
+            self.num_dropped += len(self._records)
+            self._records = []
+            return
+        # wake up the flush task so that it exits after writing what is queued
+        self._wakeup.set()
+        await self._flush_task
+        await self.flush()
+        await self._file.close()
+        self._file = None
+
+    def stats(self):
+        """ the instrumentation counters """
+        return {'queued': self.num_queued, 'dropped': self.num_dropped, 'flushed': self.num_flushed,
+                'pending': len(self._records)}
+
+    def _record(self, response_time, player_id, correct_action, predicted_action, action_matched,
+                game_state_received, game_state_expected):
         data = dict()
         data['id']                  = self.random_id
         data['timestamp']           = time.time()
@@ -36,11 +140,48 @@ class Logger:
         data['action_matched']      = action_matched
         data['game_state_received'] = game_state_received
         data['game_state_expected'] = game_state_expected
+        if self.binary:
+            return self._encoder.encode(data)
+        # the json module whether or not orjson is installed, the log lines keep the same format
+        return json.dumps(data) + '\n'
+
+    def _enqueue(self, record):
+        self._start()
+        self._records.append(record)
+        self.num_queued += 1
+        if len(self._records) >= self.flush_size:
+            self._wakeup.set()
 
-        log_filepath = self.log_filepath_json
-        mode = 'a'
-        if not os.path.exists(log_filepath):  # first write
-            mode = 'w'
+    def log_state (self, response_time: float, player_id: int,
+                   correct_action: str, predicted_action: str, action_matched: int,
+                   game_state_received: dict, game_state_expected: dict):
+        """
+        fire-and-forget logging: queue the record and return immediately.
+        returns False without queuing the record when the queue is full (or the log closed),
+        the caller then applies back pressure by awaiting write_state with the same record
+        """
+        if self._closed or len(self._records) >= self.max_queued:
+            return False
+        self._enqueue(self._record(response_time, player_id, correct_action, predicted_action, action_matched,
+                                   game_state_received, game_state_expected))
+        return True
 
-        async with aiofiles.open(log_filepath, mode=mode) as f:
-            await f.write(json.dumps(data) + '\n')
+    async def write_state (self, response_time: float, player_id: int,
+                           correct_action: str, predicted_action: str, action_matched: int,
+                           game_state_received: dict, game_state_expected: dict):
+        """
+        queue the record, waiting for the queue to be written when it is full
+        """
+        if self._closed:
+            self.num_dropped += 1
+            return
+        record = self._record(response_time, player_id, correct_action, predicted_action, action_matched,
+                              game_state_received, game_state_expected)
+        if len(self._records) >= self.max_queued:
+            # back pressure: write the queue before accepting more records
+            self._start()
+            if not await self._opened():
+                self.num_dropped += 1
+                return
+            await self.flush()
+        self._enqueue(record)
@@ -0,0 +1,46 @@
+import asyncio
+
+from Histogram import Histogram
+
+
+class LoopMonitor:
+    """
+    class measuring how long the event loop is blocked.
+    A background task sleeps for interval and records how late it wakes up: any callback
+    running on the loop for longer than the interval (e.g. decrypting a large frame)
+    shows up as lag, and delays the timers and sends of every other session by as much.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval   = interval
+        self.lag        = Histogram()   # seconds the wake ups were late
+        self._task      = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        self.lag = Histogram()
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            start_time = loop.time()
+            await asyncio.sleep(self.interval)
+            self.lag.add(max(0.0, loop.time() - start_time - self.interval))
+
+    def stats(self):
+        """ the lag in milliseconds """
+        lag = self.lag
+        if lag.count == 0:
+            return {'samples': 0}
+        return {'samples':  lag.count,
+                'mean_ms':  round(lag.mean() * 1000, 3),
+                'p99_ms':   round(lag.percentile(99) * 1000, 3),
+                'max_ms':   round(lag.max * 1000, 3)}
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+from Histogram import Histogram
+
+# the stages of a step, in the order they happen
+STAGES = ("receive",            # waiting for the frame of the eval client
+          "decrypt",            # AES decryption (per batch of frames in the pipelined mode)
+          "parse",              # json parsing of the decrypted frames
+          "simulate",           # GameState.perform_action
+          "diff",               # comparing the received game state with the expected one
+          "log",                # serializing and queueing the log record
+          "send_game_state",    # sending the expected game state back to the eval client
+          "ws_send",            # sending the updates to the web client
+          "log_write",          # writing a batch of log records to the file, in the background
+          "response")           # the response time of the eval client, as reported by send_stat
+
+
+class StageMetrics:
+    """
+    class recording the durations of the stages of processing a step in histograms
+    """
+
+    def __init__(self):
+        self.stages = dict()    # stage -> Histogram of the durations in seconds
+
+    def record(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.add(seconds)
+
+    def merge(self, other):
+        for stage, histogram in other.stages.items():
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].merge(histogram)
+
+    def _ordered(self):
+        return [s for s in STAGES if s in self.stages] + sorted(s for s in self.stages if s not in STAGES)
+
+    def to_dict(self):
+        """ the durations in milliseconds """
+        result = dict()
+        for stage in self._ordered():
+            h = self.stages[stage]
+            result[stage] = {'count':   h.count,
+                             'mean_ms': round(h.mean() * 1000, 3),
+                             'p50_ms':  round(h.percentile(50) * 1000, 3),
+                             'p90_ms':  round(h.percentile(90) * 1000, 3),
+                             'p99_ms':  round(h.percentile(99) * 1000, 3),
+                             'max_ms':  round(h.max * 1000, 3)}
+        return result
+
+    def summary(self):
+        """ one line with the mean and p99 of every stage in milliseconds """
+        return "; ".join("{} {:.2f}/{:.2f}".format(stage, self.stages[stage].mean() * 1000,
+                                                   self.stages[stage].percentile(99) * 1000)
+                         for stage in self._ordered())
+
+
+async def serve_metrics(snapshot, host="127.0.0.1", port=8002):
+    """
+    serve the dictionary returned by snapshot() as JSON over HTTP, every path returns it
+    e.g. curl http://127.0.0.1:8002/metrics
+    """
+    async def handle(reader, writer):
+        try:
+            await reader.readuntil(b'\r\n\r\n')
+            body = json.dumps(snapshot(), indent=2).encode("utf-8")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nContent-Length: " +
+                         str(len(body)).encode("utf-8") + b"\r\nConnection: close\r\n\r\n" + body)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
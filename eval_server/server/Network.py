@@ -0,0 +1,42 @@
+import asyncio
+import socket
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional, it is a faster event loop
+    uvloop = None
+
+# socket options of the high performance network mode, see tune_socket
+SOCKET_OPTIONS = dict(nodelay=True, sndbuf=256 * 1024, rcvbuf=256 * 1024, keepalive=True)
+
+
+def install_uvloop():
+    """
+    use uvloop for the event loops created from now on (asyncio.run), returns False if it is not installed
+    """
+    if uvloop is None:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+def tune_socket(sock, nodelay=True, sndbuf=None, rcvbuf=None, keepalive=False):
+    """
+    set the options of a TCP socket.
+    nodelay disables Nagle's algorithm so that small writes (the game state replies) are sent at once.
+    The buffer sizes are taken into account for the TCP window only when they are set before
+    listen() / connect(), the sockets returned by accept() inherit them from the listening socket.
+    """
+    if nodelay:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    if sndbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    if keepalive:
+        # detect an eval client which disappeared without closing the connection
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,  30)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT,   3)
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+
+from Decryptor import Decryptor
+from Histogram import Histogram
+
+EXECUTOR_KINDS = ("none", "thread", "process")
+
+_local = threading.local()  # Decryptor per key, cached in every thread / worker process
+
+
+def decrypt_and_parse(decryptor, frames):
+    """
+    decrypt the frames and parse their json.
+    returns a list of (the text or the exception raised while decrypting, the parsed json or None),
+    the seconds spent decrypting and the seconds spent parsing
+    """
+    start_time = perf_counter()
+    texts = decryptor.decrypt_many(frames)
+    decrypt_time = perf_counter() - start_time
+
+    results = []
+    for text in texts:
+        data = None
+        if not isinstance(text, Exception):
+            try:
+                data = json.loads(text)
+            except ValueError:
+                # e.g. "hello", the caller decides if it is an error
+                pass
+        results.append((text, data))
+    return results, decrypt_time, perf_counter() - start_time - decrypt_time
+
+
+def _decrypt_and_parse_key(secret_key, frames):
+    """ decrypt_and_parse in a worker process, which only gets the key """
+    decryptors = getattr(_local, "decryptors", None)
+    if decryptors is None:
+        decryptors = _local.decryptors = dict()
+    decryptor = decryptors.get(secret_key)
+    if decryptor is None:
+        if len(decryptors) >= 256:
+            decryptors.clear()
+        decryptor = decryptors[secret_key] = Decryptor(secret_key)
+    return decrypt_and_parse(decryptor, frames)
+
+
+class CryptoOffload:
+    """
+    class deciding where the frames of the clients are decrypted and parsed.
+    Frames smaller than threshold bytes (in total for a batch) are handled inline on the
+    event loop, which is cheaper than the round trip through an executor. Larger ones go to
+    a thread pool (the AES calls of PyCryptodome run without the GIL) or a process pool.
+    """
+
+    def __init__(self, kind="thread", workers=2, threshold=4096):
+        self.kind       = kind
+        self.workers    = workers
+        self.threshold  = threshold
+        self._executor  = None
+
+        # instrumentation
+        self.num_inline     = 0             # frames decrypted on the event loop
+        self.num_offloaded  = 0             # frames decrypted in the executor
+        self.inline_time    = Histogram()   # seconds the event loop was blocked per inline batch
+        self.offload_time   = Histogram()   # seconds waited for the executor per batch, the loop keeps running
+
+    def configure(self, kind=None, workers=None, threshold=None):
+        if kind is not None and kind not in EXECUTOR_KINDS:
+            raise ValueError("CryptoOffload: unknown executor {}".format(kind))
+        self.shutdown()
+        if kind is not None:
+            self.kind = kind
+        if workers is not None:
+            self.workers = workers
+        if threshold is not None:
+            self.threshold = threshold
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="crypto")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def run(self, decryptor, frames, metrics=None):
+        """
+        decrypt_and_parse the frames of a client, in the executor if they are large.
+        the decrypt and parse durations are recorded in metrics (a StageMetrics) if given
+        """
+        if self.kind == "none" or sum(len(f) for f in frames) < self.threshold:
+            start_time = perf_counter()
+            results, decrypt_time, parse_time = decrypt_and_parse(decryptor, frames)
+            self.inline_time.add(perf_counter() - start_time)
+            self.num_inline += len(frames)
+        else:
+            results, decrypt_time, parse_time = await self._run_in_executor(decryptor, frames)
+
+        if metrics is not None:
+            metrics.record("decrypt", decrypt_time)
+            metrics.record("parse",   parse_time)
+        return results
+
+    async def _run_in_executor(self, decryptor, frames):
+        loop = asyncio.get_event_loop()
+        start_time = perf_counter()
+        if self.kind == "process":
+            results = await loop.run_in_executor(self._get_executor(), _decrypt_and_parse_key,
+                                                 decryptor.secret_key.decode("utf8"), frames)
+        else:
+            # the frames of one client are processed one batch at a time, its decryptor is not shared
+            results = await loop.run_in_executor(self._get_executor(), decrypt_and_parse, decryptor, frames)
+        self.offload_time.add(perf_counter() - start_time)
+        self.num_offloaded += len(frames)
+        return results
+
+    def stats(self):
+        """ the times in milliseconds """
+        def summary(h):
+            if h.count == 0:
+                return None
+            return {'mean_ms': round(h.mean() * 1000, 3), 'max_ms': round(h.max * 1000, 3)}
+        return {'executor':     self.kind,
+                'inline':       self.num_inline,
+                'offloaded':    self.num_offloaded,
+                'inline_time':  summary(self.inline_time),
+                'offload_time': summary(self.offload_time)}
+
+
+offload = CryptoOffload()   # shared by all the clients of the process, configured by WebSocketServer.main
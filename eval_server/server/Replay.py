@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""
+Replay the sessions of the evaluation logs through GameState.perform_action
+to regression test changes to the game logic against real historical traffic.
+
+The logs do not record the positions of the players, so for every action the
+replay tries all the positions which can make a difference (the position of
+the opponent and whether the players can see each other) and keeps the game
+states which reproduce the logged game_state_expected. A session passes if
+every logged expected state can be reproduced by the current game rules.
+Both values of does_not_have_visualizer are tried and the best one is kept.
+
+usage: python3 Replay.py [--processes N] [--verbose] <log file>...
+"""
+
+import argparse
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from GameState import GameState
+from LogAnalytics import group_of
+from LogFormat import iter_records
+
+POSITIONS = (0, 1, 2, 3, 4)     # 0 is the disconnect position
+MAX_BEAM  = 64                  # bound on the candidate game states kept per session
+
+
+def _key(game_state):
+    """ game states with the same key behave the same for any further action """
+    return game_state.snapshot().tobytes()
+
+
+def _resync(game_state, expected):
+    """ force the game state to the logged expected state, the rain lists are kept """
+    for name, player in (('p1', game_state.player_1), ('p2', game_state.player_2)):
+        d = expected.get(name)
+        if d is not None:
+            player.set_state(d['bullets'], d['bombs'], d['hp'], d['deaths'], d['shields'], d['shield_hp'])
+
+
+def replay_session(records, does_not_have_visualizer):
+    """
+    replay one session, returns (number of expected states not reproduced, index of the first one,
+    number of received states matching the expected one, largest number of candidate states)
+    """
+    beam            = [GameState()]
+    num_mismatch    = 0
+    first_mismatch  = -1
+    num_received_ok = 0
+    max_beam        = 1
+
+    for index, data in enumerate(records):
+        action    = data['predicted_action']
+        player_id = data['player_id']
+        expected  = data['game_state_expected']
+
+        candidates = dict()
+        for game_state in beam:
+            for opponent_position in POSITIONS:
+                # the position of the attacker only matters through the visibility
+                for attacker_position in (1, 4):
+                    if player_id == 1:
+                        position_1, position_2 = attacker_position, opponent_position
+                    else:
+                        position_1, position_2 = opponent_position, attacker_position
+                    candidate = game_state.copy()
+                    candidate.perform_action(action, player_id, position_1, position_2, does_not_have_visualizer)
+                    if candidate.get_dict() == expected:
+                        candidates.setdefault(_key(candidate), candidate)
+
+        if candidates:
+            beam = list(candidates.values())[:MAX_BEAM]
+        else:
+            # the game rules can not reproduce the logged state
+            num_mismatch += 1
+            if first_mismatch < 0:
+                first_mismatch = index
+            for game_state in beam:
+                _resync(game_state, expected)
+            beam = list({_key(g): g for g in beam}.values())
+        max_beam = max(max_beam, len(beam))
+
+        if data['game_state_received'] == expected:
+            num_received_ok += 1
+
+    return num_mismatch, first_mismatch, num_received_ok, max_beam
+
+
+def _replay(session):
+    """ replay a session with both visualizer settings, keep the one which reproduces more states """
+    name, records = session
+    best = None
+    for does_not_have_visualizer in (False, True):
+        result = replay_session(records, does_not_have_visualizer)
+        if best is None or result[0] < best[0]:
+            best = result + (does_not_have_visualizer,)
+    num_mismatch, first_mismatch, num_received_ok, max_beam, does_not_have_visualizer = best
+    return {'session':              name,
+            'records':              len(records),
+            'expected_mismatch':    num_mismatch,
+            'first_mismatch':       first_mismatch,
+            'received_match':       num_received_ok,
+            'candidates':           max_beam,
+            'no_visualizer':        does_not_have_visualizer}
+
+
+def load_sessions(paths):
+    """ group the records of the log files by session, keeping their order """
+    sessions = dict()
+    for path in paths:
+        group, num_players = group_of(path)
+        for data in iter_records(path):
+            name = "{}_{}:{}".format(group, num_players, data['id'])
+            sessions.setdefault(name, []).append(data)
+    return list(sessions.items())
+
+
+def replay_all(sessions, processes=0, chunksize=32):
+    """ replay the sessions, in a process pool when processes > 1 """
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(_replay, sessions, chunksize=chunksize))
+    return [_replay(s) for s in sessions]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="replay the evaluation logs through GameState")
+    parser.add_argument("paths", nargs="+", help="log files (JSON lines or binary)")
+    parser.add_argument("--processes", type=int, default=0, help="size of the process pool, 0 to replay inline")
+    parser.add_argument("--verbose", action="store_true", help="print every session")
+    args = parser.parse_args(argv)
+
+    sessions = load_sessions(args.paths)
+    start = perf_counter()
+    results = replay_all(sessions, args.processes)
+    elapsed = perf_counter() - start
+
+    num_records = sum(r['records'] for r in results)
+    failed = [r for r in results if r['expected_mismatch']]
+    for r in results:
+        if args.verbose or r['expected_mismatch']:
+            print("{session:<16} records={records:<4} expected_mismatch={expected_mismatch:<3} "
+                  "first_mismatch={first_mismatch:<3} received_match={received_match:<4} "
+                  "candidates={candidates:<3} no_visualizer={no_visualizer}".format(**r))
+    print("replayed {} sessions, {} records in {:.3f}s; {} sessions not reproduced".format(
+        len(results), num_records, elapsed, len(failed)))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
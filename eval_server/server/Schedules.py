@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+"""
+Seeded move schedules: the schedule id seeds the generator of GameSimulator.make_moves, so a
+(schedule id, number of players) pair always gives the same list of moves.
+Schedules can be pre-generated into a file, which the eval server loads at start up (SCHEDULE_FILE
+in WebSocketServer.py); a session picks one with "schedule": <id> in the handshake of the web client.
+
+usage: python3 Schedules.py generate schedules.bin [--count 1000] [--first 0] [--players 1 2]
+       python3 Schedules.py show schedules.bin <schedule id> [--players 2]
+"""
+
+import argparse
+import random
+import struct
+import sys
+from collections import OrderedDict
+
+from GameSimulator import GameSimulator, _Move
+from Helper import Action
+
+# a move is stored in 2 bytes, one per player: (index of the action in SCHEDULE_ACTIONS << 3) | position
+SCHEDULE_ACTIONS = (Action.none, Action.shoot, Action.shield, Action.bomb, Action.reload,
+                    Action.basket, Action.soccer, Action.volley, Action.bowl, Action.logout)
+_ACTION_INDEX    = {action: i for i, action in enumerate(SCHEDULE_ACTIONS)}
+
+_MAGIC  = b'SCH1'
+_HEADER = struct.Struct('<IBB')     # schedule id, number of players, number of moves, followed by the moves
+
+MAX_SCHEDULE_ID = 2 ** 32 - 1
+MAX_CACHED      = 256   # lists of moves kept in memory, the least recently used one is dropped first
+
+
+def generate_moves(schedule_id, num_players):
+    """ the moves of a schedule """
+    return GameSimulator.make_moves(num_players, random.Random(schedule_id))
+
+
+def pack_moves(moves):
+    """ the moves of a schedule in 2 bytes per move """
+    return bytes(b for move in moves for b in (_ACTION_INDEX[move.action_1] << 3 | move.position_1,
+                                               _ACTION_INDEX[move.action_2] << 3 | move.position_2))
+
+
+def unpack_moves(packed):
+    return [_Move(SCHEDULE_ACTIONS[packed[i] >> 3], packed[i] & 7, SCHEDULE_ACTIONS[packed[i+1] >> 3], packed[i+1] & 7)
+            for i in range(0, len(packed), 2)]
+
+
+class ScheduleCache:
+    """
+    class keeping the schedules in memory: the schedules loaded from a file or pre-generated are kept packed,
+    any other schedule is generated when it is asked for. The lists of moves of the max_cached most recently
+    used schedules are shared by the sessions playing them, so the memory stays bounded whatever the ids
+    the web clients ask for
+    """
+
+    def __init__(self, path=None, max_cached=MAX_CACHED):
+        self.schedules      = dict()        # (schedule id, num_players) -> packed moves
+        self._moves         = OrderedDict() # (schedule id, num_players) -> list of moves, least recently used first
+        self.max_cached     = max_cached
+        self.num_generated  = 0
+        if path:
+            self.load(path)
+
+    def get(self, schedule_id, num_players):
+        """ the moves of a schedule, raises ValueError for an id which does not fit the file format """
+        key   = (schedule_id, num_players)
+        moves = self._moves.get(key)
+        if moves is not None:
+            self._moves.move_to_end(key)
+            return moves
+        if not 0 <= schedule_id <= MAX_SCHEDULE_ID:
+            raise ValueError("schedule id out of range: {}".format(schedule_id))
+        packed = self.schedules.get(key)
+        if packed is None:
+            moves = generate_moves(schedule_id, num_players)
+            self.num_generated += 1
+        else:
+            moves = unpack_moves(packed)
+        self._moves[key] = moves
+        if len(self._moves) > self.max_cached:
+            self._moves.popitem(last=False)
+        return moves
+
+    def pregenerate(self, schedule_ids, num_players):
+        """ generate schedules to be kept (and saved) packed """
+        for schedule_id in schedule_ids:
+            if not 0 <= schedule_id <= MAX_SCHEDULE_ID:
+                raise ValueError("schedule id out of range: {}".format(schedule_id))
+            self.schedules[(schedule_id, num_players)] = pack_moves(generate_moves(schedule_id, num_players))
+            self.num_generated += 1
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("not a schedule file: {}".format(path))
+        offset = len(_MAGIC)
+        while offset < len(data):
+            schedule_id, num_players, num_moves = _HEADER.unpack_from(data, offset)
+            offset += _HEADER.size
+            self.schedules[(schedule_id, num_players)] = data[offset:offset + 2 * num_moves]
+            offset += 2 * num_moves
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(_MAGIC)
+            for (schedule_id, num_players), packed in sorted(self.schedules.items()):
+                f.write(_HEADER.pack(schedule_id, num_players, len(packed) // 2))
+                f.write(packed)
+
+    def __len__(self):
+        """ the number of packed schedules, loaded or pre-generated """
+        return len(self.schedules)
+
+    def num_cached(self):
+        """ the number of lists of moves in memory """
+        return len(self._moves)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="pre-generate and show the move schedules")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("generate", help="generate schedules into a file")
+    p.add_argument("path")
+    p.add_argument("--count",   type=int, default=1000, help="number of schedules per number of players")
+    p.add_argument("--first",   type=int, default=0,    help="id of the first schedule")
+    p.add_argument("--players", type=int, default=[1, 2], nargs="+", choices=(1, 2))
+
+    p = subparsers.add_parser("show", help="print the moves of a schedule")
+    p.add_argument("path")
+    p.add_argument("schedule_id", type=int)
+    p.add_argument("--players", type=int, default=2, choices=(1, 2))
+
+    args = parser.parse_args(argv)
+    if args.command == "generate":
+        cache = ScheduleCache()
+        for num_players in args.players:
+            cache.pregenerate(range(args.first, args.first + args.count), num_players)
+        cache.save(args.path)
+        print("{} schedules written to {}".format(len(cache), args.path))
+    else:
+        cache = ScheduleCache(args.path)
+        if (args.schedule_id, args.players) not in cache.schedules:
+            print("schedule {} ({} players) is not in {}, generating it".format(args.schedule_id, args.players,
+                                                                                 args.path))
+        for i, move in enumerate(cache.get(args.schedule_id, args.players)):
+            print("{:>3} {}".format(i + 1, move))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+Sharded deployment of the eval server for many concurrent groups.
+
+The front process listens on the WebSocket port (8001) and hands every new
+browser connection to the worker process with the fewest sessions, relaying
+its bytes. Each worker runs WebSocketServer.handler in its own event loop with
+its own Client objects, so the TCP listener of every session (the port shown
+on the webpage) is in the worker and the eval client traffic (AES decryption,
+JSON parsing, game state updates) never goes through the front process.
+The group names connected to any worker are kept in a shared dictionary so
+that duplicate connections of a group are denied across workers. A worker
+which died is restarted and the groups it held are removed from the dictionary.
+
+usage: python3 ShardedServer.py [--workers N] [--port 8001]
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+
+import WebSocketServer
+from Network import install_uvloop
+
+WORKER_BASE_PORT = 18001    # worker i listens on 127.0.0.1:WORKER_BASE_PORT + i
+WORKER_CHECK_INTERVAL = 1.0 # seconds between the checks for dead workers
+
+
+def _worker_main(port, metrics_port, eval_port, shared_groups):
+    """ entry point of a worker process """
+    WebSocketServer.shared_groups = shared_groups
+    if WebSocketServer.HIGH_PERF_NETWORK:
+        install_uvloop()
+    print ("worker {} serving on port {}".format(os.getpid(), port))
+    try:
+        asyncio.run(WebSocketServer.main("127.0.0.1", port, metrics_port, eval_port))
+    except KeyboardInterrupt:
+        pass
+
+
+class _Worker:
+    def __init__(self, index, shared_groups):
+        self.port       = WORKER_BASE_PORT + index
+        self.sessions   = 0     # browser connections currently handed to this worker
+        # the metrics of worker i are on METRICS_PORT + 1 + i
+        metrics_port    = WebSocketServer.METRICS_PORT and WebSocketServer.METRICS_PORT + 1 + index
+        # with a shared eval client port, the eval clients of worker i connect to SHARED_EVAL_PORT + i
+        eval_port       = WebSocketServer.SHARED_EVAL_PORT and WebSocketServer.SHARED_EVAL_PORT + index
+        self.args       = (self.port, metrics_port, eval_port, shared_groups)
+        self.process    = None
+        self.start()
+
+    def start(self):
+        self.process = multiprocessing.Process(target=_worker_main, args=self.args, daemon=True)
+        self.process.start()
+
+
+async def _relay(reader, writer):
+    try:
+        while True:
+            data = await reader.read(64 * 1024)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+class ShardedServer:
+    """
+    front process handing the browser connections to the worker processes
+    """
+
+    def __init__(self, num_workers):
+        self.manager        = multiprocessing.Manager()
+        self.shared_groups  = self.manager.dict()
+        self.workers        = [_Worker(i, self.shared_groups) for i in range(num_workers)]
+
+    async def _connect_worker(self, worker):
+        """ connect to a worker, waiting for it to start listening """
+        for _ in range(100):
+            try:
+                return await asyncio.open_connection("127.0.0.1", worker.port)
+            except ConnectionRefusedError:
+                await asyncio.sleep(0.05)
+        raise ConnectionRefusedError("worker on port {} is not listening".format(worker.port))
+
+    def _forget_groups(self, pid):
+        """
+        remove the groups registered by the worker process pid from the shared dictionary,
+        the tokens of WebSocketServer.register_group are "<pid>:<client id>"
+        """
+        prefix = "{}:".format(pid)
+        for group_name, token in self.shared_groups.items():
+            if token.startswith(prefix):
+                self.shared_groups.pop(group_name, None)
+
+    def _check_workers(self):
+        """ restart the dead workers, their groups can connect again """
+        for worker in self.workers:
+            if worker.process.is_alive():
+                continue
+            pid = worker.process.pid
+            print ("ShardedServer: worker {} on port {} died (exit code {}), restarting it".format(
+                pid, worker.port, worker.process.exitcode))
+            self._forget_groups(pid)
+            worker.start()
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            self._check_workers()
+
+    async def _handle(self, reader, writer):
+        self._check_workers()
+        worker = min(self.workers, key=lambda w: w.sessions)
+        worker.sessions += 1
+        try:
+            worker_reader, worker_writer = await self._connect_worker(worker)
+            await asyncio.gather(_relay(reader, worker_writer), _relay(worker_reader, writer))
+        except OSError as e:
+            print ("ShardedServer: could not reach worker on port {}: {}".format(worker.port, e))
+            writer.close()
+        finally:
+            worker.sessions -= 1
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self._handle, host, port)
+        # SIGTERM stops the server like Ctrl-C, main then terminates the workers
+        stopped = asyncio.get_event_loop().create_future()
+        asyncio.get_event_loop().add_signal_handler(signal.SIGTERM, stopped.set_result, None)
+        print ("Waiting for new websocket client, {} workers".format(len(self.workers)))
+        monitor = asyncio.ensure_future(self._monitor())
+        try:
+            await stopped
+        finally:
+            monitor.cancel()
+            server.close()
+
+    def stop(self):
+        for worker in self.workers:
+            worker.process.terminate()
+        self.manager.shutdown()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="sharded eval server")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--port",    type=int, default=8001, help="WebSocket port of the front process")
+    args = parser.parse_args(argv)
+
+    if WebSocketServer.HIGH_PERF_NETWORK:
+        install_uvloop()
+    server = ShardedServer(args.workers)
+    try:
+        asyncio.run(server.serve("", args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
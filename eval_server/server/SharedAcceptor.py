@@ -0,0 +1,122 @@
+import asyncio
+import socket
+
+from Client import HELLO, HELLO_DELTA
+from FrameReader import FrameReader
+from Network import tune_socket
+
+
+class SharedAcceptor:
+    """
+    class accepting the connections of the eval clients of all the groups on a single TCP port.
+    A connection is handed to the waiting Client it belongs to according to its first frame,
+    the encrypted "hello" which Client.verify_password checks:
+        1) "<group_name>:<base64 cipher>" goes to the client of that group
+        2) a plain base64 cipher (what the eval clients send on their own port) goes to the
+           waiting client whose key decrypts it into "hello" (or "hello delta")
+    Any other connection is closed; with a wrong password the client times out waiting for its connection
+    """
+
+    def __init__(self, port, host="", socket_options=None, timeout=60):
+        self.port           = port
+        self.timeout        = timeout           # for receiving the first frame of a connection
+        self.socket_options = socket_options    # keyword arguments of Network.tune_socket, optional
+        self.waiting        = []                # (client, future) of the clients waiting for their connection
+        self._routing       = set()             # tasks reading the first frame of the new connections
+        self._task          = None
+
+        # instrumentation counters
+        self.num_accepted   = 0     # connections accepted
+        self.num_routed     = 0     # connections handed to a client
+        self.num_rejected   = 0     # connections closed, no client was waiting for them
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if socket_options:
+            tune_socket(self.socket, **socket_options)
+        self.socket.bind((host, port))
+        self.socket.listen(128)
+        self.socket.setblocking(False)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._accept_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.socket.close()
+
+    async def _accept_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            conn, addr = await loop.sock_accept(self.socket)
+            self.num_accepted += 1
+            if self.socket_options:
+                tune_socket(conn, **self.socket_options)
+            task = loop.create_task(self._route(conn, addr))
+            self._routing.add(task)
+            task.add_done_callback(self._routing.discard)
+
+    async def _route(self, conn, addr):
+        """ receive the first frame of a connection and hand the connection to its client """
+        reader = FrameReader(conn)
+        try:
+            frame = await asyncio.wait_for(reader.read_frame(), timeout=self.timeout)
+        except (asyncio.TimeoutError, OSError, ValueError):
+            frame = None
+
+        entry, text = (None, "") if frame is None else self._match(frame)
+        if entry is None:
+            self.num_rejected += 1
+            print ("SharedAcceptor: no client is waiting for the connection from", addr)
+            conn.close()
+            return
+
+        self.waiting.remove(entry)
+        self.num_routed += 1
+        entry[1].set_result((conn, addr, reader, text))
+
+    def _match(self, frame):
+        """ the waiting (client, future) the first frame belongs to and the decrypted text """
+        waiting = [entry for entry in self.waiting if not entry[1].done()]
+
+        sep = frame.find(b':')
+        if sep >= 0:
+            group_name = frame[:sep].decode("utf8", "replace")
+            for entry in waiting:
+                if entry[0].group_name == group_name:
+                    return entry, entry[0].decrypt_message(frame[sep+1:])
+            return None, ""
+
+        for entry in waiting:
+            try:
+                text = entry[0].decryptor.decrypt(frame)
+                if text == HELLO or text == HELLO_DELTA:
+                    return entry, text
+            except ValueError:
+                # not encrypted with the key of this client
+                pass
+
+        # no key decrypts the frame: a stray connection, or an eval client with a wrong password, is closed
+        # rather than handed to a client it may not belong to
+        return None, ""
+
+    async def expect(self, client):
+        """
+        wait for the connection of the eval client of a Client
+        returns the socket, the address, the FrameReader of the socket and the text of the first frame
+        """
+        entry = (client, asyncio.get_event_loop().create_future())
+        self.waiting.append(entry)
+        try:
+            return await entry[1]
+        finally:
+            if entry in self.waiting:
+                self.waiting.remove(entry)
+
+    def stats(self):
+        """ the instrumentation counters """
+        return {'accepted': self.num_accepted, 'routed': self.num_routed, 'rejected': self.num_rejected,
+                'waiting': len(self.waiting)}
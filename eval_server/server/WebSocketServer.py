@@ -2,15 +2,62 @@
 
 import asyncio
 import json
+import os
+from json.encoder import encode_basestring_ascii
+from time import perf_counter
 
 import websockets
 import statistics
 
 from Client import Client
-from Helper import ice_print_group_name, Action
+from Helper import ice_print_group_name, Action, json_dumps
+from LoopMonitor import LoopMonitor
+from Metrics import StageMetrics, serve_metrics
+from Network import SOCKET_OPTIONS, install_uvloop
+from Offload import offload
+from Schedules import ScheduleCache
+from SharedAcceptor import SharedAcceptor
 
 client_dict = dict()  # dictionary containing all the clients
 
+# group names connected to any worker process when sharded (a multiprocessing dict proxy), see ShardedServer
+shared_groups = None
+
+# opt-in: send the updates of a step as one JSON array frame (unpacked by html/helper.js)
+BATCH_WS_MESSAGES = False
+# opt-in: receive the frames of 2-player games in a background task, see Client.start_reader
+PIPELINE_2_PLAYER = False
+
+# opt-in: frames of OFFLOAD_THRESHOLD bytes or more are decrypted and parsed in an executor instead of on the
+# event loop. OFFLOAD_EXECUTOR is "none" (everything on the event loop), "thread" or "process" ("process" is not
+# available in the ShardedServer workers)
+OFFLOAD_EXECUTOR  = "none"
+OFFLOAD_WORKERS   = 2
+OFFLOAD_THRESHOLD = 4096
+
+loop_monitor = LoopMonitor()  # how long the event loop is blocked, measured while the metrics are served
+
+# opt-in high performance network mode: uvloop when installed, TCP_NODELAY, larger buffers and
+# keepalive on the socket of the eval client (see Network.SOCKET_OPTIONS)
+HIGH_PERF_NETWORK = False
+
+# opt-in single TCP port for the eval clients of all the groups (e.g. 8100), see SharedAcceptor
+# None to give every Client a port of its own
+SHARED_EVAL_PORT = None
+shared_acceptor  = None
+
+# move schedules pre-generated with "python3 Schedules.py generate <file>", loaded at start up (None for none)
+# a web client picks a schedule with "schedule": <id> in the handshake, schedules not in the file are generated
+# when asked for and only the most recently used ones are kept (Schedules.MAX_CACHED); without a schedule id
+# the moves of a session are random
+SCHEDULE_FILE = None
+schedules     = ScheduleCache()
+
+# opt-in: stage durations, lag and offload statistics are served as JSON on http://127.0.0.1:METRICS_PORT
+# (e.g. 8002), None to disable the listener and the event loop lag monitor
+METRICS_PORT = None
+completed_metrics = StageMetrics()  # stage durations of the sessions which have ended
+
 
 class _MessageType:
     action       = "action"
@@ -23,19 +70,118 @@ class _MessageType:
     position     = "position"
 
 
+class _WsBatch:
+    """
+    Accumulates the messages to the web client and sends them as one JSON array frame.
+    ws_send_* can be given a _WsBatch in place of the websocket, flush() has to be called
+    before waiting on the web client or the eval client so the display is up to date.
+    """
+
+    def __init__(self, websocket, enabled=True, metrics=None):
+        self.websocket  = websocket
+        self.enabled    = enabled
+        self.messages   = []
+        self.metrics    = metrics   # StageMetrics recording the duration of the sends, optional
+
+    async def _send(self, data):
+        start_time = perf_counter()
+        await self.websocket.send(data)
+        if self.metrics is not None:
+            self.metrics.record("ws_send", perf_counter() - start_time)
+
+    async def send(self, message):
+        if self.enabled:
+            self.messages.append(message)
+        else:
+            await self._send(message)
+
+    async def flush(self):
+        if not self.messages:
+            return
+        if len(self.messages) == 1:
+            data = self.messages[0]
+        else:
+            # the messages are already serialized
+            data = "[" + ",".join(self.messages) + "]"
+        self.messages = []
+        await self._send(data)
+
+
+# the JSON text of the messages to the web client, with the same separators as json.dumps
+_JSON_WS_TEMPLATE = '{{"type": {}, "message": {}, "pos_1": {}, "pos_2": {}, "action_match": {}, "player_id": {}}}'
+
+
+def _json_value(value):
+    """ fast JSON encoding for the str and int values of the web client messages """
+    if type(value) is str:
+        return encode_basestring_ascii(value)
+    if type(value) is int:
+        return str(value)
+    return json_dumps(value)
+
+
+def _get_json_ws(m_type, message="", pos_1=-1, pos_2=-1, action_match=-2, player_id=-1):
+    return _JSON_WS_TEMPLATE.format(_json_value(m_type), _json_value(message), _json_value(pos_1),
+                                    _json_value(pos_2), _json_value(action_match), _json_value(player_id))
+
+
+# messages sent over and over, serialized once
+_STATIC_WS_MESSAGES = {
+    (m_type, message): _get_json_ws(m_type, message)
+    for m_type, message in (
+        (_MessageType.info,     "------------"),
+        (_MessageType.info,     "Verifying Password"),
+        (_MessageType.info_y,   "eval_client connected"),
+        (_MessageType.info_y,   "Successful"),
+        (_MessageType.info_y,   "------------------- Stat -------------------"),
+        (_MessageType.error,    "Failed"),
+        (_MessageType.error,    "Failed: Timeout"),
+        (_MessageType.error,    "Connection denied: Duplicate connection to eval_server"),
+        (_MessageType.error,    "Timeout"),
+        (_MessageType.num_move, "Eval Terminated"),
+    )
+}
+
+
+def group_connected(group_name):
+    """
+    check if the group is already connected to the server (or to another worker process)
+    """
+    return group_name in client_dict or (shared_groups is not None and group_name in shared_groups)
+
+
+def register_group(group_name, client):
+    """
+    atomically register the client of a group, returns False if the group is already connected
+    """
+    if group_connected(group_name):
+        return False
+    if shared_groups is not None:
+        token = "{}:{}".format(os.getpid(), id(client))
+        if shared_groups.setdefault(group_name, token) != token:
+            return False
+    client_dict[group_name] = client
+    return True
+
+
+def unregister_group(group_name):
+    """
+    remove the group, returns its client
+    """
+    if shared_groups is not None:
+        shared_groups.pop(group_name, None)
+    return client_dict.pop(group_name)
+
+
 def get_json_ws(m_type, message="", pos_1=-1, pos_2=-1, action_match=-2, player_id=-1):
     """
     The json corresponding to the web client
     """
-    data = {
-        "type":         m_type,
-        "message":      message,
-        "pos_1":        pos_1,
-        "pos_2":        pos_2,
-        "action_match": action_match,
-        "player_id":    player_id
-    }
-    return json.dumps(data)
+    if pos_1 == -1 and pos_2 == -1 and action_match == -2 and player_id == -1:
+        data = _STATIC_WS_MESSAGES.get((m_type, message))
+        if data is not None:
+            return data
+    return _get_json_ws(m_type, message, pos_1, pos_2, action_match, player_id)
 
 
 async def ws_send_error(websocket, message):
@@ -115,14 +261,17 @@ async def perform_handshake(message, websocket):
             does_not_have_visualizer = True
         else:
             does_not_have_visualizer = False
+        moves = get_schedule(group_name, data.get("schedule"), num_player)
 
         # check if the group is already connected to the server
-        if group_name in client_dict.keys():
+        if group_connected(group_name):
             # we do not allow more than one connection
             await ws_send_error (websocket, "Connection denied: Duplicate connection to eval_server")
         else:
             # create a Client object
-            client = Client(group_name, password, num_player, does_not_have_visualizer)
+            client = Client(group_name, password, num_player, does_not_have_visualizer,
+                            socket_options=SOCKET_OPTIONS if HIGH_PERF_NETWORK else None,
+                            acceptor=shared_acceptor, moves=moves)
             await ws_send_info(websocket, "Welcome: "+group_name)
             await ws_send_info(websocket, "------------")
             await ws_send_info(websocket, "TCP server waiting for connection from eval_client on port number "
@@ -136,17 +285,20 @@ async def perform_handshake(message, websocket):
                 await websocket.ping()
 
                 # check if some other connection established by the same group
-                if group_name in client_dict:
+                if group_connected(group_name):
                     await ws_send_error(websocket, "Connection denied: Duplicate connection to eval_server")
                 else:
                     await ws_send_info_y(websocket, "eval_client connected")
                     await ws_send_info  (websocket, "Verifying Password")
                     verified, timeout = await client.verify_password()
                     if verified:
-                        await ws_send_info_y(websocket, "Successful")
-                        await ws_send_info  (websocket, "------------")
-                        client_dict[group_name] = client
-                        success = True
+                        if register_group(group_name, client):
+                            await ws_send_info_y(websocket, "Successful")
+                            await ws_send_info  (websocket, "------------")
+                            success = True
+                        else:
+                            # another connection of the same group was verified in the meantime
+                            await ws_send_error(websocket, "Connection denied: Duplicate connection to eval_server")
                     elif timeout <= 0:
                         await ws_send_error (websocket, "Failed: Timeout")
                         await ws_send_info  (websocket, "------------")
@@ -166,6 +318,21 @@ async def perform_handshake(message, websocket):
     return success, group_name, num_player, client
 
 
+def get_schedule(group_name, schedule_id, num_players):
+    """
+    the moves of the schedule asked for in the handshake, None for random moves
+    """
+    if schedule_id is None or schedule_id == "":
+        return None
+    try:
+        moves = schedules.get(int(schedule_id), num_players)
+    except (TypeError, ValueError):
+        ice_print_group_name(group_name, "Invalid schedule, playing random moves:", schedule_id)
+        return None
+    ice_print_group_name(group_name, "Playing schedule", schedule_id)
+    return moves
+
+
 async def ws_recv_next_click(websocket, group_name):
     """
     Wait for the next button to be clicked in the browser
@@ -194,6 +361,13 @@ async def handler(websocket):
     if not success:
         return
 
+    # updates to the web client are batched between the points where we wait
+    ws = _WsBatch(websocket, enabled=BATCH_WS_MESSAGES, metrics=client.metrics)
+
+    if num_players == 2 and PIPELINE_2_PLAYER:
+        # overlap the processing of one player with receiving the frame of the other
+        client.start_reader()
+
     try:
         response_time_gun   = []    # response times of correct match for gun
         response_time_ai    = []    # response times of correct match for AI actions
@@ -203,27 +377,30 @@ async def handler(websocket):
         while client.is_running:
             # display the player location if 2-player game
             pos_1, pos_2 = client.current_positions()
-            await ws_send_positions(websocket, pos_1, pos_2)
+            await ws_send_positions(ws, pos_1, pos_2)
 
             # wait for the user the click next
+            await ws.flush()
             success = await ws_recv_next_click(websocket, group_name)
 
             # display the number of moves
-            await ws_send_num_move (websocket, client.current_move())
+            await ws_send_num_move (ws, client.current_move())
 
             # send action
             action_1, action_2 = client.current_actions()
-            await ws_send_actions(websocket, action_1, action_2)
+            await ws_send_actions(ws, action_1, action_2)
 
             if not success:
                 # The websocket is disconnected
                 break
             # wait to receive 2 jsons with timeout from eval_client
-            await ws_send_info(websocket, "------------")
+            await ws_send_info(ws, "------------")
             player_processed = -1   # variable to ensure we do not process a player twice
 
             timeout_remaining = client.timeout
             for _ in range (num_players):
+                # display the actions and the previous results before waiting for the eval client
+                await ws.flush()
                 action_match, player_id, message, action_recv, response_time, timeout_remaining = \
                     await client.handle_a_player(player_processed, timeout_remaining)
 
@@ -232,11 +409,11 @@ async def handler(websocket):
                 # update display based on received action
                 if action_match == 1:
                     # action mismatch
-                    await ws_send_info_y(websocket, message="Action received: " + action_recv)
+                    await ws_send_info_y(ws, message="Action received: " + action_recv)
 
                 if action_match == -1:
                     # error during processing
-                    await ws_send_error(websocket, message)
+                    await ws_send_error(ws, message)
                 else:
                     if action_match == 0:
                         # action matched
@@ -249,29 +426,41 @@ async def handler(websocket):
                             response_time_ai.append(response_time)
 
                     # display the difference in game states for both match amd mismatch
-                    await ws_send_action_update (websocket, action_match, player_id, message)
+                    await ws_send_action_update (ws, action_match, player_id, message)
 
                     # send the correct json back only if there is no error
                     await client.send_game_state()
             # move one step forward
             client.move_forward ()
 
-        await ws_send_num_move(websocket, "Eval Terminated")
-        await ws_send_info_y(websocket, "------------------- Stat -------------------")
+        await ws_send_num_move(ws, "Eval Terminated")
+        await ws_send_info_y(ws, "------------------- Stat -------------------")
 
         accuracy = str(num_actions_matched_gun)+"/"+str(client.num_actions_gun())
-        await send_stat(accuracy, "GUN", response_time_gun, websocket, client.timeout)
+        await send_stat(accuracy, "GUN", response_time_gun, ws, client.timeout)
 
         accuracy = str(num_actions_matched_ai)+"/"+str(client.num_actions_ai())
-        await send_stat(accuracy, "AI ", response_time_ai, websocket, client.timeout)
+        await send_stat(accuracy, "AI ", response_time_ai, ws, client.timeout)
+        await ws_send_info(ws, "Stage times (mean/p99 ms): " + client.metrics.summary())
+        await ws.flush()
 
     except Exception as e:
         ice_print_group_name(group_name, "handler:", e)
 
     # the client is disconnected
-    client = client_dict.pop(group_name)
+    client = unregister_group(group_name)
     client.stop()
 
+    # make sure all the queued log records reach the disk before the session ends
+    await client.logger_closed
+    ice_print_group_name(group_name, "log records:", client.logger.stats())
+    if client.delta_replies:
+        ice_print_group_name(group_name, "game state replies: full={} delta={}".format(
+            client.num_full_replies, client.num_delta_replies))
+    ice_print_group_name(group_name, "event loop lag:", loop_monitor.stats(), "decrypt/parse:", offload.stats())
+    ice_print_group_name(group_name, "stage times:", client.metrics.to_dict())
+    completed_metrics.merge(client.metrics)
+
 
 async def send_stat(accuracy, component, response_times, websocket, timeout):
     if len(response_times) == 0:
@@ -286,14 +475,48 @@ async def send_stat(accuracy, component, response_times, websocket, timeout):
     await ws_send_info(websocket, message)
 
 
-async def main():
+def metrics_snapshot():
+    """
+    the instrumentation of the server, served on METRICS_PORT
+    """
+    return {'pid':          os.getpid(),
+            'loop_lag':     loop_monitor.stats(),
+            'offload':      offload.stats(),
+            'acceptor':     shared_acceptor.stats() if shared_acceptor is not None else None,
+            'schedules':    {'loaded': len(schedules), 'cached': schedules.num_cached(),
+                             'generated': schedules.num_generated},
+            'completed':    completed_metrics.to_dict(),
+            'sessions':     {group_name: client.metrics.to_dict() for group_name, client in client_dict.items()}}
+
+
+async def main(host="", port=8001, metrics_port=METRICS_PORT, eval_port=SHARED_EVAL_PORT,
+               schedule_file=SCHEDULE_FILE):
+    global shared_acceptor
+    offload.configure(OFFLOAD_EXECUTOR, OFFLOAD_WORKERS, OFFLOAD_THRESHOLD)
+    if schedule_file:
+        schedules.load(schedule_file)
+        print ("{} move schedules loaded from {}".format(len(schedules), schedule_file))
+    if eval_port:
+        shared_acceptor = SharedAcceptor(eval_port, socket_options=SOCKET_OPTIONS if HIGH_PERF_NETWORK else None)
+        shared_acceptor.start()
+        print ("eval_clients of all the groups connect to port {}".format(eval_port))
+    if metrics_port:
+        try:
+            await serve_metrics(metrics_snapshot, "127.0.0.1", metrics_port)
+            loop_monitor.start()
+            print ("Metrics on http://127.0.0.1:{}/metrics".format(metrics_port))
+        except OSError as e:
+            # the instrumentation is optional, the evaluation runs without it
+            print ("Metrics disabled, could not listen on port {}: {}".format(metrics_port, e))
     print ("Waiting for new websocket client")
-    async with websockets.serve(handler, "", 8001):
+    async with websockets.serve(handler, host, port):
         await asyncio.Future()  # run forever
 
 
 if __name__ == "__main__":
     print ("running main")
+    if HIGH_PERF_NETWORK and install_uvloop():
+        print ("using uvloop")
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
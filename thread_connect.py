@@ -1,17 +1,14 @@
-from collections import deque
 from enum import Enum
-import struct
 import threading
 import time
 from bluepy.btle import BTLEDisconnectError, DefaultDelegate, Peripheral
-import anycrc
+from PacketBuffer import PacketRingBuffer
+from PacketCodec import IMU_SCALE, PACKET_SIZE, PacketCodec
 
 # Constants
 INITIAL_SEQ_NUM = 0
 ERROR_VALUE = -1
 BLE_TIMEOUT = 0.25
-PACKET_SIZE = 20
-PACKET_FORMAT = "=BH16sB"
 BITS_PER_BYTE = 8
 BLUNO_MAC_ADDR_LIST = [
     "f4:b8:5e:42:67:2b",
@@ -51,18 +48,16 @@ class BlePacketDelegate(DefaultDelegate):
         super().__init__()
         self.dataBuffer = dataBuffer
         self.serial_char = serial_char
+        self.fragmentCount = 0
 
     # Bluno Beetle uses cHandle 37
     def handleNotification(self, cHandle, data):
         try:
-            # Add incoming bytes to receive buffer
+            # Add incoming bytes to receive buffer, the bytes before a header byte are dropped by the buffer
+            self.dataBuffer.write(data)
             if len(data) < PACKET_SIZE:
-                self.mPrint(bcolors.WARNING, "Fragmented packet received")
-            for dataByte in data:
-                if self.isHeaderByte(dataByte) or len(self.dataBuffer) > 0:
-                    self.dataBuffer.append(dataByte)
-                else:
-                    print("Dropping byte {}".format(dataByte))
+                # Fragments are reassembled by the buffer
+                self.fragmentCount += 1
         except Exception as err:
             print(err)
     
@@ -77,7 +72,9 @@ class Beetle(threading.Thread):
         self.mBeetle = Peripheral()
         self.color = color
         # Runtime variables
-        self.mDataBuffer = deque()
+        self.codec = PacketCodec()
+        self.mDataBuffer = PacketRingBuffer(PACKET_SIZE, isValidPacket = self.isValidPacket,
+                                            headerBytes = range(PacketType.HELLO.value, PacketType.GAME_STAT.value + 1))
         self.hasHandshake = False
         self.hasSentHello = False
         self.seq_num = 0
@@ -88,7 +85,8 @@ class Beetle(threading.Thread):
         self.mService = None
         self.serial_char = None
         # Configure Peripheral
-        self.mBeetle.withDelegate(BlePacketDelegate(self.serial_char, self.mDataBuffer))
+        self.mDelegate = BlePacketDelegate(self.serial_char, self.mDataBuffer)
+        self.mBeetle.withDelegate(self.mDelegate)
 
     def connect(self):
         if not self.terminateEvent.is_set():
@@ -121,7 +119,10 @@ class Beetle(threading.Thread):
 
     def quit(self):
         self.mPrint(bcolors.WARNING, "Quitting {}".format(self.beetle_mac_addr))
-        self.mPrint(bcolors.OKCYAN, "{}: {} fragmented packets".format(self.beetle_mac_addr, self.fragmentedCount))
+        self.mPrint(bcolors.OKCYAN, "{}: {} fragmented packets, {} fragments received".format(
+            self.beetle_mac_addr, self.fragmentedCount, self.mDelegate.fragmentCount))
+        self.mPrint(bcolors.OKCYAN, "{}: {} dropped bytes, {} invalid packets".format(
+            self.beetle_mac_addr, self.mDataBuffer.droppedBytes, self.mDataBuffer.invalidPackets))
         self.terminateEvent.set()
 
     def mPrint2(self, inputString):
@@ -147,25 +148,9 @@ class Beetle(threading.Thread):
                     if len(self.mDataBuffer) < PACKET_SIZE:
                         self.fragmentedCount += 1
                     mRecvTime = time.time()
-                    # bytearray for 20-byte packet
-                    packetBytes = self.checkReceiveBuffer(self.mDataBuffer)
-                    # Parse packet from 20-byte
-                    packet_id, seq_num, data = self.parsePacket(packetBytes)
-                    if data and (len(data) > 0):
-                        if not self.hasHandshake:
-                            # Send SYN+ACK
-                            if packet_id == PacketType.ACK.value:
-                                self.sendAck(seq_num, self.serial_char)
-
-                                self.rawdata_queue.put(data)
-                                
-                                # BUG: If Beetle never received the SYN+ACK sent above, laptop
-                                #   one-sided-ly thinks it completed handshake but Beetle is still waiting
-                                #   Consider letting the Beetle signal that the handshake failed
-                                self.hasHandshake = True
-                        else:
-                            if packet_id != PacketType.ACK.value:
-                                self.sendAck(seq_num, self.serial_char)
+                    # Handle every complete 20-byte packet received so far
+                    for packetBytes in self.mDataBuffer.packets():
+                        self.handlePacket(packetBytes)
             
             except Exception as err:
                 print(err)
@@ -173,6 +158,29 @@ class Beetle(threading.Thread):
                 self.main()
         self.disconnect()
 
+    def handlePacket(self, packetBytes):
+        # Copy the packet out of the receive buffer first: sendAck can deliver notifications re-entrantly
+        # (bluepy), which write into the buffer while the memoryview of this packet is still in use
+        packetBytes = bytes(packetBytes)
+        # Parse packet from 20-byte
+        packet_id, seq_num, data = self.parsePacket(packetBytes)
+        if data and (len(data) > 0):
+            if not self.hasHandshake:
+                # Send SYN+ACK
+                if packet_id == PacketType.ACK.value:
+                    self.sendAck(seq_num, self.serial_char)
+
+                    # BUG: If Beetle never received the SYN+ACK sent above, laptop
+                    #   one-sided-ly thinks it completed handshake but Beetle is still waiting
+                    #   Consider letting the Beetle signal that the handshake failed
+                    self.hasHandshake = True
+            else:
+                if packet_id != PacketType.ACK.value:
+                    self.sendAck(seq_num, self.serial_char)
+                if packet_id == PacketType.P1_IMU.value or packet_id == PacketType.P2_IMU.value:
+                    # IMU packets are decoded in batches and windowed by ImuWindowStage
+                    self.ble_to_data_queue.put(packetBytes)
+
     def run(self):
         self.connect()
         self.main()
@@ -181,64 +189,42 @@ class Beetle(threading.Thread):
         return dataByte <= PacketType.GAME_STAT.value and dataByte >= PacketType.HELLO.value
     
     def isValidPacket(self, dataPacket):
-        return True
+        # Header byte and CRC, the receive buffer resynchronizes on the next header byte otherwise
+        return self.codec.isValid(dataPacket)
 
     def checkReceiveBuffer(self, receiveBuffer):
-        if len(receiveBuffer) >= PACKET_SIZE:
-            # bytearray for 20-byte packet
-            dataPacket = bytearray()
-            # Read 20 bytes from input buffer
-            for i in range(0, PACKET_SIZE):
-                dataPacket.append(receiveBuffer.popleft())
-            if self.isValidPacket(dataPacket):
-                return dataPacket
-            return bytearray()
-        else:
+        # memoryview of the next valid 20-byte packet, only valid until the next notification
+        dataPacket = receiveBuffer.readPacket()
+        if dataPacket is None:
             return bytearray()
+        return dataPacket
         
     def createPacket(self, packet_id, seq_num, data):
-        # TODO: Avoid hardcoding this value
-        data_length = 16
-        if (len(data) < data_length):
-            data = self.addPaddingBytes(data, data_length)
-        dataCrc = self.getCrcOf(packet_id, seq_num, data)
-        packet = struct.pack(PACKET_FORMAT, packet_id, seq_num, data, dataCrc)
-        return packet
+        # Data padded to DATA_SIZE bytes, see PacketCodec
+        return self.codec.encode(packet_id, seq_num, data)
 
-    def getCrcOf(self, packet_id, seq_num, data):
-        crc8 = anycrc.Model('CRC8-SMBUS')
-        crc8.update(packet_id.to_bytes())
-        crc8.update(seq_num.to_bytes(length = 2, byteorder = 'little'))
-        dataCrc = crc8.update(data)
-        return dataCrc
-    
     def getPacketFrom(self, packetBytes):
-        packet_id, seq_num, data, dataCrc = struct.unpack(PACKET_FORMAT, packetBytes)
+        packet_id, seq_num, data, dataCrc = self.codec.decode(packetBytes)
         return packet_id, seq_num, data, dataCrc
     
     def parseData(self, byte1, byte2):
-        return int.from_bytes(byte1, byteorder='little') + (int.from_bytes(byte2, byteorder='little') << BITS_PER_BYTE) / 100.0
+        # Signed little-endian 16-bit fixed-point value with 2 decimals, byte1 is the low byte
+        value = int.from_bytes(bytes((byte1, byte2)), byteorder='little', signed=True)
+        return value / IMU_SCALE
 
     def getDataFrom(self, dataBytes):
-        x1 = self.parseData(dataBytes[0], dataBytes[1])
-        y1 = self.parseData(dataBytes[2], dataBytes[3])
-        z1 = self.parseData(dataBytes[4], dataBytes[5])
-        x2 = self.parseData(dataBytes[6], dataBytes[7])
-        y2 = self.parseData(dataBytes[8], dataBytes[9])
-        z2 = self.parseData(dataBytes[10], dataBytes[11])
-        return x1, y1, z1, x2, y2, z2
+        # x1, y1, z1, x2, y2, z2 of one IMU packet, ImuDecoder decodes batches of packets at once
+        return self.codec.decodeImu(dataBytes)
         
     def parsePacket(self, packetBytes):
         # Check for NULL packet or incomplete packet
         if not packetBytes or len(packetBytes) < PACKET_SIZE:
             return ERROR_VALUE, ERROR_VALUE, None
         #print("{}{} has New packet: {}{}".format(bcolors.OKGREEN, self.beetle_mac_addr, packetBytes, bcolors.ENDC))
-        self.mPrint2(inputString = "{} has new packet: {}".format(self.beetle_mac_addr, packetBytes))
+        self.mPrint2(inputString = "{} has new packet: {}".format(self.beetle_mac_addr, bytes(packetBytes)))
         # packet_id = packetBytes[0]
+        # the CRC was checked by the receive buffer (isValidPacket)
         packet_id, seq_num, data, dataCrc = self.getPacketFrom(packetBytes)
-        computedCrc = self.getCrcOf(packet_id, seq_num, data)
-        if dataCrc != computedCrc:
-            print("CRC8 not match: received {} but expected {}".format(dataCrc, computedCrc))
         """ if packet_id == PacketType.P1_IMU.value or packet_id == PacketType.P2_IMU.value:
             #self.mPrint(bcolors.OKGREEN, "IMU data: [{}, {}, {}], [{}, {}, {}]".format(data[0:1]))
             print(struct.unpack('H', bytearray(data[0:1])))
@@ -259,10 +245,7 @@ class Beetle(threading.Thread):
 
     def addPaddingBytes(self, data, target_len):
         num_padding_bytes = target_len - len(data)
-        result = bytearray(data)
-        for i in range(0, num_padding_bytes):
-            result.append(num_padding_bytes)
-        return result
+        return bytes(data) + bytes([num_padding_bytes]) * num_padding_bytes
 
 if __name__=="__main__":
     beetles = []